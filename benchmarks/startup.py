@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures the wall time of cold ``bqdm --help`` runs.
+
+Each run starts a fresh interpreter, so the time includes the imports of the CLI.
+
+    python benchmarks/startup.py [RUNS]
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import subprocess
+import sys
+import time
+
+
+def main(runs=20):
+    command = [sys.executable, '-c', 'from bqdm.cli import cli; cli.main(["--help"])']
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.call(command, stdout=devnull)
+            timings.append(time.time() - start)
+    timings.sort()
+    print('bqdm --help: {0} runs, min {1:.3f}s, median {2:.3f}s, max {3:.3f}s'.format(
+        runs, timings[0], timings[len(timings) // 2], timings[-1]))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -5,14 +5,19 @@ import codecs
 import logging
 import os
 import sys
+import threading
 
 from future.utils import iteritems
-from google.cloud import bigquery
-from google.cloud.exceptions import NotFound
-from google.oauth2 import service_account
+from google.cloud.bigquery.dataset import Dataset
+from google.cloud.bigquery.job import QueryJob
+from googleapiclient.errors import HttpError
 
-from bqdm.model.dataset import BigQueryDataset
-from bqdm.util import (dump, echo, echo_dump, echo_ndiff)
+from bqdm.api import ApiCaller
+from bqdm.model.dataset import (DATASET_RESOURCE_FIELDS, MANAGED_LABEL_FILTER, MANAGED_LABEL_KEY,
+                                MANAGED_LABEL_VALUE, BigQueryDataset)
+from bqdm.profiler import phase
+from bqdm.util import (chunks, dump, echo, echo_dump, echo_ndiff, estimate_throughput,
+                       get_api_client, get_client, list_all)
 
 _logger = logging.getLogger(__name__)
 _logger.addHandler(logging.StreamHandler(sys.stdout))
@@ -22,61 +27,159 @@ _logger.setLevel(logging.INFO)
 class DatasetAction(object):
 
     def __init__(self, executor, project=None, credential_file=None,
-                 no_color=False, debug=False):
+                 no_color=False, debug=False, batch_size=50, api_caller=None):
         self._executor = executor
-        credentials = None
-        if credential_file:
-            credentials = service_account.Credentials.from_service_account_file(credential_file)
-        self._client = bigquery.Client(project, credentials)
+        self._caller = api_caller if api_caller else ApiCaller()
+        self._credential_file = credential_file
+        self._client = get_client(project, credential_file)
+        self._batch_size = batch_size
+        self._job_throughput = None
+        self._job_throughput_lock = threading.Lock()
         self.no_color = no_color
         if debug:
             _logger.setLevel(logging.DEBUG)
 
+    @property
+    def project(self):
+        return self._client.project
+
+    @property
+    def _api_client(self):
+        return get_api_client(self._credential_file)
+
     @staticmethod
+    @phase('diff')
     def get_add_datasets(source, target):
         dataset_ids = set(t.dataset_id for t in target) - set(s.dataset_id for s in source)
         results = [t for t in target if t.dataset_id in dataset_ids]
         return len(results), tuple(results)
 
     @staticmethod
+    @phase('diff')
     def get_change_datasets(source, target):
         _, add_datasets = DatasetAction.get_add_datasets(source, target)
         results = (set(target) - set(add_datasets)) - set(source)
         return len(results), tuple(results)
 
     @staticmethod
+    @phase('diff')
+    def get_change_fields(source_model, target_model):
+        """Returns the fields of the dataset to update, the ones differing from the source.
+
+        The labels are also updated to label the dataset as managed."""
+        fields = [f for f in ['friendly_name', 'description', 'default_table_expiration_ms']
+                  if getattr(source_model, f) != getattr(target_model, f)]
+        if (source_model.labels or dict()) != (target_model.labels or dict()) or \
+                not source_model.managed:
+            fields.append('labels')
+        if frozenset(source_model.access_entries or ()) != \
+                frozenset(target_model.access_entries or ()):
+            fields.append('access_entries')
+        return fields
+
+    @staticmethod
+    @phase('diff')
     def get_destroy_datasets(source, target):
         dataset_ids = set(s.dataset_id for s in source) - set(t.dataset_id for t in target)
         results = [s for s in source if s.dataset_id in dataset_ids]
         return len(results), tuple(results)
 
     @staticmethod
+    @phase('diff')
     def get_intersection_datasets(source, target):
         dataset_ids = set(s.dataset_id for s in source) & set(t.dataset_id for t in target)
         results = [s for s in source if s.dataset_id in dataset_ids]
         return len(results), tuple(results)
 
+    @staticmethod
+    @phase('convert')
+    def _to_model(dataset):
+        return BigQueryDataset.from_dataset(dataset)
+
+    def _get_dataset_request(self, dataset_id):
+        # The discovery client requests gzip-compressed responses.
+        return self._api_client.datasets().get(
+            projectId=self._client.project,
+            datasetId=dataset_id,
+            fields=DATASET_RESOURCE_FIELDS)
+
+    @phase('refresh')
     def get_dataset(self, dataset_id):
-        dataset_ref = self._client.dataset(dataset_id)
         dataset = None
         try:
-            dataset = self._client.get_dataset(dataset_ref)
+            dataset = Dataset.from_api_repr(self._caller.read(
+                self._get_dataset_request(dataset_id).execute))
             echo('Load dataset: ' + dataset.path)
-            dataset = BigQueryDataset.from_dataset(dataset)
-        except NotFound:
+            dataset = self._to_model(dataset)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
             _logger.info('Dataset {0} is not found.'.format(dataset_id))
         return dataset
 
-    def _list_datasets(self, include_datasets=(), exclude_datasets=()):
+    @phase('refresh')
+    def get_datasets(self, dataset_ids):
+        datasets = [None] * len(dataset_ids)
+
+        def callback(index, response, exception):
+            if exception:
+                if not isinstance(exception, HttpError) or exception.resp.status != 404:
+                    raise exception
+                _logger.info('Dataset {0} is not found.'.format(dataset_ids[index]))
+            else:
+                dataset = Dataset.from_api_repr(response)
+                echo('Load dataset: ' + dataset.path)
+                datasets[index] = self._to_model(dataset)
+
+        requests = [self._get_dataset_request(dataset_id) for dataset_id in dataset_ids]
+        self._caller.read_batch(self._api_client, requests, callback)
+        return tuple(datasets)
+
+    @phase('refresh')
+    def _list_datasets(self, include_datasets=(), exclude_datasets=(),
+                       managed_only=False, local_datasets=(), shard=None):
         if not include_datasets:
-            include_datasets = [d.dataset_id for d in self._client.list_datasets()]
-        return tuple(set(include_datasets) - set(exclude_datasets))
+            if managed_only:
+                # Only datasets labelled by apply, plus the ones defined locally
+                # that may not have been labelled yet.
+                include_datasets = [d.dataset_id for d in self._caller.read(
+                    list_all(self._client.list_datasets), filter=MANAGED_LABEL_FILTER,
+                    retry=None)]
+                include_datasets.extend(local_datasets)
+            else:
+                include_datasets = [d.dataset_id for d in self._caller.read(
+                    list_all(self._client.list_datasets), retry=None)]
+        return tuple(d for d in set(include_datasets) - set(exclude_datasets)
+                     if not shard or shard.owns(d))
 
-    def list_datasets(self, include_datasets=(), exclude_datasets=()):
-        fs = [self._executor.submit(self.get_dataset, d)
-              for d in self._list_datasets(include_datasets, exclude_datasets)]
+    def list_datasets(self, include_datasets=(), exclude_datasets=(),
+                      managed_only=False, local_datasets=(), shard=None):
+        fs = [self._executor.submit(self.get_datasets, dataset_ids)
+              for dataset_ids in chunks(self._list_datasets(include_datasets, exclude_datasets,
+                                                            managed_only, local_datasets,
+                                                            shard),
+                                        self._batch_size)]
         return fs
 
+    def get_job_throughput(self, max_results=200):
+        """Returns the bytes processed per second by the recent query jobs of the project,
+        or None if unknown.
+
+        The jobs are listed on the first call only, the jobs that cannot be listed,
+        for example without the permission, leave the throughput unknown."""
+        with self._job_throughput_lock:
+            if self._job_throughput is None:
+                try:
+                    jobs = self._caller.read(list_all(self._client.list_jobs),
+                                             max_results=max_results, state_filter='done',
+                                             retry=None)
+                    self._job_throughput = (
+                        estimate_throughput(j for j in jobs if isinstance(j, QueryJob)), )
+                except Exception as e:
+                    _logger.info('Failed to list the jobs to estimate the duration: {0}'.format(e))
+                    self._job_throughput = (None, )
+            return self._job_throughput[0]
+
     def _export(self, output_dir, dataset_id):
         dataset = self.get_dataset(dataset_id)
         if dataset:
@@ -88,23 +191,29 @@ class DatasetAction(object):
                 f.write(data)
         return dataset
 
-    def export(self, output_dir, include_datasets=(), exclude_datasets=()):
+    def export(self, output_dir, include_datasets=(), exclude_datasets=(), managed_only=False):
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-        datasets = self._list_datasets(include_datasets, exclude_datasets)
+        datasets = self._list_datasets(include_datasets, exclude_datasets, managed_only)
         fs = [self._executor.submit(self._export, output_dir, d)
               for d in datasets]
         return fs
 
+    @staticmethod
+    def _mark_managed(dataset):
+        labels = dataset.labels.copy()
+        labels[MANAGED_LABEL_KEY] = MANAGED_LABEL_VALUE
+        dataset.labels = labels
+
+    @phase('apply')
     def _add(self, model, prefix='  ', fg='green'):
         dataset = BigQueryDataset.to_dataset(self._client.project, model)
         echo('Adding... {0}'.format(dataset.path),
              prefix=prefix, fg=fg, no_color=self.no_color)
         echo_dump(model, prefix=prefix + '  ', fg=fg, no_color=self.no_color)
-        self._client.create_dataset(dataset)
-        self._client.update_dataset(dataset, [
-            'access_entries'
-        ])
+        self._mark_managed(dataset)
+        # The access entries are sent with the dataset resource on creation.
+        self._caller.create(dataset.path, self._client.create_dataset, dataset)
         echo()
 
     def plan_add(self, source, target, prefix='  ', fg='green'):
@@ -120,9 +229,11 @@ class DatasetAction(object):
     def add(self, source, target, prefix='  ', fg='green'):
         count, datasets = self.get_add_datasets(source, target)
         _logger.debug('Add datasets: {0}'.format(datasets))
-        fs = [self._executor.submit(self._add, d, prefix, fg) for d in datasets]
+        fs = {self._caller.submit(self._executor, self._client.dataset(d.dataset_id).path,
+                                  self._add, d, prefix, fg): d.dataset_id for d in datasets}
         return count, fs
 
+    @phase('apply')
     def _change(self, source_model, target_model, prefix='  ', fg='yellow'):
         dataset = BigQueryDataset.to_dataset(self._client.project, target_model)
         echo('Changing... {0}'.format(dataset.path),
@@ -135,13 +246,13 @@ class DatasetAction(object):
                 if k not in labels.keys():
                     labels[k] = None
             dataset.labels = labels
-        self._client.update_dataset(dataset, [
-            'friendly_name',
-            'description',
-            'default_table_expiration_ms',
-            'labels',
-            'access_entries'
-        ])
+        self._mark_managed(dataset)
+        # Only the changed fields are sent, a large access list is not sent again
+        # when only a label is changed.
+        fields = self.get_change_fields(source_model, target_model)
+        if fields:
+            self._caller.write(dataset.path, self._client.update_dataset, dataset, fields,
+                               retry=None)
         echo()
 
     def plan_change(self, source, target, prefix='  ', fg='yellow'):
@@ -158,16 +269,19 @@ class DatasetAction(object):
     def change(self, source, target, prefix='  ', fg='yellow'):
         count, datasets = self.get_change_datasets(source, target)
         _logger.debug('Change datasets: {0}'.format(datasets))
-        fs = [self._executor.submit(
+        fs = {self._caller.submit(
+            self._executor, self._client.dataset(d.dataset_id).path,
             self._change, next((s for s in source if s.dataset_id == d.dataset_id), None),
-            d, prefix, fg) for d in datasets]
+            d, prefix, fg): d.dataset_id for d in datasets}
         return count, fs
 
+    @phase('apply')
     def _destroy(self, model, prefix='  ', fg='red'):
         datasetted = BigQueryDataset.to_dataset(self._client.project, model)
         echo('Destroying... {0}'.format(datasetted.path),
              prefix=prefix, fg=fg, no_color=self.no_color)
-        self._client.delete_dataset(datasetted)
+        self._caller.delete(datasetted.path, self._client.delete_dataset, datasetted,
+                            retry=None)
         echo()
 
     def plan_destroy(self, source, target, prefix='  ', fg='red'):
@@ -182,7 +296,8 @@ class DatasetAction(object):
     def destroy(self, source, target):
         count, datasets = self.get_destroy_datasets(source, target)
         _logger.debug('Destroy datasets: {0}'.format(datasets))
-        fs = [self._executor.submit(self._destroy, d) for d in datasets]
+        fs = {self._caller.submit(self._executor, self._client.dataset(d.dataset_id).path,
+                                  self._destroy, d): d.dataset_id for d in datasets}
         return count, fs
 
     def plan_intersection_destroy(self, source, target, prefix='  ', fg='red'):
@@ -197,5 +312,6 @@ class DatasetAction(object):
     def intersection_destroy(self, source, target, prefix='  ', fg='red'):
         count, datasets = self.get_intersection_datasets(target, source)
         _logger.debug('Destroy datasets: {0}'.format(datasets))
-        fs = [self._executor.submit(self._destroy, d, prefix, fg) for d in datasets]
+        fs = {self._caller.submit(self._executor, self._client.dataset(d.dataset_id).path,
+                                  self._destroy, d, prefix, fg): d.dataset_id for d in datasets}
         return count, fs
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from enum import Enum
+
+
+class SchemaMigrationMode(Enum):
+
+    SELECT_INSERT = 'select_insert'
+    SELECT_INSERT_BACKUP = 'select_insert_backup'
+    REPLACE = 'replace'
+    REPLACE_BACKUP = 'replace_backup'
+    DROP_CREATE = 'drop_create'
+    DROP_CREATE_BACKUP = 'drop_create_backup'
+
+
+class BackupType(Enum):
+
+    COPY = 'copy'
+    SNAPSHOT = 'snapshot'
+
+
+class JobPriority(Enum):
+
+    INTERACTIVE = 'interactive'
+    BATCH = 'batch'
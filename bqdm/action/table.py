@@ -5,50 +5,56 @@ import codecs
 import copy
 import logging
 import os
+import re
 import sys
+import threading
+import time
 import uuid
-from datetime import datetime
-from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-import googleapiclient.discovery
 from future.utils import iteritems
-from google.cloud import bigquery
 from google.cloud.bigquery.job import (CopyJobConfig, CreateDisposition, QueryJobConfig,
-                                       WriteDisposition)
-from google.cloud.exceptions import NotFound
-from google.oauth2 import service_account
-
+                                       QueryPriority, WriteDisposition)
+from google.cloud.bigquery.table import Table
+from google.cloud.exceptions import BadRequest, Conflict, Forbidden, NotFound
+from googleapiclient.errors import HttpError
+
+from bqdm.action.enums import BackupType, JobPriority, SchemaMigrationMode
+from bqdm.api import ApiCaller
+from bqdm.journal import Journal
 from bqdm.model.schema import BigQuerySchemaField
-from bqdm.model.table import BigQueryTable
-from bqdm.util import (dump, echo, echo_dump, echo_ndiff)
+from bqdm.model.table import TABLE_RESOURCE_FIELDS, BigQueryTable
+from bqdm.profiler import phase
+from bqdm.scheduler import JobScheduler
+from bqdm.tracing import TRACER, job_attributes
+from bqdm.util import (Timings, as_completed, chunks, dump, echo, echo_dump, echo_ndiff,
+                       format_estimate, get_api_client, get_client, list_all, make_job_id,
+                       make_job_labels)
 
 _logger = logging.getLogger(__name__)
 _logger.addHandler(logging.StreamHandler(sys.stdout))
 _logger.setLevel(logging.INFO)
 
 
-class SchemaMigrationMode(Enum):
-
-    SELECT_INSERT = 'select_insert'
-    SELECT_INSERT_BACKUP = 'select_insert_backup'
-    REPLACE = 'replace'
-    REPLACE_BACKUP = 'replace_backup'
-    DROP_CREATE = 'drop_create'
-    DROP_CREATE_BACKUP = 'drop_create_backup'
-
-
 class TableAction(object):
 
     def __init__(self, executor, dataset_id,
                  migration_mode=None, backup_dataset_id=None, project=None,
-                 credential_file=None, no_color=False, debug=False):
+                 credential_file=None, no_color=False, debug=False, batch_size=50,
+                 api_caller=None, journal=None, run_id=None, job_id_prefix='bqdm_',
+                 job_labels=None, backup_type=None, backup_expiration=None,
+                 partition_parallelism=8, maximum_bytes_billed=None, throughput=None,
+                 verify=False, timings=None, job_scheduler=None, priority=None,
+                 table_priorities=None, partition_executor=None):
         self._executor = executor
-        credentials = None
-        if credential_file:
-            credentials = service_account.Credentials.from_service_account_file(credential_file)
-        self._client = bigquery.Client(project, credentials)
-        self._api_client = googleapiclient.discovery.build('bigquery', 'v2',
-                                                           credentials=credentials)
+        self._journal = journal if journal else Journal()
+        self._run_id = run_id if run_id else str(uuid.uuid4())
+        self._job_id_prefix = job_id_prefix
+        self._job_labels = job_labels
+        self._caller = api_caller if api_caller else ApiCaller()
+        self._credential_file = credential_file
+        self._client = get_client(project, credential_file)
         self._dataset_ref = self._client.dataset(dataset_id)
         if backup_dataset_id:
             self._backup_dataset_ref = self._client.dataset(backup_dataset_id)
@@ -58,22 +64,42 @@ class TableAction(object):
             self._migration_mode = SchemaMigrationMode(migration_mode)
         else:
             self._migration_mode = SchemaMigrationMode.SELECT_INSERT
+        self._backup_type = BackupType(backup_type) if backup_type else BackupType.COPY
+        self._backup_expiration = backup_expiration
+        self._partition_parallelism = partition_parallelism
+        # Shared by the tables migrated at the same time, so that the number of threads
+        # migrating partitions is bounded by the run, not multiplied by the tables.
+        self._partition_executor = partition_executor
+        self._maximum_bytes_billed = maximum_bytes_billed
+        self._throughput = throughput
+        self._estimated_bytes = 0
+        self._verify = verify
+        self._timings = timings if timings else Timings()
+        self._job_scheduler = job_scheduler if job_scheduler else JobScheduler()
+        self._priority = JobPriority(priority) if priority else JobPriority.INTERACTIVE
+        self._table_priorities = dict(
+            (k, JobPriority(v)) for k, v in iteritems(table_priorities or dict()))
+        self._batch_size = batch_size
         self.no_color = no_color
         if debug:
             _logger.setLevel(logging.DEBUG)
 
+    @property
+    def _api_client(self):
+        return get_api_client(self._credential_file)
+
     @property
     def dataset_reference(self):
         return self._dataset_ref
 
     @property
     def dataset(self):
-        return self._client.get_dataset(self._dataset_ref)
+        return self._caller.read(self._client.get_dataset, self._dataset_ref, retry=None)
 
     @property
     def exists_dataset(self):
         try:
-            self._client.get_dataset(self._dataset_ref)
+            self._caller.read(self._client.get_dataset, self._dataset_ref, retry=None)
             return True
         except NotFound:
             return False
@@ -84,12 +110,13 @@ class TableAction(object):
 
     @property
     def backup_dataset(self):
-        return self._client.get_dataset(self._backup_dataset_ref)
+        return self._caller.read(self._client.get_dataset, self._backup_dataset_ref,
+                                 retry=None)
 
     @property
     def exists_backup_dataset(self):
         try:
-            self._client.get_dataset(self._backup_dataset_ref)
+            self._caller.read(self._client.get_dataset, self._backup_dataset_ref, retry=None)
             return True
         except NotFound:
             return False
@@ -98,90 +125,493 @@ class TableAction(object):
     def migration_mode(self):
         return self._migration_mode
 
+    @property
+    def estimated_bytes(self):
+        return self._estimated_bytes
+
+    def _resource_id(self, model):
+        return '{0}.{1}'.format(self._dataset_ref.dataset_id, model.table_id)
+
     @staticmethod
+    @phase('diff')
     def get_add_tables(source, target):
         table_ids = set(t.table_id for t in target) - set(s.table_id for s in source)
         results = [t for t in target if t.table_id in table_ids]
         return len(results), tuple(results)
 
     @staticmethod
+    @phase('diff')
     def get_change_tables(source, target):
         _, add_tables = TableAction.get_add_tables(source, target)
         results = (set(target) - set(add_tables)) - set(source)
         return len(results), tuple(results)
 
     @staticmethod
+    @phase('diff')
+    def get_change_fields(source_model, target_model):
+        """Returns the fields of the table to update, the ones differing from the source.
+
+        The schema is updated only if the change does not require migration."""
+        fields = [f for f in ['friendly_name', 'description', 'expires',
+                              'view_use_legacy_sql', 'view_query']
+                  if getattr(source_model, f) != getattr(target_model, f)]
+        if (source_model.labels or dict()) != (target_model.labels or dict()):
+            fields.append('labels')
+        if not TableAction.requires_migration(source_model, target_model) and \
+                target_model.schema != source_model.schema:
+            # Merge the schema description change into the same metadata update.
+            fields.append('schema')
+        return fields
+
+    @staticmethod
+    @phase('diff')
     def get_destroy_tables(source, target):
         table_ids = set(s.table_id for s in source) - set(t.table_id for t in target)
         results = [s for s in source if s.table_id in table_ids]
         return len(results), tuple(results)
 
+    def _step(self, run_id, resource, step, fn, ignore=(), **attrs):
+        record = self._journal.get(resource, step)
+        if record and record['state'] == Journal.DONE:
+            echo('    Skipping completed step... {0}'.format(step),
+                 fg='yellow', no_color=self.no_color)
+            return record['attrs']
+        resumed = record is not None
+        if resumed:
+            # Continues with the temporary table and job recorded at the beginning.
+            attrs = record['attrs']
+        self._journal.begin(resource, step, **attrs)
+        try:
+            fn(**attrs)
+        except ignore:
+            if not resumed:
+                raise
+        except Exception:
+            if 'job_id' in attrs:
+                # A failed job cannot be adopted, the next run submits a new one.
+                self._journal.begin(resource, step, **dict(attrs, job_id=self._job_id(
+                    run_id, resource, step, attrs['job_id'])))
+            raise
+        self._journal.done(resource, step, **attrs)
+        return attrs
+
+    def _job_id(self, run_id, resource, step, salt=''):
+        return make_job_id(self._job_id_prefix, run_id, resource, step, salt)
+
+    def _is_batch(self, table_id):
+        priority = self._table_priorities.get(
+            '{0}.{1}'.format(self._dataset_ref.dataset_id, table_id), self._priority)
+        return priority == JobPriority.BATCH
+
+    def _job_step(self, run_id, resource, step, fn, priority=0, batch=False):
+        labels = make_job_labels(self._job_labels, run_id, resource, step)
+
+        def run(job_id):
+            with TRACER.span(step, **{'bqdm.resource': resource,
+                                      'bqdm.job_id': job_id}) as span:
+                with self._job_scheduler.slot(priority, batch):
+                    job = fn(job_id=job_id, job_labels=labels)
+                self._job_scheduler.record(job)
+                if span is not None:
+                    span.set_attributes(job_attributes(job))
+
+        return self._step(run_id, resource, step, run,
+                          job_id=self._job_id(run_id, resource, step))
+
+    @staticmethod
+    def requires_migration(source_model, target_model):
+        return source_model.schema_exclude_description() != \
+            target_model.schema_exclude_description() or \
+            source_model.partitioning_type != target_model.partitioning_type
+
     def migrate(self, source_table, target_table, prefix='    ', fg='yellow'):
-        if self._migration_mode in [SchemaMigrationMode.SELECT_INSERT_BACKUP,
-                                    SchemaMigrationMode.REPLACE_BACKUP,
-                                    SchemaMigrationMode.DROP_CREATE_BACKUP]:
-            self.backup(source_table.table_id)
-
-        if self._migration_mode in [SchemaMigrationMode.SELECT_INSERT,
-                                    SchemaMigrationMode.SELECT_INSERT_BACKUP]:
-            query_field = TableAction.build_query_field(source_table.schema, target_table.schema)
-            self.select_insert(target_table.table_id, target_table.table_id, query_field)
-        elif self._migration_mode in [SchemaMigrationMode.REPLACE,
-                                      SchemaMigrationMode.REPLACE_BACKUP]:
-            tmp_table = self.create_temporary_table(target_table)
-            query_field = TableAction.build_query_field(source_table.schema, target_table.schema)
-            self.select_insert(source_table.table_id, tmp_table.table_id, query_field)
-            self._destroy(target_table, prefix, fg)
-            self._add(target_table, prefix, fg)
-            query_field = TableAction.build_query_field(target_table.schema, target_table.schema)
-            self.select_insert(tmp_table.table_id, target_table.table_id, query_field)
-            self._destroy(tmp_table, prefix, fg)
-        elif self._migration_mode in [SchemaMigrationMode.DROP_CREATE,
-                                      SchemaMigrationMode.DROP_CREATE_BACKUP]:
-            self._destroy(target_table, prefix, fg)
-            self._add(target_table, prefix, fg)
+        resource = self._resource_id(target_table)
+        record = self._journal.get(resource, 'migrate')
+        if record:
+            mode = SchemaMigrationMode(record['attrs']['mode'])
+            run_id = record['attrs']['run_id']
+        else:
+            mode, run_id = self._migration_mode, self._run_id
+        self._journal.begin(resource, 'migrate', mode=mode.value, run_id=run_id)
+        start = time.time()
+        verify = self._verify and mode not in [SchemaMigrationMode.DROP_CREATE,
+                                               SchemaMigrationMode.DROP_CREATE_BACKUP]
+        if verify:
+            record = self._journal.get(resource, 'row_counts')
+            if record:
+                expected = record['attrs']
+            else:
+                expected = self._step(run_id, resource, 'row_counts', lambda **counts: None,
+                                      **self.get_row_counts(target_table.table_id,
+                                                            source_table.partitioning_type))
+
+        # Larger tables are given job slots first.
+        priority = getattr(source_table, 'num_bytes', None) or 0
+        batch = self._is_batch(target_table.table_id)
+
+        def query_field(source_schema, target_schema):
+            assert source_schema is not None, \
+                'Source table of {0} not found.'.format(resource)
+            return TableAction.build_query_field(source_schema, target_schema)
+
+        if mode in [SchemaMigrationMode.SELECT_INSERT_BACKUP,
+                    SchemaMigrationMode.REPLACE_BACKUP,
+                    SchemaMigrationMode.DROP_CREATE_BACKUP]:
+            backup_table_id = self._step(
+                run_id, resource, 'backup_table', lambda backup_table_id: None,
+                backup_table_id=self._backup_table_id(target_table.table_id))['backup_table_id']
+            self._job_step(run_id, resource, 'backup',
+                           lambda **job: self.backup(target_table.table_id,
+                                                     backup_table_id=backup_table_id, **job),
+                           priority=priority)
+
+        source_schema = source_table.schema if source_table else None
+        if mode in [SchemaMigrationMode.SELECT_INSERT,
+                    SchemaMigrationMode.SELECT_INSERT_BACKUP]:
+            self._job_step(run_id, resource, 'select_insert',
+                           lambda **job: self.select_insert(
+                               target_table.table_id, target_table.table_id,
+                               query_field(source_schema, target_table.schema), **job),
+                           priority=priority, batch=batch)
+        elif mode in [SchemaMigrationMode.REPLACE,
+                      SchemaMigrationMode.REPLACE_BACKUP]:
+            tmp_table_id = self._step(
+                run_id, resource, 'create_temporary_table',
+                lambda tmp_table_id: self.create_temporary_table(target_table, tmp_table_id),
+                ignore=(Conflict, ),
+                tmp_table_id=str(uuid.uuid4()).replace('-', '_'))['tmp_table_id']
+            tmp_table = copy.deepcopy(target_table)
+            tmp_table.table_id = tmp_table_id
+            if self._is_day_partitioned(source_table, target_table):
+                self._step(run_id, resource, 'select_insert_temporary_table',
+                           lambda: self._select_insert_partitions(
+                               run_id, resource, 'select_insert_temporary_table',
+                               target_table.table_id, tmp_table_id,
+                               query_field(source_schema, target_table.schema), prefix, fg,
+                               priority, batch))
+            else:
+                self._job_step(run_id, resource, 'select_insert_temporary_table',
+                               lambda **job: self.select_insert(
+                                   target_table.table_id, tmp_table_id,
+                                   query_field(source_schema, target_table.schema), **job),
+                               priority=priority, batch=batch)
+            self._step(run_id, resource, 'destroy',
+                       lambda: self._destroy(target_table, prefix, fg), ignore=(NotFound, ))
+            self._step(run_id, resource, 'add',
+                       lambda: self._add(target_table, prefix, fg), ignore=(Conflict, ))
+            # The data is rewritten only once, copying back from the temporary table
+            # does not process any bytes.
+            self._job_step(run_id, resource, 'copy',
+                           lambda **job: self.copy(tmp_table_id, target_table.table_id, **job),
+                           priority=priority)
+            self._step(run_id, resource, 'destroy_temporary_table',
+                       lambda: self._destroy(tmp_table, prefix, fg), ignore=(NotFound, ))
+        elif mode in [SchemaMigrationMode.DROP_CREATE,
+                      SchemaMigrationMode.DROP_CREATE_BACKUP]:
+            self._step(run_id, resource, 'destroy',
+                       lambda: self._destroy(target_table, prefix, fg), ignore=(NotFound, ))
+            self._step(run_id, resource, 'add',
+                       lambda: self._add(target_table, prefix, fg), ignore=(Conflict, ))
         else:
             raise ValueError('Unknown migration mode.')
+        self._journal.finish(resource)
+        self._timings.add('migration', time.time() - start)
+
+        if verify:
+            start = time.time()
+            actual = self.get_row_counts(target_table.table_id, target_table.partitioning_type)
+            mismatches = self.compare_row_counts(expected, actual)
+            self._timings.add('verification', time.time() - start)
+            if mismatches:
+                raise RuntimeError('Verification of {0} failed: {1}'.format(
+                    resource, ', '.join(mismatches)))
+            echo('Verified... {0} rows'.format(actual['num_rows']),
+                 prefix=prefix, fg=fg, no_color=self.no_color)
 
-    def backup(self, source_table_id, prefix='    ', fg='yellow'):
-        source_table = self.dataset.table(source_table_id)
-        backup_table_id = 'backup_{source_table_id}_{timestamp}'.format(
+    def _get_row_count_request(self, table_id):
+        return self._api_client.tables().get(
+            projectId=self._dataset_ref.project,
+            datasetId=self._dataset_ref.dataset_id,
+            tableId=table_id,
+            fields='numRows')
+
+    def get_row_counts(self, table_id, partitioning_type=None):
+        """Returns the number of rows of the table and of each partition from the metadata.
+
+        Rows in the streaming buffer are not counted."""
+        response = self._caller.read(self._get_row_count_request(table_id).execute)
+        partitions = dict()
+        if partitioning_type == 'DAY':
+            partition_ids = [p for p in self.list_partitions(table_id) if re.match(r'^\d{8}$', p)]
+            for chunk in chunks(partition_ids, self._batch_size):
+                def callback(index, response, exception):
+                    if exception:
+                        raise exception
+                    partitions[chunk[index]] = int(response.get('numRows', 0))
+
+                requests = [self._get_row_count_request('{0}${1}'.format(table_id, p))
+                            for p in chunk]
+                self._caller.read_batch(self._api_client, requests, callback)
+        return {'num_rows': int(response.get('numRows', 0)), 'partitions': partitions}
+
+    @staticmethod
+    def compare_row_counts(expected, actual):
+        mismatches = []
+        if expected['num_rows'] != actual['num_rows']:
+            mismatches.append('numRows {0} != {1}'.format(
+                expected['num_rows'], actual['num_rows']))
+        if expected['partitions'] and actual['partitions']:
+            for partition_id in sorted(set(expected['partitions']) | set(actual['partitions'])):
+                expected_rows = expected['partitions'].get(partition_id, 0)
+                actual_rows = actual['partitions'].get(partition_id, 0)
+                if expected_rows != actual_rows:
+                    mismatches.append('partition {0} numRows {1} != {2}'.format(
+                        partition_id, expected_rows, actual_rows))
+        return mismatches
+
+    @phase('apply')
+    def _resume(self, target_model, prefix='  ', fg='yellow'):
+        echo('Resuming... {0}'.format(self._resource_id(target_model)),
+             prefix=prefix, fg=fg, no_color=self.no_color)
+        self.migrate(self.get_table(target_model.table_id), target_model)
+        echo()
+
+    def resume(self, target):
+        """Continues the migrations interrupted in the previous run."""
+        pending = set(self._journal.pending())
+        tables = [t for t in target if self._resource_id(t) in pending]
+        for resource in pending - set(self._resource_id(t) for t in tables):
+            if resource.split('.', 1)[0] == self._dataset_ref.dataset_id:
+                _logger.warning('Table {0} is not found in the configuration, '
+                                'skip resuming.'.format(resource))
+        _logger.debug('Resume tables: {0}'.format(tables))
+        fs = {self._executor.submit(self._resume, t): self._resource_id(t)
+              for t in tables}
+        return len(tables), fs
+
+    def _begin_job(self, destination, fn, *args, **kwargs):
+        # The job ID is fixed before submitting, so that a retried submission or a rerun
+        # whose job reached the server adopts the existing job instead of starting another.
+        job_id = kwargs.get('job_id', None) or str(uuid.uuid4())
+        kwargs['job_id'] = job_id
+        # The API calls are retried by the caller only.
+        kwargs['retry'] = None
+        try:
+            return self._caller.job(destination, fn, *args, **kwargs)
+        except Conflict:
+            job = self._caller.read(self._client.get_job, job_id, retry=None)
+            _logger.info('Job {0} already exists, state: {1}'.format(job_id, job.state))
+            self._check_adopted_job(job, destination,
+                                    args[0] if fn == self._client.query else None)
+            return job
+
+    @staticmethod
+    def _check_adopted_job(job, destination, query=None):
+        """Raises if the existing job of the ID does not do the work requested.
+
+        The job ID is derived from the run ID, the table and the step. A rerun with the
+        same run ID but without the journal writes to another temporary table, adopting
+        the job of the previous run would copy back a table never written."""
+        actual = job.destination.path if getattr(job, 'destination', None) else None
+        if actual != destination:
+            raise RuntimeError('Job {0} already exists and writes to {1} instead of {2}, '
+                               'run with another run ID.'.format(job.job_id, actual,
+                                                                 destination))
+        if query is not None and job.query != query:
+            raise RuntimeError('Job {0} already exists with another query, '
+                               'run with another run ID.'.format(job.job_id))
+
+    @staticmethod
+    def _backup_table_id(source_table_id):
+        return 'backup_{source_table_id}_{timestamp}'.format(
             source_table_id=source_table_id,
             timestamp=datetime.utcnow().strftime('%Y%m%d%H%M%S%f'))
+
+    def backup(self, source_table_id, prefix='    ', fg='yellow',
+               backup_table_id=None, job_id=None, job_labels=None):
+        source_table = self.dataset.table(source_table_id)
+        if not backup_table_id:
+            backup_table_id = self._backup_table_id(source_table_id)
         backup_table = self.backup_dataset.table(backup_table_id)
+        backup_type = self._backup_type
+        try:
+            job = self._begin_backup(source_table, backup_table, backup_type,
+                                     job_id, job_labels)
+        except (BadRequest, Forbidden) as e:
+            if backup_type != BackupType.SNAPSHOT:
+                raise
+            # Only a snapshot rejected on submission falls back, a snapshot job that
+            # ran and failed is raised like a copy job.
+            _logger.warning('Snapshot of {0} failed, fall back to copy: {1}'.format(
+                source_table.path, e))
+            backup_type = BackupType.COPY
+            job_id = '{0}_copy'.format(job_id) if job_id else None
+            job = self._begin_backup(source_table, backup_table, backup_type,
+                                     job_id, job_labels)
+        echo('Backing up ({0})... {1}'.format(backup_type.value, job.job_id),
+             prefix=prefix, fg=fg, no_color=self.no_color)
+        job.result()
+        assert job.state == 'DONE'
+        error_result = job.error_result
+        if error_result:
+            raise RuntimeError(job.errors)
+        return job
+
+    def _begin_backup(self, source_table, backup_table, backup_type, job_id, job_labels):
+        job_config = CopyJobConfig()
+        job_config.create_disposition = CreateDisposition.CREATE_IF_NEEDED
+        # The properties below are not supported by the job config of this client version.
+        # https://cloud.google.com/bigquery/docs/table-snapshots-create
+        if backup_type == BackupType.SNAPSHOT:
+            job_config._set_sub_prop('operationType', 'SNAPSHOT')
+        if self._backup_expiration:
+            expiration = datetime.utcnow() + timedelta(days=self._backup_expiration)
+            job_config._set_sub_prop('destinationExpirationTime',
+                                     expiration.strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
+        if job_labels:
+            job_config._properties['labels'] = job_labels
+        return self._begin_job(backup_table.path, self._client.copy_table,
+                               source_table, backup_table, job_config=job_config,
+                               job_id=job_id)
+
+    def copy(self, source_table_id, destination_table_id, prefix='    ', fg='yellow',
+             job_id=None, job_labels=None):
+        source_table = self.dataset.table(source_table_id)
+        destination_table = self.dataset.table(destination_table_id)
         job_config = CopyJobConfig()
         job_config.create_disposition = CreateDisposition.CREATE_IF_NEEDED
-        job = self._client.copy_table(source_table, backup_table, job_config=job_config)
-        echo('Backing up... {0}'.format(job.job_id),
+        job_config.write_disposition = WriteDisposition.WRITE_TRUNCATE
+        if job_labels:
+            job_config._properties['labels'] = job_labels
+        job = self._begin_job(destination_table.path, self._client.copy_table,
+                              source_table, destination_table, job_config=job_config,
+                              job_id=job_id)
+        echo('Copying... {0}'.format(job.job_id),
              prefix=prefix, fg=fg, no_color=self.no_color)
         job.result()
         assert job.state == 'DONE'
         error_result = job.error_result
         if error_result:
             raise RuntimeError(job.errors)
+        return job
 
-    def select_insert(self, source_table_id, destination_table_id, query_field,
-                      prefix='    ', fg='yellow'):
+    @staticmethod
+    def _is_day_partitioned(source_table, target_table):
+        return source_table is not None and \
+            source_table.partitioning_type == 'DAY' and target_table.partitioning_type == 'DAY'
+
+    def list_partitions(self, table_id):
+        return self._caller.read(self._client.list_partitions, self._dataset_ref.table(table_id),
+                                 retry=None)
+
+    def _select_insert_partitions(self, run_id, resource, step, source_table_id,
+                                  destination_table_id, query_field, prefix='    ', fg='yellow',
+                                  priority=0, batch=False):
+        partitions = self.list_partitions(source_table_id)
+        if not all(re.match(r'^\d{8}$', p) for p in partitions):
+            # Rows in the streaming buffer cannot be written to a partition decorator.
+            _logger.info('Table {0} has unpartitioned rows, migrate the whole table.'.format(
+                source_table_id))
+            # The step of the partitions is recorded by the caller, the job has its own.
+            self._job_step(run_id, resource, '{0}_whole'.format(step),
+                           lambda **job: self.select_insert(
+                               source_table_id, destination_table_id, query_field,
+                               prefix, fg, **job), priority=priority, batch=batch)
+            return
+
+        lock = threading.Lock()
+        progress = {'done': 0, 'total': len(partitions)}
+
+        def select_insert_partition(partition_id):
+            self._job_step(run_id, resource, '{0}${1}'.format(step, partition_id),
+                           lambda **job: self.select_insert(
+                               source_table_id, destination_table_id, query_field,
+                               prefix, fg, partition_id=partition_id, **job),
+                           priority=priority, batch=batch)
+            with lock:
+                progress['done'] += 1
+                echo('Inserted partitions... {0}/{1} ({2})'.format(
+                    progress['done'], progress['total'], partition_id),
+                    prefix=prefix, fg=fg, no_color=self.no_color)
+
+        def submit(executor):
+            # The partitions of the table share its quota of partition updates.
+            return [self._caller.submit(
+                executor, self._dataset_ref.table('{0}${1}'.format(destination_table_id, p)).path,
+                select_insert_partition, p) for p in partitions]
+
+        if self._partition_executor:
+            as_completed(submit(self._partition_executor))
+            return
+        with ThreadPoolExecutor(max_workers=self._partition_parallelism) as e:
+            as_completed(submit(e))
+
+    def _select_query(self, source_table_id, query_field, partition_id=None):
         query = 'SELECT {query_field} FROM {dataset_id}.{source_table_id}'.format(
             query_field=query_field,
             dataset_id=self._dataset_ref.dataset_id,
             source_table_id=source_table_id)
+        if partition_id:
+            query += " WHERE _PARTITIONTIME = TIMESTAMP('{0}-{1}-{2}')".format(
+                partition_id[:4], partition_id[4:6], partition_id[6:])
+        return query
+
+    def dry_run_select_insert(self, source_model, target_model):
+        """Returns the bytes processed by the migration query without running it."""
+        query_field = TableAction.build_query_field(source_model.schema, target_model.schema)
+        job_config = QueryJobConfig()
+        job_config.use_legacy_sql = False
+        job_config.use_query_cache = False
+        job_config.dry_run = True
+        job = self._caller.read(self._client.query,
+                                self._select_query(source_model.table_id, query_field),
+                                job_config=job_config, retry=None)
+        return job.total_bytes_processed or 0
+
+    def estimate_change(self, source, target):
+        """Returns the total bytes processed by the migration queries of the changes."""
+        if self._migration_mode in [SchemaMigrationMode.DROP_CREATE,
+                                    SchemaMigrationMode.DROP_CREATE_BACKUP]:
+            return 0
+        _, tables = self.get_change_tables(source, target)
+        fs = []
+        for table in tables:
+            source_table = next((s for s in source if s.table_id == table.table_id), None)
+            if self.requires_migration(source_table, table):
+                fs.append(self._executor.submit(self.dry_run_select_insert, source_table, table))
+        return sum(as_completed(fs))
+
+    def select_insert(self, source_table_id, destination_table_id, query_field,
+                      prefix='    ', fg='yellow', job_id=None, job_labels=None,
+                      partition_id=None):
+        query = self._select_query(source_table_id, query_field, partition_id)
+        if partition_id:
+            destination_table_id = '{0}${1}'.format(destination_table_id, partition_id)
         destination_table = self.dataset.table(destination_table_id)
         job_config = QueryJobConfig()
         job_config.use_legacy_sql = False
         job_config.use_query_cache = False
         job_config.write_disposition = WriteDisposition.WRITE_TRUNCATE
         job_config.destination = destination_table
-        job = self._client.query(query, job_config)
-        echo('Inserting... {0}'.format(job.job_id),
-             prefix=prefix, fg=fg, no_color=self.no_color)
-        echo('  {0}'.format(job.query),
-             prefix=prefix, fg=fg, no_color=self.no_color)
+        if self._maximum_bytes_billed is not None:
+            job_config.maximum_bytes_billed = self._maximum_bytes_billed
+        if self._is_batch(source_table_id):
+            job_config.priority = QueryPriority.BATCH
+        if job_labels:
+            job_config._properties['labels'] = job_labels
+        job = self._begin_job(destination_table.path, self._client.query,
+                              query, job_config=job_config, job_id=job_id)
+        if not partition_id:
+            echo('Inserting... {0}'.format(job.job_id),
+                 prefix=prefix, fg=fg, no_color=self.no_color)
+            echo('  {0}'.format(job.query),
+                 prefix=prefix, fg=fg, no_color=self.no_color)
         job.result()
         assert job.state == 'DONE'
         error_result = job.error_result
         if error_result:
             raise RuntimeError(job.errors)
+        return job
 
     @staticmethod
     def build_query_field(source_schema, target_schema, prefix=None):
@@ -213,47 +643,74 @@ class TableAction(object):
                     query_fields.append('null AS {alias}'.format(alias=target.name))
         return ', '.join(query_fields)
 
-    def update_schema_description(self, target_table):
-        request = self._api_client.tables().patch(
-            projectId=self._client.project,
-            datasetId=self.dataset.dataset_id,
-            tableId=target_table.table_id,
-            body={
-                'schema': target_table.schema_dict()
-            }
-        )
-        request.execute()
-
-    def create_temporary_table(self, model):
+    def create_temporary_table(self, model, tmp_table_id=None):
         tmp_table_model = copy.deepcopy(model)
-        tmp_table_id = str(uuid.uuid4()).replace('-', '_')
+        if not tmp_table_id:
+            tmp_table_id = str(uuid.uuid4()).replace('-', '_')
         tmp_table_model.table_id = tmp_table_id
         tmp_table = BigQueryTable.to_table(self._dataset_ref, tmp_table_model)
         echo('    Temporary table creating... {0}'.format(tmp_table.path),
              fg='yellow', no_color=self.no_color)
-        self._client.create_table(tmp_table)
+        self._caller.create(tmp_table.path, self._client.create_table, tmp_table)
         return tmp_table_model
 
+    @staticmethod
+    @phase('convert')
+    def _to_model(table):
+        return BigQueryTable.from_table(table)
+
+    def _get_table_request(self, table_id):
+        # The discovery client requests gzip-compressed responses.
+        return self._api_client.tables().get(
+            projectId=self._dataset_ref.project,
+            datasetId=self._dataset_ref.dataset_id,
+            tableId=table_id,
+            fields=TABLE_RESOURCE_FIELDS)
+
+    @phase('refresh')
     def get_table(self, table_id):
-        table_ref = self.dataset.table(table_id)
         table = None
         try:
-            table = self._client.get_table(table_ref)
+            table = Table.from_api_repr(self._caller.read(
+                self._get_table_request(table_id).execute))
             echo('Load table: ' + table.path)
-            table = BigQueryTable.from_table(table)
-        except NotFound:
+            table = self._to_model(table)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
             _logger.info('Table {0} is not found.'.format(table_id))
         return table
 
+    @phase('refresh')
+    def get_tables(self, table_ids):
+        tables = [None] * len(table_ids)
+
+        def callback(index, response, exception):
+            if exception:
+                if not isinstance(exception, HttpError) or exception.resp.status != 404:
+                    raise exception
+                _logger.info('Table {0} is not found.'.format(table_ids[index]))
+            else:
+                table = Table.from_api_repr(response)
+                echo('Load table: ' + table.path)
+                tables[index] = self._to_model(table)
+
+        requests = [self._get_table_request(table_id) for table_id in table_ids]
+        self._caller.read_batch(self._api_client, requests, callback)
+        return tuple(tables)
+
+    @phase('refresh')
     def _list_tables(self):
-        return self._client.list_tables(self.dataset)
+        return self._caller.read(list_all(self._client.list_tables), self._dataset_ref,
+                                 retry=None)
 
     def list_tables(self):
         if not self.exists_dataset:
             return []
 
-        fs = [self._executor.submit(self.get_table, t.table_id)
-              for t in self._client.list_tables(self.dataset)]
+        fs = [self._executor.submit(self.get_tables, table_ids)
+              for table_ids in chunks((t.table_id for t in self._list_tables()),
+                                      self._batch_size)]
         return fs
 
     def _export(self, output_dir, table_id):
@@ -280,12 +737,13 @@ class TableAction(object):
                 open(keep_file, 'a').close()
         return fs
 
+    @phase('apply')
     def _add(self, model, prefix='  ', fg='green'):
         table = BigQueryTable.to_table(self._dataset_ref, model)
         echo('Adding... {0}'.format(table.path),
              prefix=prefix, fg=fg, no_color=self.no_color)
         echo_dump(model, prefix=prefix + '  ', fg=fg, no_color=self.no_color)
-        self._client.create_table(table)
+        self._caller.create(table.path, self._client.create_table, table)
         echo()
 
     def plan_add(self, source, target, prefix='  ', fg='green'):
@@ -301,9 +759,12 @@ class TableAction(object):
     def add(self, source, target, prefix='  ', fg='yellow'):
         count, tables = self.get_add_tables(source, target)
         _logger.debug('Add tables: {0}'.format(tables))
-        fs = [self._executor.submit(self._add, t, prefix, fg) for t in tables]
+        fs = {self._caller.submit(self._executor, self._dataset_ref.table(t.table_id).path,
+                                  self._add, t, prefix, fg): self._resource_id(t)
+              for t in tables}
         return count, fs
 
+    @phase('apply')
     def _change(self, source_model, target_model, prefix='  ', fg='yellow'):
         table = BigQueryTable.to_table(self._dataset_ref, target_model)
         echo('Changing... {0}'.format(table.path),
@@ -321,48 +782,65 @@ class TableAction(object):
                 SchemaMigrationMode.SELECT_INSERT,
                 SchemaMigrationMode.SELECT_INSERT_BACKUP],\
                 'Migration mode: `{0}` not supported.'.format(self._migration_mode.value)
-        target_schema_exclude_description = target_model.schema_exclude_description()
-        source_schema_exclude_description = source_model.schema_exclude_description()
-        if target_schema_exclude_description != source_schema_exclude_description or \
-                target_model.partitioning_type != source_model.partitioning_type:
+        if self.requires_migration(source_model, target_model):
             self.migrate(source_model, target_model)
-        if target_schema_exclude_description == source_schema_exclude_description and \
-                target_model.schema != source_model.schema:
-            self.update_schema_description(target_model)
-        self._client.update_table(table, [
-            'friendly_name',
-            'description',
-            'expires',
-            'view_use_legacy_sql',
-            'view_query',
-            'labels',
-        ])
+        # Only the changed fields are sent, a large view query is not sent again
+        # when only a label is changed. Nothing is sent if only the migration is needed.
+        fields = self.get_change_fields(source_model, target_model)
+        if fields:
+            self._caller.write(table.path, self._client.update_table, table, fields, retry=None)
         echo()
 
     def plan_change(self, source, target, prefix='  ', fg='yellow'):
         count, tables = self.get_change_tables(source, target)
         _logger.debug('Change tables: {0}'.format(tables))
+        estimates = dict()
+        for table in tables:
+            source_table = next((s for s in source if s.table_id == table.table_id), None)
+            if self.requires_migration(source_table, table):
+                estimates[table.table_id] = self._executor.submit(
+                    self.dry_run_select_insert, source_table, table)
         for table in tables:
             echo('~ {0}'.format(table.table_id),
                  prefix=prefix, fg=fg, no_color=self.no_color)
             source_table = next((s for s in source if s.table_id == table.table_id), None)
             echo_ndiff(source_table, table, prefix=prefix + ' ', fg=fg)
+            if table.table_id in estimates:
+                estimated_bytes = estimates[table.table_id].result()
+                self._estimated_bytes += estimated_bytes
+                echo(format_estimate(estimated_bytes,
+                                     self._throughput() if self._throughput else None),
+                     prefix=prefix + '  ', fg=fg, no_color=self.no_color)
             echo()
         return count
 
+    def get_migration_tables(self, source, target):
+        """Returns the tables to migrate with their size, largest first."""
+        _, tables = self.get_change_tables(source, target)
+        results = []
+        for table in tables:
+            source_table = next((s for s in source if s.table_id == table.table_id), None)
+            if self.requires_migration(source_table, table):
+                results.append((self._resource_id(table), source_table.num_bytes or 0))
+        return sorted(results, key=lambda r: r[1], reverse=True)
+
     def change(self, source, target, prefix='  ', fg='yellow'):
         count, tables = self.get_change_tables(source, target)
         _logger.debug('Change tables: {0}'.format(tables))
-        fs = [self._executor.submit(
+        # Submits the largest tables first, so that their migrations are not started last.
+        tables = sorted(tables, key=lambda t: next(
+            (s.num_bytes or 0 for s in source if s.table_id == t.table_id), 0), reverse=True)
+        fs = {self._executor.submit(
             self._change, next((s for s in source if s.table_id == t.table_id), None),
-            t, prefix, fg) for t in tables]
+            t, prefix, fg): self._resource_id(t) for t in tables}
         return count, fs
 
+    @phase('apply')
     def _destroy(self, model, prefix='  ', fg='red'):
         table = BigQueryTable.to_table(self._dataset_ref, model)
         echo('Destroying... {0}'.format(table.path),
              prefix=prefix, fg=fg, no_color=self.no_color)
-        self._client.delete_table(table)
+        self._caller.delete(table.path, self._client.delete_table, table, retry=None)
         echo()
 
     def plan_destroy(self, source, target, prefix='  ', fg='red'):
@@ -377,5 +855,7 @@ class TableAction(object):
     def destroy(self, source, target, prefix='  ', fg='red'):
         count, tables = self.get_destroy_tables(source, target)
         _logger.debug('Destroy tables: {0}'.format(tables))
-        fs = [self._executor.submit(self._destroy, t, prefix, fg) for t in tables]
+        fs = {self._caller.submit(self._executor, self._dataset_ref.table(t.table_id).path,
+                                  self._destroy, t, prefix, fg): self._resource_id(t)
+              for t in tables}
         return count, fs
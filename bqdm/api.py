@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import functools
+import time
+
+from google.api_core.exceptions import Conflict, NotFound
+
+from bqdm.limiter import ConcurrencyLimiter, QuotaScheduler, is_rate_limit_error
+from bqdm.profiler import PROFILER, api_method_name
+from bqdm.retry import Retry, is_retryable_error
+from bqdm.tracing import SPAN_KIND_CLIENT, TRACER
+from bqdm.util import get_parallelism, with_captured_output
+
+
+def _resource_id(fn, args):
+    owner = getattr(fn, '__self__', None)
+    uri = getattr(owner, 'uri', None)
+    if uri:
+        # googleapiclient.http.HttpRequest
+        return uri.split('?', 1)[0]
+    for arg in args:
+        path = getattr(arg, 'path', None)
+        if isinstance(path, str):
+            return path
+    return None
+
+
+def _result_attributes(result):
+    if isinstance(result, dict):
+        return {'bqdm.bytes': int(result['numBytes']) if 'numBytes' in result else None}
+    return {
+        'bqdm.bytes': getattr(result, 'num_bytes', None) or
+        getattr(result, 'total_bytes_processed', None),
+        'bqdm.job_id': getattr(result, 'job_id', None),
+    }
+
+
+class ApiCaller(object):
+    """Runs BigQuery API calls under the concurrency limit of their kind.
+
+    Writes and job submissions are also delayed to stay within the update quota
+    of the resource they modify, and transient errors are retried. The calls of the client
+    library are made with ``retry=None``, so that its own retry does not hide the errors
+    from the retry policy and the limits. A single instance is shared by all actions of a run."""
+
+    def __init__(self, parallelism=None, retry=None):
+        self._limiter = ConcurrencyLimiter(parallelism if parallelism else get_parallelism())
+        self._quota = QuotaScheduler()
+        self._retry = retry if retry else Retry()
+
+    @property
+    def retry(self):
+        return self._retry
+
+    def limit(self, kind):
+        return self._limiter[kind].limit
+
+    def _call(self, kind, resource, fn, *args, **kwargs):
+        if resource:
+            self._quota.acquire(resource)
+        limiter = self._limiter[kind]
+        limiter.acquire()
+        span = TRACER.current()
+        if span is not None:
+            span.increment('bqdm.attempts')
+        start = time.time()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            PROFILER.record_call(api_method_name(fn), start, time.time(), e)
+            limiter.release(rate_limited=is_rate_limit_error(e))
+            raise
+        end = time.time()
+        PROFILER.record_call(api_method_name(fn), start, end)
+        limiter.release(latency=end - start)
+        return result
+
+    def call(self, kind, resource, fn, *args, **kwargs):
+        if not TRACER.enabled:
+            return self._retry.call(self._call, kind, resource, fn, *args, **kwargs)
+        with TRACER.span(api_method_name(fn), SPAN_KIND_CLIENT, **{
+                'bqdm.method': api_method_name(fn),
+                'bqdm.kind': kind,
+                'bqdm.resource': resource or _resource_id(fn, args),
+                'bqdm.job_id': kwargs.get('job_id', None)}) as span:
+            try:
+                result = self._retry.call(self._call, kind, resource, fn, *args, **kwargs)
+                span.set_attributes(_result_attributes(result))
+                return result
+            finally:
+                span.set_attributes({
+                    'bqdm.retries': max(span.attributes.get('bqdm.attempts', 0) - 1, 0)})
+
+    def submit(self, executor, resource, fn, *args, **kwargs):
+        """Submits the task ``fn`` updating ``resource`` to ``executor`` when the update quota
+        of ``resource`` allows it, the task does not hold a thread while it waits."""
+        return self._quota.submit(executor, resource, with_captured_output(fn), *args, **kwargs)
+
+    def read(self, fn, *args, **kwargs):
+        return self.call(ConcurrencyLimiter.READ, None, fn, *args, **kwargs)
+
+    def read_batch(self, api_client, requests, callback):
+        """Executes the read requests in a batch and calls ``callback(index, response, exception)``
+        with the result of each.
+
+        Requests failing with a transient error are executed again in a new batch
+        under the retry policy, an exception raised by ``callback`` fails the call."""
+        pending = dict(enumerate(requests))
+
+        def batch():
+            errors = []
+            retryable = []
+
+            def on_response(request_id, response, exception):
+                index = int(request_id)
+                if exception is not None and is_retryable_error(exception):
+                    retryable.append(exception)
+                    return
+                del pending[index]
+                try:
+                    callback(index, response, exception)
+                except Exception as e:
+                    errors.append(e)
+
+            request = api_client.new_batch_http_request(callback=on_response)
+            for index, r in sorted(pending.items()):
+                request.add(r, request_id=str(index))
+            request.execute()
+            if errors:
+                raise errors[0]
+            if retryable:
+                raise retryable[0]
+
+        if pending:
+            self.read(batch)
+
+    def write(self, resource, fn, *args, **kwargs):
+        return self.call(ConcurrencyLimiter.WRITE, resource, fn, *args, **kwargs)
+
+    def _idempotent(self, resource, fn, error, *args, **kwargs):
+        attempts = []
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            attempts.append(None)
+            try:
+                return fn(*args, **kwargs)
+            except error:
+                if len(attempts) == 1:
+                    raise
+                # The previous attempt reached the server, its response was lost.
+                return None
+
+        return self.write(resource, wrapper, *args, **kwargs)
+
+    def create(self, resource, fn, *args, **kwargs):
+        """Creates ``resource``, a Conflict on a retried attempt is taken as created."""
+        return self._idempotent(resource, fn, Conflict, *args, **kwargs)
+
+    def delete(self, resource, fn, *args, **kwargs):
+        """Deletes ``resource``, a NotFound on a retried attempt is taken as deleted."""
+        return self._idempotent(resource, fn, NotFound, *args, **kwargs)
+
+    def job(self, destination, fn, *args, **kwargs):
+        return self.call(ConcurrencyLimiter.JOB, destination, fn, *args, **kwargs)
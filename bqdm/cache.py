@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import threading
+import time
+
+
+class StateCache(object):
+    """Remote datasets and tables refreshed by plan, kept for ``ttl`` seconds.
+
+    Used by ``bqdm serve`` so that consecutive plans do not refresh the same resources.
+    Apply always refreshes and clears the cache after it changes the resources."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+
+    def get_or_set(self, key, fn):
+        value = self.get(key)
+        if value is None:
+            value = fn()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -3,36 +3,36 @@
 from __future__ import absolute_import
 
 import logging
+import os
 import sys
+import time
+import uuid
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 
 import click
-import yaml
-from past.types import unicode
 
 import bqdm.message as msg
 from bqdm import CONTEXT_SETTINGS
-from bqdm.action.dataset import DatasetAction
-from bqdm.action.table import SchemaMigrationMode, TableAction
-from bqdm.model.dataset import BigQueryAccessEntry, BigQueryDataset
-from bqdm.model.schema import BigQuerySchemaField
-from bqdm.model.table import BigQueryTable
-from bqdm.util import (as_completed, echo, get_parallelism, list_local_datasets, list_local_tables,
-                       str_representer, tuple_representer)
+from bqdm.api import ApiCaller
+from bqdm.action.enums import BackupType, JobPriority, SchemaMigrationMode
+from bqdm.journal import Journal
+from bqdm.metrics import Metrics
+from bqdm.profiler import PROFILER
+from bqdm.retry import Retry
+from bqdm.scheduler import JobScheduler
+from bqdm.shard import load_plan, merge_plans, write_json
+from bqdm.tracing import TRACER
+from bqdm.util import (CapturingExecutor, ResultCollector, Timings, as_completed, capture_output,
+                       echo, echo_captured, format_bytes, format_estimate, get_client,
+                       get_parallelism, list_local_datasets, list_local_projects,
+                       list_local_tables, read_resources, write_resources)
 
 _logger = logging.getLogger(__name__)
 _logger.addHandler(logging.StreamHandler(sys.stdout))
 _logger.setLevel(logging.INFO)
 
-yaml.add_representer(str, str_representer)
-yaml.add_representer(unicode, str_representer)
-yaml.add_representer(tuple, tuple_representer)
-yaml.add_representer(BigQueryDataset, BigQueryDataset.represent)
-yaml.add_representer(BigQueryAccessEntry, BigQueryAccessEntry.represent)
-yaml.add_representer(BigQueryTable, BigQueryTable.represent)
-yaml.add_representer(BigQuerySchemaField, BigQuerySchemaField.represent)
-
 
 @click.group(context_settings=CONTEXT_SETTINGS)
 @click.option('--credential-file', '-c', type=click.Path(exists=True), required=False,
@@ -43,18 +43,249 @@ yaml.add_representer(BigQuerySchemaField, BigQuerySchemaField.represent)
               help=msg.HELP_OPTION_COLOR)
 @click.option('--parallelism', type=int, required=False, default=get_parallelism(),
               help=msg.HELP_OPTION_PARALLELISM)
+@click.option('--batch-size', type=click.IntRange(1, 1000), required=False, default=50,
+              help=msg.HELP_OPTION_BATCH_SIZE)
+@click.option('--max-attempts', type=click.IntRange(1, None), required=False, default=5,
+              help=msg.HELP_OPTION_MAX_ATTEMPTS)
+@click.option('--call-deadline', type=float, required=False, default=600.0,
+              help=msg.HELP_OPTION_CALL_DEADLINE)
+@click.option('--run-deadline', type=float, required=False,
+              help=msg.HELP_OPTION_RUN_DEADLINE)
 @click.option('--debug', is_flag=True, default=False,
               help=msg.HELP_OPTION_DEBUG)
+@click.option('--profile', is_flag=True, default=False,
+              help=msg.HELP_OPTION_PROFILE)
+@click.option('--profile-output', type=click.Path(dir_okay=False, writable=True),
+              required=False, help=msg.HELP_OPTION_PROFILE_OUTPUT)
+@click.option('--trace-file', type=click.Path(dir_okay=False, writable=True),
+              required=False, help=msg.HELP_OPTION_TRACE_FILE)
+@click.option('--trace-format', type=click.Choice(['chrome', 'otlp']), required=False,
+              default='chrome', help=msg.HELP_OPTION_TRACE_FORMAT)
+@click.option('--metrics-file', type=click.Path(dir_okay=False, writable=True),
+              required=False, help=msg.HELP_OPTION_METRICS_FILE)
+@click.option('--metrics-push-url', type=str, required=False,
+              help=msg.HELP_OPTION_METRICS_PUSH_URL)
 @click.pass_context
-def cli(ctx, credential_file, project, color, parallelism, debug):
-    ctx.obj = dict()
+def cli(ctx, credential_file, project, color, parallelism, batch_size,
+        max_attempts, call_deadline, run_deadline, debug, profile, profile_output, trace_file,
+        trace_format, metrics_file, metrics_push_url):
+    # bqdm serve passes the state cache shared by the requests.
+    ctx.ensure_object(dict)
+    ctx.obj.setdefault('state_cache', None)
+    ctx.obj.setdefault('server', False)
     ctx.obj['credential_file'] = credential_file
     ctx.obj['project'] = project
     ctx.obj['color'] = color
     ctx.obj['parallelism'] = parallelism
+    ctx.obj['batch_size'] = batch_size
+    ctx.obj['api_caller'] = ApiCaller(parallelism, Retry(
+        max_attempts=max_attempts,
+        deadline=call_deadline,
+        run_deadline=time.time() + run_deadline if run_deadline else None))
     ctx.obj['debug'] = debug
     if debug:
         _logger.setLevel(logging.DEBUG)
+    if trace_file and trace_format == 'otlp':
+        _start_trace(ctx, trace_file)
+        trace_file = None
+    if profile or profile_output or trace_file:
+        _start_profile(ctx, profile, profile_output, trace_file)
+    ctx.obj['metrics'] = None
+    if metrics_file or metrics_push_url:
+        _start_metrics(ctx, metrics_file, metrics_push_url)
+
+
+def _start_metrics(ctx, metrics_file, metrics_push_url):
+    if not PROFILER.enabled:
+        # The API calls and phase durations are collected by the profiler.
+        PROFILER.enable()
+    metrics = ctx.obj['metrics'] = Metrics(ctx.obj['project'])
+    start = time.time()
+
+    def close():
+        for method, count, errors, _, _, _ in PROFILER.calls():
+            metrics.set('bqdm_api_calls', count, method=method)
+            metrics.set('bqdm_api_errors', errors, method=method)
+        metrics.set('bqdm_api_retries', ctx.obj['api_caller'].retry.retries)
+        for name, wall, _ in PROFILER.phases():
+            metrics.set('bqdm_phase_duration_seconds', wall, phase=name)
+        end = time.time()
+        metrics.set('bqdm_run_duration_seconds', end - start, command=ctx.invoked_subcommand)
+        metrics.set('bqdm_last_run_timestamp_seconds', end, command=ctx.invoked_subcommand)
+        if metrics_file:
+            metrics.write_textfile(metrics_file)
+        if metrics_push_url:
+            try:
+                metrics.push(metrics_push_url)
+            except Exception as e:
+                _logger.warning('Failed to push metrics to {0}: {1}'.format(
+                    metrics_push_url, e))
+
+    ctx.call_on_close(close)
+
+
+def _start_trace(ctx, trace_file):
+    TRACER.enable()
+    span = TRACER.start(ctx.invoked_subcommand or 'bqdm', root=True,
+                        **{'bqdm.project': ctx.obj['project']})
+
+    def close():
+        TRACER.end(span)
+        TRACER.write(trace_file)
+
+    ctx.call_on_close(close)
+
+
+def _start_profile(ctx, profile, profile_output, trace_file):
+    import cProfile
+
+    PROFILER.enable(trace=bool(trace_file))
+    stats = None
+    if profile_output:
+        stats = cProfile.Profile()
+        stats.enable()
+
+    def close():
+        if stats:
+            stats.disable()
+            stats.dump_stats(profile_output)
+        if trace_file:
+            PROFILER.write_trace(trace_file)
+        if profile:
+            _echo_profile()
+
+    ctx.call_on_close(close)
+
+
+def _echo_profile():
+    echo(msg.MESSAGE_PROFILE_PHASE_HEADER)
+    for name, wall, cpu in PROFILER.phases():
+        echo('{0:<10} {1:>10.3f}s {2:>10.3f}s'.format(name, wall, cpu), prefix='  ')
+    calls = PROFILER.calls()
+    if calls:
+        echo(msg.MESSAGE_PROFILE_CALL_HEADER)
+        for method, count, errors, p50, p90, p99 in calls:
+            echo('{0:<32} {1:>6d} {2:>6d} {3:>8.0f}ms {4:>8.0f}ms {5:>8.0f}ms'.format(
+                method, count, errors, p50 * 1000, p90 * 1000, p99 * 1000), prefix='  ')
+    echo()
+
+
+def _exit_with_failures(results, failures_file=None):
+    if not results.failed:
+        return
+    echo(msg.MESSAGE_FAILURE_SUMMARY.format(len(results.failed), len(results.succeeded)),
+         fg='red')
+    for resource, exception in sorted(results.failed, key=lambda r: r[0]):
+        echo('{0}: {1}'.format(resource, exception), prefix='  ', fg='red')
+    echo()
+    if failures_file:
+        write_resources(failures_file, [r for r, _ in results.failed])
+    sys.exit(1)
+
+
+def _parse_labels(values):
+    labels = dict()
+    for value in values:
+        key, sep, label = value.partition('=')
+        if not sep:
+            raise click.BadParameter('Must be KEY=VALUE: {0}'.format(value))
+        labels[key] = label
+    return labels
+
+
+def _refresh_datasets(ctx, dataset_action, dataset, exclude_dataset, managed_only,
+                      target_datasets, shard=None):
+    local_datasets = [d.dataset_id for d in target_datasets]
+
+    def refresh():
+        return [d for d in chain.from_iterable(as_completed(
+            dataset_action.list_datasets(dataset, exclude_dataset, managed_only,
+                                         local_datasets, shard))) if d]
+
+    state_cache = ctx.obj['state_cache']
+    if state_cache is None:
+        return refresh()
+    return state_cache.get_or_set((dataset_action.project, 'datasets', tuple(dataset),
+                                   tuple(exclude_dataset), managed_only,
+                                   tuple(sorted(local_datasets)), str(shard)), refresh)
+
+
+def _refresh_tables(ctx, table_action):
+    def refresh():
+        return [t for t in chain.from_iterable(
+            as_completed(table_action.list_tables())) if t]
+
+    state_cache = ctx.obj['state_cache']
+    if state_cache is None:
+        return refresh()
+    dataset_ref = table_action.dataset_reference
+    return state_cache.get_or_set((dataset_ref.project, 'tables', dataset_ref.dataset_id),
+                                  refresh)
+
+
+def _clear_state_cache(ctx):
+    if ctx.obj['state_cache'] is not None:
+        ctx.obj['state_cache'].clear()
+
+
+def _record_dataset_metrics(metrics, project, source_datasets, target_datasets):
+    from bqdm.action.dataset import DatasetAction
+
+    metrics.set('bqdm_resources_refreshed', len(source_datasets), project=project,
+                dataset='', resource='dataset')
+    for drift, get_datasets in [('add', DatasetAction.get_add_datasets),
+                                ('change', DatasetAction.get_change_datasets),
+                                ('destroy', DatasetAction.get_destroy_datasets)]:
+        _, datasets = get_datasets(source_datasets, target_datasets)
+        for d in datasets:
+            metrics.set('bqdm_drift', 1, project=project, dataset=d.dataset_id,
+                        resource='dataset', type=drift)
+
+
+def _record_table_metrics(metrics, project, dataset_id, refreshed, add_count, change_count,
+                          destroy_count):
+    metrics.set('bqdm_resources_refreshed', refreshed, project=project, dataset=dataset_id,
+                resource='table')
+    for drift, count in [('add', add_count), ('change', change_count),
+                         ('destroy', destroy_count)]:
+        metrics.set('bqdm_drift', count, project=project, dataset=dataset_id,
+                    resource='table', type=drift)
+
+
+def _echo_schedule(table_plans):
+    migrations = sorted(chain.from_iterable(
+        table_action.get_migration_tables(source_tables, target_tables)
+        for table_action, source_tables, target_tables in table_plans),
+        key=lambda m: m[1], reverse=True)
+    if not migrations:
+        return
+    echo(msg.MESSAGE_SCHEDULE_HEADER)
+    for i, (resource, num_bytes) in enumerate(migrations):
+        echo('{0}. {1} ({2})'.format(i + 1, resource, format_bytes(num_bytes)), prefix='  ')
+    echo()
+
+
+def _echo_job_summary(job_scheduler):
+    jobs, slot_seconds, slots = job_scheduler.utilization()
+    if jobs:
+        echo(msg.MESSAGE_JOB_SUMMARY.format(jobs, slot_seconds / 3600.0, slots))
+    batch_jobs, queued_seconds = job_scheduler.batch_summary()
+    if batch_jobs:
+        echo(msg.MESSAGE_BATCH_JOB_SUMMARY.format(batch_jobs, queued_seconds))
+
+
+def _echo_timing_summary(timings):
+    items = timings.items()
+    if items:
+        echo(msg.MESSAGE_TIMING_SUMMARY.format(', '.join(
+            '{0} {1:.1f}s'.format(name, seconds) for name, seconds in items)))
+
+
+def _echo_retry_summary(ctx):
+    retry = ctx.obj['api_caller'].retry
+    if retry.retries:
+        echo(msg.MESSAGE_RETRY_SUMMARY.format(retry.retries, retry.backoff))
+        echo()
 
 
 @cli.command(help=msg.HELP_COMMAND_EXPORT)
@@ -64,14 +295,21 @@ def cli(ctx, credential_file, project, color, parallelism, debug):
               help=msg.HELP_OPTION_DATASET)
 @click.option('--exclude-dataset', '-e', type=str, required=False, multiple=True,
               help=msg.HELP_OPTION_EXCLUDE_DATASET)
+@click.option('--managed-only', is_flag=True, default=False,
+              help=msg.HELP_OPTION_MANAGED_ONLY)
 @click.pass_context
-def export(ctx, output_dir, dataset, exclude_dataset):
+def export(ctx, output_dir, dataset, exclude_dataset, managed_only):
+    from bqdm.action.dataset import DatasetAction
+    from bqdm.action.table import TableAction
+
     with ThreadPoolExecutor(max_workers=ctx.obj['parallelism']) as e:
         action = DatasetAction(e, project=ctx.obj['project'],
                                credential_file=ctx.obj['credential_file'],
                                no_color=not ctx.obj['color'],
-                               debug=ctx.obj['debug'])
-        datasets = as_completed(action.export(output_dir, dataset, exclude_dataset))
+                               debug=ctx.obj['debug'],
+                               api_caller=ctx.obj['api_caller'])
+        datasets = as_completed(action.export(output_dir, dataset, exclude_dataset,
+                                              managed_only))
 
         fs = []
         for d in datasets:
@@ -79,7 +317,8 @@ def export(ctx, output_dir, dataset, exclude_dataset):
                                  project=ctx.obj['project'],
                                  credential_file=ctx.obj['credential_file'],
                                  no_color=not ctx.obj['color'],
-                                 debug=ctx.obj['debug'])
+                                 debug=ctx.obj['debug'],
+                                 api_caller=ctx.obj['api_caller'])
             fs.extend(action.export(output_dir))
         as_completed(fs)
 
@@ -93,52 +332,392 @@ def export(ctx, output_dir, dataset, exclude_dataset):
               help=msg.HELP_OPTION_DATASET)
 @click.option('--exclude-dataset', '-e', type=str, required=False, multiple=True,
               help=msg.HELP_OPTION_EXCLUDE_DATASET)
+@click.option('--managed-only', is_flag=True, default=False,
+              help=msg.HELP_OPTION_MANAGED_ONLY)
+@click.option('--watch', is_flag=True, default=False,
+              help=msg.HELP_OPTION_WATCH)
+@click.option('--shard', type=str, required=False,
+              help=msg.HELP_OPTION_SHARD)
+@click.option('--shard-weights', type=click.Path(exists=True, dir_okay=False), required=False,
+              help=msg.HELP_OPTION_SHARD_WEIGHTS)
+@click.option('--plan-output', type=click.Path(dir_okay=False, writable=True), required=False,
+              help=msg.HELP_OPTION_PLAN_OUTPUT)
+@click.option('--multi-project', is_flag=True, default=False,
+              help=msg.HELP_OPTION_MULTI_PROJECT)
 @click.pass_context
-def plan(ctx, conf_dir, detailed_exitcode, dataset, exclude_dataset):
+def plan(ctx, conf_dir, detailed_exitcode, dataset, exclude_dataset, managed_only, watch,
+         shard, shard_weights, plan_output, multi_project):
+    if multi_project and (watch or shard or plan_output):
+        raise click.UsageError(msg.MESSAGE_MULTI_PROJECT_UNSUPPORTED.format(
+            '--watch, --shard and --plan-output'))
+    if watch and ctx.obj['server']:
+        raise click.UsageError(msg.MESSAGE_WATCH_SERVING)
+    shard = _parse_shard(shard, shard_weights)
     echo(msg.MESSAGE_PLAN_HEADER)
 
-    add_counts, change_counts, destroy_counts = [], [], []
     with ThreadPoolExecutor(max_workers=ctx.obj['parallelism']) as e:
-        dataset_action = DatasetAction(e, project=ctx.obj['project'],
-                                       credential_file=ctx.obj['credential_file'],
-                                       no_color=not ctx.obj['color'],
-                                       debug=ctx.obj['debug'])
-        source_datasets = [d for d in as_completed(dataset_action.list_datasets(
-            dataset, exclude_dataset)) if d]
-        target_datasets = list_local_datasets(conf_dir, dataset, exclude_dataset)
-        echo('------------------------------------------------------------------------')
-        echo()
-
-        add_counts.append(dataset_action.plan_add(source_datasets, target_datasets))
-        change_counts.append(dataset_action.plan_change(source_datasets, target_datasets))
-        destroy_counts.append(dataset_action.plan_destroy(source_datasets, target_datasets))
-
-        for d in target_datasets:
-            target_tables = list_local_tables(conf_dir, d.dataset_id)
-            if target_tables is None:
-                continue
-            table_action = TableAction(e, d.dataset_id,
-                                       project=ctx.obj['project'],
-                                       credential_file=ctx.obj['credential_file'],
-                                       no_color=not ctx.obj['color'],
-                                       debug=ctx.obj['debug'])
-            source_tables = [t for t in as_completed(table_action.list_tables()) if t]
-            if target_tables or source_tables:
-                echo('------------------------------------------------------------------------')
-                echo()
-                add_counts.append(table_action.plan_add(source_tables, target_tables))
-                change_counts.append(table_action.plan_change(source_tables, target_tables))
-                destroy_counts.append(table_action.plan_destroy(source_tables, target_tables))
+        if multi_project:
+            if ctx.obj['metrics']:
+                # The samples of each project are labelled with the project, and the ones
+                # of the run with none.
+                ctx.obj['metrics'].project = None
+            # The output of the refresh running on the executor is of the project too.
+            plans = _run_projects(ctx, conf_dir, lambda project, api_caller: _plan_project(
+                ctx, CapturingExecutor(e), project, api_caller,
+                os.path.join(conf_dir, project), dataset, exclude_dataset, managed_only,
+                metrics=ctx.obj['metrics']), capture=True)
+        else:
+            if ctx.obj['metrics']:
+                # The project of the client when not given.
+                ctx.obj['metrics'].project = get_client(ctx.obj['project'],
+                                                        ctx.obj['credential_file']).project
+            plans = OrderedDict([(ctx.obj['project'], _plan_project(
+                ctx, e, ctx.obj['project'], ctx.obj['api_caller'], conf_dir,
+                dataset, exclude_dataset, managed_only, shard, ctx.obj['metrics']))])
 
-    if not any(chain.from_iterable([add_counts, change_counts, destroy_counts])):
+    _echo_retry_summary(ctx)
+    if multi_project:
+        _echo_project_summary(msg.MESSAGE_PLAN_SUMMARY, plans)
+    add_count, change_count, destroy_count = [sum(sum(getattr(p, c)) for p in plans.values())
+                                              for c in _COUNTS]
+    changed = any([add_count, change_count, destroy_count])
+    if not changed:
         echo(msg.MESSAGE_SUMMARY_NO_CHANGE)
         echo()
     else:
-        echo(msg.MESSAGE_PLAN_SUMMARY.format(
-            sum(add_counts), sum(change_counts), sum(destroy_counts)))
+        echo(msg.MESSAGE_PLAN_SUMMARY.format(add_count, change_count, destroy_count))
+        estimated_bytes = sum(sum(p.estimated_bytes) for p in plans.values())
+        if estimated_bytes:
+            echo(format_estimate(estimated_bytes, None if multi_project else
+                                 next(iter(plans.values())).throughput()))
         echo()
-        if detailed_exitcode:
-            sys.exit(2)
+        _echo_schedule(list(chain.from_iterable(p.table_plans for p in plans.values())))
+    if plan_output:
+        result = next(iter(plans.values()))
+        write_json(plan_output, _make_plan(shard, result.source_datasets,
+                                           result.target_datasets, result.source_tables,
+                                           result.target_tables, sum(result.estimated_bytes)))
+    if watch:
+        result = next(iter(plans.values()))
+        _watch_plan(ctx, conf_dir, dataset, exclude_dataset, result.throughput,
+                    result.source_datasets, result.target_datasets,
+                    result.source_tables, result.target_tables)
+    elif changed and detailed_exitcode:
+        sys.exit(2)
+
+
+_COUNTS = ('add_counts', 'change_counts', 'destroy_counts')
+
+
+class _ProjectResult(object):
+    """Counts of the changes of a project planned or applied, and what plan refreshed."""
+
+    def __init__(self):
+        self.add_counts, self.change_counts, self.destroy_counts = [], [], []
+        self.estimated_bytes = []
+        self.table_plans = []
+        self.throughput = None
+        self.source_datasets, self.target_datasets = [], []
+        self.source_tables, self.target_tables = dict(), dict()
+        self.job_scheduler = None
+
+
+def _run_projects(ctx, conf_dir, fn, capture=False):
+    """Runs ``fn(project, api_caller)`` for the configuration files of each project under
+    ``conf_dir`` at the same time and returns the results by project.
+
+    The projects share the executor of the API calls and the clients, each project has
+    its own ``ApiCaller`` so that the concurrency limits and update quotas apply to each
+    project. With ``capture``, the output of each project is written as a block in the
+    order of the projects."""
+    projects = list_local_projects(conf_dir)
+
+    def run(project):
+        api_caller = ApiCaller(ctx.obj['parallelism'], ctx.obj['api_caller'].retry)
+        if not capture:
+            return fn(project, api_caller), None
+        with capture_output() as lines:
+            result = fn(project, api_caller)
+        return result, lines
+
+    results = OrderedDict()
+    with ThreadPoolExecutor(max_workers=max(len(projects), 1)) as e:
+        fs = [(project, e.submit(run, project)) for project in projects]
+        for project, f in fs:
+            result, lines = f.result()
+            if lines is not None:
+                echo('========================================================================')
+                echo(msg.MESSAGE_PROJECT_HEADER.format(project))
+                echo()
+                echo_captured(lines)
+            results[project] = result
+    return results
+
+
+def _echo_project_summary(summary, results):
+    echo('========================================================================')
+    for project, result in results.items():
+        if result is None:
+            continue
+        echo('{0}: {1}'.format(project, summary.format(
+            *[sum(getattr(result, c)) for c in _COUNTS])), prefix='  ')
+        if result.job_scheduler:
+            jobs, slot_seconds, slots = result.job_scheduler.utilization()
+            if jobs:
+                echo(msg.MESSAGE_JOB_SUMMARY.format(jobs, slot_seconds / 3600.0, slots),
+                     prefix='    ')
+    echo()
+
+
+def _plan_project(ctx, e, project, api_caller, conf_dir, dataset, exclude_dataset,
+                  managed_only, shard=None, metrics=None):
+    from bqdm.action.dataset import DatasetAction
+    from bqdm.action.table import TableAction
+
+    result = _ProjectResult()
+    dataset_action = DatasetAction(e, project=project,
+                                   credential_file=ctx.obj['credential_file'],
+                                   no_color=not ctx.obj['color'],
+                                   debug=ctx.obj['debug'],
+                                   batch_size=ctx.obj['batch_size'],
+                                   api_caller=api_caller)
+    target_datasets = list_local_datasets(conf_dir, dataset, exclude_dataset, shard)
+    source_datasets = _refresh_datasets(ctx, dataset_action, dataset, exclude_dataset,
+                                        managed_only, target_datasets, shard)
+    result.source_datasets, result.target_datasets = source_datasets, target_datasets
+    echo('------------------------------------------------------------------------')
+    echo()
+
+    result.add_counts.append(dataset_action.plan_add(source_datasets, target_datasets))
+    result.change_counts.append(dataset_action.plan_change(source_datasets, target_datasets))
+    result.destroy_counts.append(dataset_action.plan_destroy(source_datasets, target_datasets))
+    if metrics:
+        _record_dataset_metrics(metrics, dataset_action.project, source_datasets,
+                                target_datasets)
+
+    # Listed only when a migration query is estimated.
+    result.throughput = dataset_action.get_job_throughput
+    for d in target_datasets:
+        target_tables = list_local_tables(conf_dir, d.dataset_id)
+        if target_tables is None:
+            continue
+        table_action = TableAction(e, d.dataset_id,
+                                   project=project,
+                                   credential_file=ctx.obj['credential_file'],
+                                   no_color=not ctx.obj['color'],
+                                   debug=ctx.obj['debug'],
+                                   batch_size=ctx.obj['batch_size'],
+                                   api_caller=api_caller,
+                                   throughput=result.throughput)
+        source_tables = _refresh_tables(ctx, table_action)
+        result.source_tables[d.dataset_id] = source_tables
+        result.target_tables[d.dataset_id] = target_tables
+        if target_tables or source_tables:
+            echo('------------------------------------------------------------------------')
+            echo()
+            result.add_counts.append(table_action.plan_add(source_tables, target_tables))
+            result.change_counts.append(table_action.plan_change(source_tables, target_tables))
+            result.destroy_counts.append(table_action.plan_destroy(source_tables,
+                                                                   target_tables))
+            result.estimated_bytes.append(table_action.estimated_bytes)
+            result.table_plans.append((table_action, source_tables, target_tables))
+            if metrics:
+                _record_table_metrics(metrics, dataset_action.project, d.dataset_id,
+                                      len(source_tables), result.add_counts[-1],
+                                      result.change_counts[-1], result.destroy_counts[-1])
+    return result
+
+
+def _parse_shard(value, weights_file):
+    from bqdm.shard import Shard, load_weights
+
+    if not value:
+        return None
+    try:
+        return Shard.parse(value, load_weights(weights_file) if weights_file else None)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--shard')
+
+
+def _make_plan(shard, source_datasets, target_datasets, source_tables, target_tables,
+               estimated_bytes):
+    from bqdm.action.dataset import DatasetAction
+    from bqdm.action.table import TableAction
+    from bqdm.shard import make_plan
+
+    tables = dict((d.dataset_id, 0) for d in chain(source_datasets, target_datasets))
+    changes = _drift(source_datasets, target_datasets, DatasetAction.get_add_datasets,
+                     DatasetAction.get_change_datasets, DatasetAction.get_destroy_datasets,
+                     lambda d: d.dataset_id)
+    for dataset_id, target in target_tables.items():
+        source = source_tables[dataset_id]
+        tables[dataset_id] = len(set(t.table_id for t in chain(source, target)))
+        changes.update(_drift(source, target, TableAction.get_add_tables,
+                              TableAction.get_change_tables, TableAction.get_destroy_tables,
+                              lambda t, d=dataset_id: '{0}.{1}'.format(d, t.table_id)))
+    by_type = dict()
+    for resource, change in changes.items():
+        by_type.setdefault(change, []).append(resource)
+    return make_plan(shard, tables, by_type, estimated_bytes)
+
+
+def _drift(source, target, get_add, get_change, get_destroy, key):
+    drift = dict()
+    for kind, get_models in [('add', get_add), ('change', get_change),
+                             ('destroy', get_destroy)]:
+        _, models = get_models(source, target)
+        for model in models:
+            drift[key(model)] = kind
+    return drift
+
+
+def _watch_plan(ctx, conf_dir, dataset, exclude_dataset, throughput,
+                source_datasets, target_datasets, source_tables, target_tables):
+    """Plans again the datasets and tables of the configuration files changed after the
+    plan, against the datasets and tables refreshed by the plan."""
+    from bqdm.action.dataset import DatasetAction
+    from bqdm.action.table import TableAction
+    from bqdm.util import load_dataset, load_table
+    from bqdm.watch import create_watcher
+
+    sources = dict((d.dataset_id, d) for d in source_datasets)
+    targets = dict((d.dataset_id, d) for d in target_datasets)
+    source_tables = dict((k, dict((t.table_id, t) for t in v))
+                         for k, v in source_tables.items())
+    target_tables = dict((k, dict((t.table_id, t) for t in v))
+                         for k, v in target_tables.items())
+    refreshed = set(sources.keys())
+    drift = _drift(source_datasets, target_datasets, DatasetAction.get_add_datasets,
+                   DatasetAction.get_change_datasets, DatasetAction.get_destroy_datasets,
+                   lambda d: (d.dataset_id, None))
+    for dataset_id, tables in target_tables.items():
+        drift.update(_drift(list(source_tables[dataset_id].values()), list(tables.values()),
+                            TableAction.get_add_tables, TableAction.get_change_tables,
+                            TableAction.get_destroy_tables,
+                            lambda t, d=dataset_id: (d, t.table_id)))
+
+    watcher = create_watcher(conf_dir)
+    echo(msg.MESSAGE_WATCH_WAITING.format(conf_dir))
+    echo()
+    try:
+        with ThreadPoolExecutor(max_workers=ctx.obj['parallelism']) as e:
+            dataset_action = DatasetAction(e, project=ctx.obj['project'],
+                                           credential_file=ctx.obj['credential_file'],
+                                           no_color=not ctx.obj['color'],
+                                           debug=ctx.obj['debug'],
+                                           batch_size=ctx.obj['batch_size'],
+                                           api_caller=ctx.obj['api_caller'])
+            table_actions = dict()
+
+            def replan(changed):
+                changed_datasets, changed_tables = set(), dict()
+                for path in changed:
+                    parts = path.split(os.sep)
+                    dataset_id = os.path.splitext(parts[0])[0]
+                    if (dataset and dataset_id not in dataset) or dataset_id in exclude_dataset:
+                        continue
+                    full_path = os.path.join(conf_dir, path)
+                    if len(parts) == 1 and path.endswith('.yml'):
+                        changed_datasets.add(dataset_id)
+                        if os.path.exists(full_path):
+                            targets[dataset_id] = load_dataset(full_path)
+                        else:
+                            targets.pop(dataset_id, None)
+                    elif len(parts) == 1:
+                        # The directory of the tables is created or removed.
+                        tables = list_local_tables(conf_dir, dataset_id)
+                        if tables is None:
+                            target_tables.pop(dataset_id, None)
+                        else:
+                            target_tables[dataset_id] = dict((t.table_id, t) for t in tables)
+                        changed_tables[dataset_id] = None
+                    elif len(parts) == 2:
+                        table_id = os.path.splitext(parts[1])[0]
+                        if dataset_id not in target_tables:
+                            continue
+                        if os.path.exists(full_path):
+                            target_tables[dataset_id][table_id] = load_table(full_path)
+                        else:
+                            target_tables[dataset_id].pop(table_id, None)
+                        if changed_tables.get(dataset_id, set()) is not None:
+                            changed_tables.setdefault(dataset_id, set()).add(table_id)
+
+                for dataset_id in changed_datasets - refreshed:
+                    # Not listed by the plan, for example not managed yet.
+                    source = dataset_action.get_dataset(dataset_id)
+                    if source:
+                        sources[dataset_id] = source
+                    refreshed.add(dataset_id)
+                if changed_datasets:
+                    source = [sources[i] for i in changed_datasets if i in sources]
+                    target = [targets[i] for i in changed_datasets if i in targets]
+                    for dataset_id in changed_datasets:
+                        drift.pop((dataset_id, None), None)
+                    dataset_action.plan_add(source, target)
+                    dataset_action.plan_change(source, target)
+                    dataset_action.plan_destroy(source, target)
+                    drift.update(_drift(source, target, DatasetAction.get_add_datasets,
+                                        DatasetAction.get_change_datasets,
+                                        DatasetAction.get_destroy_datasets,
+                                        lambda d: (d.dataset_id, None)))
+
+                for dataset_id, table_ids in changed_tables.items():
+                    for key in [k for k in drift if k[0] == dataset_id and k[1] is not None and
+                                (table_ids is None or k[1] in table_ids)]:
+                        del drift[key]
+                    if dataset_id not in target_tables:
+                        continue
+                    table_action = table_actions.get(dataset_id, None)
+                    if table_action is None:
+                        table_action = table_actions[dataset_id] = TableAction(
+                            e, dataset_id,
+                            project=ctx.obj['project'],
+                            credential_file=ctx.obj['credential_file'],
+                            no_color=not ctx.obj['color'],
+                            debug=ctx.obj['debug'],
+                            batch_size=ctx.obj['batch_size'],
+                            api_caller=ctx.obj['api_caller'],
+                            throughput=throughput)
+                    if dataset_id not in source_tables:
+                        source_tables[dataset_id] = dict(
+                            (t.table_id, t) for t in _refresh_tables(ctx, table_action))
+                    source = [t for i, t in source_tables[dataset_id].items()
+                              if table_ids is None or i in table_ids]
+                    target = [t for i, t in target_tables[dataset_id].items()
+                              if table_ids is None or i in table_ids]
+                    table_action.plan_add(source, target)
+                    table_action.plan_change(source, target)
+                    table_action.plan_destroy(source, target)
+                    drift.update(_drift(source, target, TableAction.get_add_tables,
+                                        TableAction.get_change_tables,
+                                        TableAction.get_destroy_tables,
+                                        lambda t, d=dataset_id: (d, t.table_id)))
+
+                kinds = list(drift.values())
+                if not kinds:
+                    echo(msg.MESSAGE_SUMMARY_NO_CHANGE)
+                else:
+                    echo(msg.MESSAGE_PLAN_SUMMARY.format(
+                        kinds.count('add'), kinds.count('change'), kinds.count('destroy')))
+                echo()
+
+            while True:
+                changed = [os.path.relpath(p, conf_dir) for p in watcher.wait()]
+                echo('------------------------------------------------------------------------')
+                echo(msg.MESSAGE_WATCH_CHANGED.format(', '.join(changed)))
+                echo()
+                try:
+                    replan(changed)
+                except Exception as ex:
+                    # An invalid configuration file or an API error, plan again on the next change.
+                    echo(msg.MESSAGE_WATCH_ERROR.format(ex))
+                    echo()
+                echo(msg.MESSAGE_WATCH_WAITING.format(conf_dir))
+                echo()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
 
 
 @cli.command(help=msg.HELP_COMMAND_APPLY)
@@ -150,6 +729,8 @@ def plan(ctx, conf_dir, detailed_exitcode, dataset, exclude_dataset):
               help=msg.HELP_OPTION_DATASET)
 @click.option('--exclude-dataset', '-e', type=str, required=False, multiple=True,
               help=msg.HELP_OPTION_EXCLUDE_DATASET)
+@click.option('--managed-only', is_flag=True, default=False,
+              help=msg.HELP_OPTION_MANAGED_ONLY)
 @click.option('--mode', '-m', type=click.Choice([
     SchemaMigrationMode.SELECT_INSERT.value,
     SchemaMigrationMode.SELECT_INSERT_BACKUP.value,
@@ -161,67 +742,312 @@ def plan(ctx, conf_dir, detailed_exitcode, dataset, exclude_dataset):
               help=msg.HELP_OPTION_MIGRATION_MODE)
 @click.option('--backup-dataset', '-b', type=str, required=False,
               help=msg.HELP_OPTION_BACKUP_DATASET)
+@click.option('--backup-type', type=click.Choice([t.value for t in BackupType]),
+              required=False, default=BackupType.COPY.value, help=msg.HELP_OPTION_BACKUP_TYPE)
+@click.option('--backup-expiration', type=click.IntRange(1, None), required=False,
+              help=msg.HELP_OPTION_BACKUP_EXPIRATION)
+@click.option('--partition-parallelism', type=click.IntRange(1, None), required=False,
+              default=8, help=msg.HELP_OPTION_PARTITION_PARALLELISM)
+@click.option('--max-bytes-billed', type=click.IntRange(0, None), required=False,
+              help=msg.HELP_OPTION_MAX_BYTES_BILLED)
+@click.option('--max-concurrent-jobs', type=click.IntRange(1, None), required=False,
+              default=10, help=msg.HELP_OPTION_MAX_CONCURRENT_JOBS)
+@click.option('--max-slots', type=click.IntRange(1, None), required=False,
+              help=msg.HELP_OPTION_MAX_SLOTS)
+@click.option('--priority', type=click.Choice([p.value for p in JobPriority]), required=False,
+              default=JobPriority.INTERACTIVE.value, help=msg.HELP_OPTION_PRIORITY)
+@click.option('--table-priority', type=str, required=False, multiple=True,
+              help=msg.HELP_OPTION_TABLE_PRIORITY)
+@click.option('--verify', is_flag=True, default=False,
+              help=msg.HELP_OPTION_VERIFY)
+@click.option('--failures-file', type=click.Path(dir_okay=False, writable=True), required=False,
+              help=msg.HELP_OPTION_FAILURES_FILE)
+@click.option('--retry-failed', type=click.Path(exists=True, dir_okay=False), required=False,
+              help=msg.HELP_OPTION_RETRY_FAILED)
+@click.option('--journal-file', type=click.Path(dir_okay=False, writable=True), required=False,
+              default='.bqdm.journal', help=msg.HELP_OPTION_JOURNAL_FILE)
+@click.option('--resume', is_flag=True, default=False,
+              help=msg.HELP_OPTION_RESUME)
+@click.option('--run-id', type=str, required=False,
+              help=msg.HELP_OPTION_RUN_ID)
+@click.option('--job-id-prefix', type=str, required=False, default='bqdm_',
+              help=msg.HELP_OPTION_JOB_ID_PREFIX)
+@click.option('--job-label', type=str, required=False, multiple=True,
+              help=msg.HELP_OPTION_JOB_LABEL)
+@click.option('--shard', type=str, required=False,
+              help=msg.HELP_OPTION_SHARD)
+@click.option('--shard-weights', type=click.Path(exists=True, dir_okay=False), required=False,
+              help=msg.HELP_OPTION_SHARD_WEIGHTS)
+@click.option('--multi-project', is_flag=True, default=False,
+              help=msg.HELP_OPTION_MULTI_PROJECT)
 @click.pass_context
-def apply(ctx, conf_dir, auto_approve, dataset, exclude_dataset, mode, backup_dataset):
+def apply(ctx, conf_dir, auto_approve, dataset, exclude_dataset, managed_only, mode,
+          backup_dataset, backup_type, backup_expiration, partition_parallelism,
+          max_bytes_billed, max_concurrent_jobs, max_slots, priority, table_priority, verify,
+          failures_file, retry_failed,
+          journal_file, resume, run_id, job_id_prefix, job_label, shard, shard_weights,
+          multi_project):
+    # The resources refreshed before this apply are stale after it.
+    ctx.call_on_close(lambda: _clear_state_cache(ctx))
+    if multi_project and shard:
+        raise click.UsageError(msg.MESSAGE_MULTI_PROJECT_UNSUPPORTED.format('--shard'))
+    shard = _parse_shard(shard, shard_weights)
     # TODO Impl auto-approve option
-    add_counts, change_counts, destroy_counts = [], [], []
-    with ThreadPoolExecutor(max_workers=ctx.obj['parallelism']) as e:
-        dataset_action = DatasetAction(e, project=ctx.obj['project'],
-                                       credential_file=ctx.obj['credential_file'],
-                                       no_color=not ctx.obj['color'],
-                                       debug=ctx.obj['debug'])
-        source_datasets = [d for d in as_completed(dataset_action.list_datasets(
-            dataset, exclude_dataset)) if d]
-        target_datasets = list_local_datasets(conf_dir, dataset, exclude_dataset)
-        echo('------------------------------------------------------------------------')
+    if multi_project:
+        # Each project has its own journal, the resources are identified within a project.
+        journals = OrderedDict((p, Journal('{0}.{1}'.format(journal_file, p)))
+                               for p in list_local_projects(conf_dir))
+    else:
+        journals = OrderedDict([(ctx.obj['project'], Journal(journal_file))])
+    pending = [(j.path, j.pending()) for j in journals.values() if j.pending()]
+    if pending and not resume:
+        for path, resources in pending:
+            echo(msg.MESSAGE_JOURNAL_PENDING.format(path, ', '.join(resources)), fg='red')
         echo()
+        sys.exit(1)
+    if not run_id:
+        run_id = str(uuid.uuid4())
+    job_labels = _parse_labels(job_label)
+    table_priorities = _parse_labels(table_priority)
+    for value in table_priorities.values():
+        if value not in [p.value for p in JobPriority]:
+            raise click.BadParameter('Priority must be one of {0}: {1}'.format(
+                ', '.join(p.value for p in JobPriority), value))
 
-        fs = []
-        add_count, add_fs = dataset_action.add(source_datasets, target_datasets)
-        add_counts.append(add_count)
-        fs.extend(add_fs)
-        change_count, change_fs = dataset_action.change(source_datasets, target_datasets)
-        change_counts.append(change_count)
-        fs.extend(change_fs)
-        destroy_count, destroy_fs = dataset_action.destroy(source_datasets, target_datasets)
-        destroy_counts.append(destroy_count)
-        fs.extend(destroy_fs)
-        as_completed(fs)
+    resources = None
+    if retry_failed:
+        resources = read_resources(retry_failed)
 
-        fs = []
-        for d in target_datasets:
-            target_tables = list_local_tables(conf_dir, d.dataset_id)
-            if target_tables is None:
-                continue
-            table_action = TableAction(e, d.dataset_id,
-                                       migration_mode=mode,
-                                       backup_dataset_id=backup_dataset,
-                                       project=ctx.obj['project'],
-                                       credential_file=ctx.obj['credential_file'],
-                                       no_color=not ctx.obj['color'],
-                                       debug=ctx.obj['debug'])
-            source_tables = [t for t in as_completed(table_action.list_tables()) if t]
-            if target_tables or source_tables:
-                echo('------------------------------------------------------------------------')
-                echo()
-                add_count, add_fs = table_action.add(source_tables, target_tables)
-                add_counts.append(add_count)
-                fs.extend(add_fs)
-                change_count, change_fs = table_action.change(source_tables, target_tables)
-                change_counts.append(change_count)
-                fs.extend(change_fs)
-                destroy_count, destroy_fs = table_action.destroy(source_tables, target_tables)
-                destroy_counts.append(destroy_count)
-                fs.extend(destroy_fs)
-        as_completed(fs)
+    results = ResultCollector()
+    timings = Timings()
+    options = dict(dataset=dataset, exclude_dataset=exclude_dataset,
+                   managed_only=managed_only, mode=mode, backup_dataset=backup_dataset,
+                   backup_type=backup_type, backup_expiration=backup_expiration,
+                   partition_parallelism=partition_parallelism,
+                   max_bytes_billed=max_bytes_billed, verify=verify, priority=priority,
+                   table_priorities=table_priorities, resume=resume, run_id=run_id,
+                   job_id_prefix=job_id_prefix, job_labels=job_labels, timings=timings)
+    with ThreadPoolExecutor(max_workers=ctx.obj['parallelism']) as e, \
+            ThreadPoolExecutor(max_workers=partition_parallelism) as partition_executor:
+        options['partition_executor'] = partition_executor
+        if multi_project:
+            def apply_project(project, api_caller):
+                project_resources = None
+                if resources is not None:
+                    # The failures of a multi-project run are written as PROJECT:RESOURCE.
+                    project_resources = set(r.split(':', 1)[1] for r in resources
+                                            if r.split(':', 1)[0] == project)
+                project_results = ResultCollector()
+                result = _apply_project(
+                    ctx, e, project, api_caller, os.path.join(conf_dir, project),
+                    JobScheduler(max_concurrent_jobs, max_slots), journals[project],
+                    project_results, project_resources, **options)
+                results.succeeded.extend('{0}:{1}'.format(project, r)
+                                         for r in project_results.succeeded)
+                results.failed.extend(('{0}:{1}'.format(project, r), ex)
+                                      for r, ex in project_results.failed)
+                if result is None:
+                    results.failed.append((project, msg.MESSAGE_PROJECT_ABORTED))
+                return result
+
+            applies = _run_projects(ctx, conf_dir, apply_project)
+        else:
+            job_scheduler = JobScheduler(max_concurrent_jobs, max_slots)
+            result = _apply_project(ctx, e, ctx.obj['project'], ctx.obj['api_caller'],
+                                    conf_dir, job_scheduler, journals[ctx.obj['project']],
+                                    results, resources, shard=shard, **options)
+            if result is None:
+                sys.exit(1)
+            applies = OrderedDict([(ctx.obj['project'], result)])
 
-    if not any(chain.from_iterable([add_counts, change_counts, destroy_counts])):
+    _echo_retry_summary(ctx)
+    _echo_timing_summary(timings)
+    if multi_project:
+        _echo_project_summary(msg.MESSAGE_APPLY_SUMMARY, applies)
+    else:
+        _echo_job_summary(applies[ctx.obj['project']].job_scheduler)
+    add_count, change_count, destroy_count = [
+        sum(sum(getattr(a, c)) for a in applies.values() if a) for c in _COUNTS]
+    if not any([add_count, change_count, destroy_count]):
         echo(msg.MESSAGE_SUMMARY_NO_CHANGE)
         echo()
     else:
-        echo(msg.MESSAGE_APPLY_SUMMARY.format(
-            sum(add_counts), sum(change_counts), sum(destroy_counts)))
+        echo(msg.MESSAGE_APPLY_SUMMARY.format(add_count, change_count, destroy_count))
+        echo()
+    _exit_with_failures(results, failures_file)
+
+
+def _apply_project(ctx, e, project, api_caller, conf_dir, job_scheduler, journal, results,
+                   resources, dataset, exclude_dataset, managed_only, mode, backup_dataset,
+                   backup_type, backup_expiration, partition_parallelism, max_bytes_billed,
+                   verify, priority, table_priorities, resume, run_id, job_id_prefix,
+                   job_labels, timings, partition_executor=None, shard=None):
+    """Applies the configuration files of a project and returns the counts of the changes,
+    or None if the migrations are estimated to exceed ``max_bytes_billed``."""
+    from bqdm.action.dataset import DatasetAction
+    from bqdm.action.table import TableAction
+
+    result = _ProjectResult()
+    result.job_scheduler = job_scheduler
+    if resources is not None:
+        dataset_ids = set(r.split('.', 1)[0] for r in resources)
+        dataset = tuple(dataset_ids & set(dataset)) if dataset else tuple(dataset_ids)
+        if not dataset:
+            journal.close()
+            return result
+
+    dataset_action = DatasetAction(e, project=project,
+                                   credential_file=ctx.obj['credential_file'],
+                                   no_color=not ctx.obj['color'],
+                                   debug=ctx.obj['debug'],
+                                   batch_size=ctx.obj['batch_size'],
+                                   api_caller=api_caller)
+    target_datasets = list_local_datasets(conf_dir, dataset, exclude_dataset, shard)
+    source_datasets = [d for d in chain.from_iterable(as_completed(
+        dataset_action.list_datasets(dataset, exclude_dataset, managed_only,
+                                     [d.dataset_id for d in target_datasets],
+                                     shard))) if d]
+    echo('------------------------------------------------------------------------')
+    echo()
+
+    table_plans = []
+    for d in target_datasets:
+        target_tables = list_local_tables(conf_dir, d.dataset_id)
+        if target_tables is None:
+            continue
+        table_action = TableAction(e, d.dataset_id,
+                                   migration_mode=mode,
+                                   backup_dataset_id=backup_dataset,
+                                   backup_type=backup_type,
+                                   backup_expiration=backup_expiration,
+                                   partition_parallelism=partition_parallelism,
+                                   maximum_bytes_billed=max_bytes_billed,
+                                   verify=verify,
+                                   timings=timings,
+                                   job_scheduler=job_scheduler,
+                                   priority=priority,
+                                   table_priorities=table_priorities,
+                                   project=project,
+                                   credential_file=ctx.obj['credential_file'],
+                                   no_color=not ctx.obj['color'],
+                                   debug=ctx.obj['debug'],
+                                   batch_size=ctx.obj['batch_size'],
+                                   api_caller=api_caller,
+                                   journal=journal,
+                                   run_id=run_id,
+                                   job_id_prefix=job_id_prefix,
+                                   job_labels=job_labels,
+                                   partition_executor=partition_executor)
+        if resume:
+            resume_count, resume_fs = table_action.resume(target_tables)
+            result.change_counts.append(resume_count)
+            results.collect(resume_fs)
+        source_tables = [t for t in chain.from_iterable(
+            as_completed(table_action.list_tables())) if t]
+        if resources is not None and d.dataset_id not in resources:
+            source_tables = [t for t in source_tables
+                             if '{0}.{1}'.format(d.dataset_id, t.table_id) in resources]
+            target_tables = [t for t in target_tables
+                             if '{0}.{1}'.format(d.dataset_id, t.table_id) in resources]
+        table_plans.append((table_action, source_tables, target_tables))
+
+    if max_bytes_billed is not None:
+        estimated_bytes = sum(table_action.estimate_change(source_tables, target_tables)
+                              for table_action, source_tables, target_tables in table_plans)
+        if estimated_bytes > max_bytes_billed:
+            echo(msg.MESSAGE_MAX_BYTES_BILLED_EXCEEDED.format(
+                format_bytes(estimated_bytes), format_bytes(max_bytes_billed)), fg='red')
+            echo()
+            journal.close()
+            return None
+
+    _echo_schedule(table_plans)
+
+    apply_source_datasets, apply_target_datasets = source_datasets, target_datasets
+    if resources is not None:
+        apply_source_datasets = [d for d in source_datasets if d.dataset_id in resources]
+        apply_target_datasets = [d for d in target_datasets if d.dataset_id in resources]
+
+    fs = dict()
+    add_count, add_fs = dataset_action.add(apply_source_datasets, apply_target_datasets)
+    result.add_counts.append(add_count)
+    fs.update(add_fs)
+    change_count, change_fs = dataset_action.change(apply_source_datasets,
+                                                    apply_target_datasets)
+    result.change_counts.append(change_count)
+    fs.update(change_fs)
+    destroy_count, destroy_fs = dataset_action.destroy(apply_source_datasets,
+                                                       apply_target_datasets)
+    result.destroy_counts.append(destroy_count)
+    fs.update(destroy_fs)
+    results.collect(fs)
+
+    fs = dict()
+    for table_action, source_tables, target_tables in table_plans:
+        if target_tables or source_tables:
+            echo('------------------------------------------------------------------------')
+            echo()
+            add_count, add_fs = table_action.add(source_tables, target_tables)
+            result.add_counts.append(add_count)
+            fs.update(add_fs)
+            change_count, change_fs = table_action.change(source_tables, target_tables)
+            result.change_counts.append(change_count)
+            fs.update(change_fs)
+            destroy_count, destroy_fs = table_action.destroy(source_tables, target_tables)
+            result.destroy_counts.append(destroy_count)
+            fs.update(destroy_fs)
+    results.collect(fs)
+    journal.close()
+    return result
+
+
+@cli.command(help=msg.HELP_COMMAND_SERVE)
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False), required=False,
+              default='.bqdm.sock', help=msg.HELP_OPTION_SOCKET)
+@click.option('--cache-ttl', type=click.FloatRange(0, None), required=False, default=300.0,
+              help=msg.HELP_OPTION_CACHE_TTL)
+@click.pass_context
+def serve(ctx, socket_path, cache_ttl):
+    from bqdm.server import serve
+
+    if ctx.obj['server']:
+        raise click.UsageError(msg.MESSAGE_ALREADY_SERVING)
+    serve(socket_path, cache_ttl)
+
+
+@cli.command('merge-plans', help=msg.HELP_COMMAND_MERGE_PLANS)
+@click.argument('plan-files', type=click.Path(exists=True, dir_okay=False), nargs=-1,
+                required=True)
+@click.option('--detailed-exitcode', is_flag=True, default=False,
+              help=msg.HELP_OPTION_DETAILED_EXIT_CODE)
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), required=False,
+              help=msg.HELP_OPTION_MERGED_PLAN_OUTPUT)
+@click.pass_context
+def merge_plan_files(ctx, plan_files, detailed_exitcode, output):
+    try:
+        merged = merge_plans([load_plan(f) for f in plan_files])
+    except (ValueError, KeyError, TypeError) as e:
+        raise click.ClickException('Failed to merge plans: {0}'.format(e))
+    changes = merged['changes']
+    for change, symbol, fg in [('add', '+', 'green'), ('change', '~', 'yellow'),
+                               ('destroy', '-', 'red')]:
+        for resource in changes[change]:
+            echo('{0} {1}'.format(symbol, resource), prefix='  ', fg=fg,
+                 no_color=not ctx.obj['color'])
+    changed = any(changes.values())
+    if changed:
         echo()
+        echo(msg.MESSAGE_PLAN_SUMMARY.format(
+            len(changes['add']), len(changes['change']), len(changes['destroy'])))
+    else:
+        echo(msg.MESSAGE_SUMMARY_NO_CHANGE)
+    if merged['estimated_bytes']:
+        echo(format_estimate(merged['estimated_bytes']))
+    echo()
+    if output:
+        write_json(output, merged)
+    if changed and detailed_exitcode:
+        sys.exit(2)
 
 
 @cli.group(help=msg.HELP_COMMAND_DESTROY)
@@ -239,8 +1065,13 @@ def destroy(ctx):
               help=msg.HELP_OPTION_DATASET)
 @click.option('--exclude-dataset', '-e', type=str, required=False, multiple=True,
               help=msg.HELP_OPTION_EXCLUDE_DATASET)
+@click.option('--managed-only', is_flag=True, default=False,
+              help=msg.HELP_OPTION_MANAGED_ONLY)
 @click.pass_context
-def plan_destroy(ctx, conf_dir, detailed_exitcode, dataset, exclude_dataset):
+def plan_destroy(ctx, conf_dir, detailed_exitcode, dataset, exclude_dataset, managed_only):
+    from bqdm.action.dataset import DatasetAction
+    from bqdm.action.table import TableAction
+
     echo(msg.MESSAGE_PLAN_HEADER)
 
     destroy_counts = []
@@ -248,10 +1079,12 @@ def plan_destroy(ctx, conf_dir, detailed_exitcode, dataset, exclude_dataset):
         dataset_action = DatasetAction(e, project=ctx.obj['project'],
                                        credential_file=ctx.obj['credential_file'],
                                        no_color=not ctx.obj['color'],
-                                       debug=ctx.obj['debug'])
-        source_datasets = [d for d in as_completed(dataset_action.list_datasets(
-            dataset, exclude_dataset)) if d]
+                                       debug=ctx.obj['debug'],
+                                       batch_size=ctx.obj['batch_size'],
+                                       api_caller=ctx.obj['api_caller'])
         target_datasets = list_local_datasets(conf_dir, dataset, exclude_dataset)
+        source_datasets = _refresh_datasets(ctx, dataset_action, dataset, exclude_dataset,
+                                            managed_only, target_datasets)
         echo('------------------------------------------------------------------------')
         echo()
 
@@ -263,13 +1096,16 @@ def plan_destroy(ctx, conf_dir, detailed_exitcode, dataset, exclude_dataset):
                                        project=ctx.obj['project'],
                                        credential_file=ctx.obj['credential_file'],
                                        no_color=not ctx.obj['color'],
-                                       debug=ctx.obj['debug'])
-            source_tables = [t for t in as_completed(table_action.list_tables()) if t]
+                                       debug=ctx.obj['debug'],
+                                       batch_size=ctx.obj['batch_size'],
+                                       api_caller=ctx.obj['api_caller'])
+            source_tables = _refresh_tables(ctx, table_action)
             if source_tables:
                 echo('------------------------------------------------------------------------')
                 echo()
                 destroy_counts.append(table_action.plan_destroy(source_tables, []))
 
+    _echo_retry_summary(ctx)
     if not any(destroy_counts):
         echo(msg.MESSAGE_SUMMARY_NO_CHANGE)
         echo()
@@ -289,50 +1125,66 @@ def plan_destroy(ctx, conf_dir, detailed_exitcode, dataset, exclude_dataset):
               help=msg.HELP_OPTION_DATASET)
 @click.option('--exclude-dataset', '-e', type=str, required=False, multiple=True,
               help=msg.HELP_OPTION_EXCLUDE_DATASET)
+@click.option('--managed-only', is_flag=True, default=False,
+              help=msg.HELP_OPTION_MANAGED_ONLY)
 @click.pass_context
-def apply_destroy(ctx, conf_dir, auto_approve, dataset, exclude_dataset):
+def apply_destroy(ctx, conf_dir, auto_approve, dataset, exclude_dataset, managed_only):
+    from bqdm.action.dataset import DatasetAction
+    from bqdm.action.table import TableAction
+
+    # The resources refreshed before this apply are stale after it.
+    ctx.call_on_close(lambda: _clear_state_cache(ctx))
     # TODO Impl auto-approve option
+    results = ResultCollector()
     destroy_counts = []
     with ThreadPoolExecutor(max_workers=ctx.obj['parallelism']) as e:
         dataset_action = DatasetAction(e, project=ctx.obj['project'],
                                        credential_file=ctx.obj['credential_file'],
                                        no_color=not ctx.obj['color'],
-                                       debug=ctx.obj['debug'])
-        source_datasets = [d for d in as_completed(dataset_action.list_datasets(
-            dataset, exclude_dataset)) if d]
+                                       debug=ctx.obj['debug'],
+                                       batch_size=ctx.obj['batch_size'],
+                                       api_caller=ctx.obj['api_caller'])
         target_datasets = list_local_datasets(conf_dir, dataset, exclude_dataset)
+        source_datasets = [d for d in chain.from_iterable(as_completed(
+            dataset_action.list_datasets(dataset, exclude_dataset, managed_only,
+                                         [d.dataset_id for d in target_datasets]))) if d]
         echo('------------------------------------------------------------------------')
         echo()
 
-        fs = []
+        fs = dict()
         for d in target_datasets:
             table_action = TableAction(e, d.dataset_id,
                                        project=ctx.obj['project'],
                                        credential_file=ctx.obj['credential_file'],
                                        no_color=not ctx.obj['color'],
-                                       debug=ctx.obj['debug'])
-            source_tables = [t for t in as_completed(table_action.list_tables()) if t]
+                                       debug=ctx.obj['debug'],
+                                       batch_size=ctx.obj['batch_size'],
+                                       api_caller=ctx.obj['api_caller'])
+            source_tables = [t for t in chain.from_iterable(
+                as_completed(table_action.list_tables())) if t]
             if source_tables:
                 echo('------------------------------------------------------------------------')
                 echo()
                 destroy_count, destroy_fs = table_action.destroy(source_tables, [])
                 destroy_counts.append(destroy_count)
-                fs.extend(destroy_fs)
-        as_completed(fs)
+                fs.update(destroy_fs)
+        results.collect(fs)
 
-        fs = []
+        fs = dict()
         destroy_count, destroy_fs = dataset_action.intersection_destroy(
             source_datasets, target_datasets)
         destroy_counts.append(destroy_count)
-        fs.extend(destroy_fs)
-        as_completed(fs)
+        fs.update(destroy_fs)
+        results.collect(fs)
 
+    _echo_retry_summary(ctx)
     if not any(destroy_counts):
         echo(msg.MESSAGE_SUMMARY_NO_CHANGE)
         echo()
     else:
         echo(msg.MESSAGE_APPLY_DESTROY_SUMMARY.format(sum(destroy_counts)))
         echo()
+    _exit_with_failures(results)
 
 
 if __name__ == '__main__':
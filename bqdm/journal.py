@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import codecs
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class Journal(object):
+    """Write-ahead log of the migration steps of apply.
+
+    A step is recorded before it starts and again after it completes, and each record
+    is flushed to disk, so that an interrupted run can continue from the last completed
+    step. Without ``path`` the records are kept only in memory."""
+
+    BEGIN = 'begin'
+    DONE = 'done'
+    FINISHED = 'finished'
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._steps = self._load(path) if path else dict()
+
+    @staticmethod
+    def _truncate_torn_record(path):
+        """Removes the last record torn by an interruption, so that the records appended
+        next start on a line of their own."""
+        with open(path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    @staticmethod
+    def _load(path):
+        steps = dict()
+        if not os.path.exists(path):
+            return steps
+        Journal._truncate_torn_record(path)
+        with codecs.open(path, 'rb', 'utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record torn by an interruption.
+                    continue
+                resource = record['resource']
+                if record['state'] == Journal.FINISHED:
+                    steps.pop(resource, None)
+                else:
+                    steps.setdefault(resource, OrderedDict())[record['step']] = record
+        return steps
+
+    def _append(self, record):
+        with self._lock:
+            resource = record['resource']
+            if record['state'] == Journal.FINISHED:
+                self._steps.pop(resource, None)
+            else:
+                self._steps.setdefault(resource, OrderedDict())[record['step']] = record
+            if not self.path:
+                return
+            with codecs.open(self.path, 'ab', 'utf-8') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def pending(self):
+        """Returns the resources whose migration has not finished."""
+        with self._lock:
+            return sorted(self._steps.keys())
+
+    def get(self, resource, step):
+        with self._lock:
+            return self._steps.get(resource, dict()).get(step, None)
+
+    def begin(self, resource, step, **attrs):
+        self._append({'resource': resource, 'step': step, 'state': Journal.BEGIN,
+                      'attrs': attrs})
+
+    def done(self, resource, step, **attrs):
+        self._append({'resource': resource, 'step': step, 'state': Journal.DONE,
+                      'attrs': attrs})
+
+    def finish(self, resource):
+        self._append({'resource': resource, 'step': None, 'state': Journal.FINISHED})
+
+    def close(self):
+        """Removes the journal file if every migration has finished."""
+        if self.path and not self.pending() and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+
+_logger = logging.getLogger(__name__)
+_logger.addHandler(logging.StreamHandler(sys.stdout))
+_logger.setLevel(logging.INFO)
+
+RATE_LIMIT_REASONS = ('rateLimitExceeded', )
+
+
+def get_status_code(exception):
+    resp = getattr(exception, 'resp', None)
+    if resp is not None:
+        # googleapiclient.errors.HttpError
+        return getattr(resp, 'status', None)
+    code = getattr(exception, 'code', None)
+    return code if isinstance(code, int) else None
+
+
+def get_error_reasons(exception):
+    errors = getattr(exception, 'errors', None)
+    content = getattr(exception, 'content', None)
+    if not errors and content:
+        # googleapiclient.errors.HttpError
+        try:
+            if isinstance(content, bytes):
+                content = content.decode('utf-8')
+            errors = json.loads(content)['error']['errors']
+        except (ValueError, KeyError, TypeError):
+            errors = None
+    return tuple(e.get('reason', None) for e in errors or () if isinstance(e, dict))
+
+
+def is_rate_limit_error(exception):
+    if exception is None:
+        return False
+    if get_status_code(exception) == 429:
+        return True
+    return any(r in RATE_LIMIT_REASONS for r in get_error_reasons(exception))
+
+
+class AdaptiveLimiter(object):
+    """Concurrency limiter with additive increase and multiplicative decrease.
+
+    The limit grows by one per window of calls while the observed latency stays
+    close to the best latency seen so far, and is multiplied by ``backoff_ratio``
+    when the API reports a rate limit error."""
+
+    def __init__(self, name, max_limit, initial_limit=4, min_limit=1,
+                 backoff_ratio=0.5, latency_tolerance=2.0, smoothing=0.2):
+        assert max_limit >= min_limit >= 1, 'Invalid limit range.'
+        self.name = name
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._min_latency = None
+        self._avg_latency = None
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency=None, rate_limited=False):
+        with self._condition:
+            self._in_flight -= 1
+            if rate_limited:
+                self._decrease()
+            elif latency is not None:
+                self._update(latency)
+            self._condition.notify_all()
+
+    def _decrease(self):
+        limit = max(float(self.min_limit), self._limit * self.backoff_ratio)
+        if int(limit) != self.limit:
+            _logger.debug('Limiter {0}: rate limited, limit {1} -> {2}'.format(
+                self.name, self.limit, int(limit)))
+        self._limit = limit
+
+    def _update(self, latency):
+        if self._min_latency is None or latency < self._min_latency:
+            self._min_latency = latency
+        if self._avg_latency is None:
+            self._avg_latency = latency
+        else:
+            self._avg_latency += self.smoothing * (latency - self._avg_latency)
+        if self._avg_latency <= self._min_latency * self.latency_tolerance:
+            limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+            if int(limit) != self.limit:
+                _logger.debug('Limiter {0}: limit {1} -> {2}'.format(
+                    self.name, self.limit, int(limit)))
+            self._limit = limit
+
+
+class ConcurrencyLimiter(object):
+    """Separate adaptive limits for metadata reads, metadata writes and job submissions."""
+
+    READ = 'read'
+    WRITE = 'write'
+    JOB = 'job'
+
+    def __init__(self, max_limit):
+        self._limiters = {
+            ConcurrencyLimiter.READ: AdaptiveLimiter(ConcurrencyLimiter.READ, max_limit,
+                                                     initial_limit=8),
+            ConcurrencyLimiter.WRITE: AdaptiveLimiter(ConcurrencyLimiter.WRITE, max_limit),
+            ConcurrencyLimiter.JOB: AdaptiveLimiter(ConcurrencyLimiter.JOB, max_limit),
+        }
+
+    def __getitem__(self, kind):
+        return self._limiters[kind]
+
+
+class QuotaExceededError(Exception):
+    """The update quota of a resource does not allow the operation within the longest wait.
+    Retryable, the operation is not sent."""
+
+
+class ResourceQuota(object):
+    """Sliding window quota of operations per resource."""
+
+    def __init__(self, max_operations, window, max_wait=None):
+        self.max_operations = max_operations
+        self.window = window
+        self.max_wait = max_wait
+        self._history = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key):
+        """Records an operation on ``key`` if it is allowed now and returns 0,
+        otherwise returns the seconds until it may be allowed."""
+        with self._lock:
+            now = time.time()
+            history = self._history[key]
+            while history and history[0] <= now - self.window:
+                history.popleft()
+            if len(history) < self.max_operations:
+                history.append(now)
+                return 0
+            return history[0] + self.window - now
+
+    def acquire(self, key):
+        """Blocks until an operation on ``key`` is allowed and records it.
+
+        Raises ``QuotaExceededError`` instead of blocking longer than ``max_wait``."""
+        start = time.time()
+        while True:
+            wait = self.try_acquire(key)
+            if not wait:
+                return
+            if self.max_wait is not None and time.time() + wait - start > self.max_wait:
+                raise QuotaExceededError('Quota of {0} exceeded for {1:.2f}s.'.format(
+                    key, time.time() + wait - start))
+            _logger.debug('Quota of {0} exceeded, waiting {1:.2f}s.'.format(key, wait))
+            time.sleep(wait)
+
+
+class Timer(object):
+    """Calls functions after a delay from a single thread, for the callbacks submitting
+    the deferred tasks."""
+
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay, fn, *args):
+        with self._condition:
+            heapq.heappush(self._queue, (time.time() + delay, next(self._counter), fn, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='bqdm-timer')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue or self._queue[0][0] > time.time():
+                    self._condition.wait(
+                        max(self._queue[0][0] - time.time(), 0) if self._queue else None)
+                _, _, fn, args = heapq.heappop(self._queue)
+            try:
+                fn(*args)
+            except Exception as e:
+                _logger.warning('Deferred call failed: {0}'.format(e))
+
+
+class QuotaScheduler(object):
+    """Delays metadata updates to stay within the per-table and per-dataset quotas.
+
+    Tasks submitted by ``submit`` wait for the quota of their resource in a queue of the
+    resource instead of a thread of the executor, and are started in the order submitted.
+    The updates made by the tasks themselves wait at most ``max_wait`` seconds.
+
+    https://cloud.google.com/bigquery/quotas#dataset_limits
+    https://cloud.google.com/bigquery/quotas#standard_tables
+    https://cloud.google.com/bigquery/quotas#partitioned_tables"""
+
+    acquired_ttl = 1.0
+
+    def __init__(self, table_quota=(5, 10), dataset_quota=(5, 10), partition_quota=(50, 10),
+                 max_wait=10.0):
+        self._table_quota = ResourceQuota(*table_quota, max_wait=max_wait)
+        self._dataset_quota = ResourceQuota(*dataset_quota, max_wait=max_wait)
+        self._partition_quota = ResourceQuota(*partition_quota, max_wait=max_wait)
+        self._waiting = defaultdict(deque)
+        self._active = set()
+        self._lock = threading.Lock()
+        self._timer = Timer()
+        self._local = threading.local()
+
+    def _quota(self, resource):
+        # Updates of partitions (``table$YYYYMMDD``) share the partition quota of their table.
+        if '$' in resource:
+            return self._partition_quota, resource.split('$', 1)[0]
+        elif '/tables/' in resource:
+            return self._table_quota, resource
+        else:
+            return self._dataset_quota, resource
+
+    def acquire(self, resource):
+        """Acquires an update of ``resource``, the API path of a table or a dataset."""
+        acquired = getattr(self._local, 'acquired', None)
+        if acquired and acquired[0] == resource:
+            self._local.acquired = None
+            # Acquired when the task submitted for the resource was started, unless the task
+            # waited for something else since, the update is then counted at its time.
+            if time.time() - acquired[1] < self.acquired_ttl:
+                return
+        quota, key = self._quota(resource)
+        quota.acquire(key)
+
+    def submit(self, executor, resource, fn, *args, **kwargs):
+        """Submits the task ``fn`` updating ``resource`` to ``executor`` once the quota of
+        ``resource`` allows an update, and returns its future. The first update of
+        ``resource`` made by the task uses the update acquired."""
+        quota, key = self._quota(resource)
+        queue = (id(quota), key)
+        future = Future()
+        with self._lock:
+            self._waiting[queue].append((future, executor, resource, fn, args, kwargs))
+            if queue in self._active:
+                return future
+            self._active.add(queue)
+        self._next(queue)
+        return future
+
+    def _next(self, queue):
+        with self._lock:
+            if not self._waiting[queue]:
+                self._active.discard(queue)
+                del self._waiting[queue]
+                return
+            task = self._waiting[queue].popleft()
+        future, executor = task[:2]
+        try:
+            executor.submit(self._start, queue, task)
+        except Exception as e:
+            # The executor is shut down.
+            future.set_exception(e)
+            self._next(queue)
+
+    def _start(self, queue, task):
+        future, _, resource, fn, args, kwargs = task
+        quota, key = self._quota(resource)
+        wait = quota.try_acquire(key)
+        if wait:
+            # Back to the head of the queue, the thread is returned to the executor.
+            with self._lock:
+                self._waiting[queue].appendleft(task)
+            self._timer.call_later(wait, self._next, queue)
+            return
+        self._next(queue)
+        if not future.set_running_or_notify_cancel():
+            return
+        self._local.acquired = (resource, time.time())
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self._local.acquired = None
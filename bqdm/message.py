@@ -10,12 +10,25 @@ HELP_COMMAND_APPLY = 'Builds or changes datasets.'
 HELP_COMMAND_DESTROY = 'Specify subcommand `plan` or `apply`'
 HELP_COMMAND_PLAN_DESTROY = 'Generate and show an execution plan for datasets destruction.'
 HELP_COMMAND_APPLY_DESTROY = 'Destroy managed datasets.'
+HELP_COMMAND_SERVE = 'Serve plan and apply requests over a Unix socket.'
+HELP_COMMAND_MERGE_PLANS = 'Merge the plans of all shards written by `plan --plan-output`.'
 
 HELP_OPTION_CREDENTIAL_FILE = 'Location of credential file for service accounts.'
 HELP_OPTION_PROJECT = 'Project ID for the project which you’d like to manage with.'
 HELP_OPTION_COLOR = 'Enables output with coloring.'
-HELP_OPTION_PARALLELISM = 'Limit the number of concurrent operation.'
+HELP_OPTION_PARALLELISM = """Upper bound of the number of concurrent operation.
+The concurrency is adjusted within this bound by the API latency and rate limit errors."""
+HELP_OPTION_BATCH_SIZE = 'Number of resources to fetch in a single batch request.'
+HELP_OPTION_MAX_ATTEMPTS = 'Maximum number of attempts of an API call with transient errors.'
+HELP_OPTION_CALL_DEADLINE = 'Maximum seconds to spend on an API call including its retries.'
+HELP_OPTION_RUN_DEADLINE = 'Maximum seconds of the whole run. No API call is started after it.'
 HELP_OPTION_DEBUG = 'Debug output management.'
+HELP_OPTION_PROFILE = 'Print the time spent in each phase and the latency of each API method.'
+HELP_OPTION_PROFILE_OUTPUT = 'Write the cProfile statistics of the run to the file.'
+HELP_OPTION_TRACE_FILE = 'Write the phases and API calls to the file.'
+HELP_OPTION_METRICS_FILE = 'Write the metrics of the run to the file in Prometheus text format.'
+HELP_OPTION_METRICS_PUSH_URL = 'Push the metrics of the run to the Prometheus Pushgateway.'
+HELP_OPTION_TRACE_FORMAT = 'Format of the trace file, Chrome trace events or OTLP/JSON spans.'
 HELP_OPTION_OUTPUT_DIR = 'Directory path to output YAML files.'
 HELP_OPTION_CONF_DIR = 'Directory path where YAML files located.'
 HELP_OPTION_DETAILED_EXIT_CODE = """Return a detailed exit code when the command exits.
@@ -30,7 +43,48 @@ Choice from `select_insert`, `select_insert_backup`, `replace`, `replace_backup`
 `drop_create`, `drop_create_backup`."""
 HELP_OPTION_DATASET = 'Specify the ID of the dataset to manage.'
 HELP_OPTION_BACKUP_DATASET = 'Specify the ID of the dataset to store the backup at migration'
+HELP_OPTION_BACKUP_TYPE = """Specify how to back up at migration.
+Choice from `copy`, `snapshot`.
+`snapshot` falls back to `copy` when the snapshot is rejected."""
+HELP_OPTION_BACKUP_EXPIRATION = 'Number of days after which the backup table expires.'
+HELP_OPTION_PARTITION_PARALLELISM = """Number of partitions to migrate concurrently in the run
+when both the table and the new definition are partitioned by day."""
+HELP_OPTION_MAX_BYTES_BILLED = """Refuse to apply if the migration queries are estimated
+to process more bytes than this, and limit the bytes billed of each query."""
+HELP_OPTION_MAX_CONCURRENT_JOBS = """Maximum number of query and copy jobs of migration
+running at the same time. Larger tables are started first."""
+HELP_OPTION_MAX_SLOTS = """Number of BigQuery slots interactive migration jobs may use together.
+New jobs wait while the jobs running are expected to use more."""
+HELP_OPTION_PRIORITY = """Priority of migration queries. Choice from `interactive`, `batch`.
+BATCH queries wait in the queue until idle slots are available."""
+HELP_OPTION_TABLE_PRIORITY = """Priority of the migration queries of a table
+in DATASET.TABLE=PRIORITY format. Can be repeated."""
+HELP_OPTION_VERIFY = """Verify the migrated tables by comparing the number of rows
+of the table and each partition from the table metadata, without scanning data."""
+HELP_OPTION_FAILURES_FILE = 'File to write the IDs of the resources failed to apply.'
+HELP_OPTION_RETRY_FAILED = """Apply only the resources listed in the file
+written by the `--failures-file` option of the previous run."""
+HELP_OPTION_WATCH = 'Plan again the datasets and tables whose configuration files are changed.'
+HELP_OPTION_SHARD = """Manage only the INDEX th of COUNT shards of the datasets
+in INDEX/COUNT format, such as 1/4. Datasets are assigned to shards by their IDs."""
+HELP_OPTION_SHARD_WEIGHTS = """Merged plan of a previous run to balance the shards
+by the number of tables of the datasets."""
+HELP_OPTION_PLAN_OUTPUT = 'Write the plan of the shard to the file in JSON format.'
+HELP_OPTION_MERGED_PLAN_OUTPUT = """Write the merged plan to the file in JSON format,
+to be passed to `--shard-weights` of the next run."""
+HELP_OPTION_MULTI_PROJECT = """CONF_DIR has a directory of the configuration files
+of each project. The projects are refreshed and applied at the same time."""
+HELP_OPTION_SOCKET = 'Path of the Unix socket to listen on.'
+HELP_OPTION_CACHE_TTL = 'Seconds to reuse the datasets and tables refreshed by plan.'
+HELP_OPTION_JOURNAL_FILE = 'File to record the migration steps to resume an interrupted apply.'
+HELP_OPTION_RESUME = 'Continue the migrations interrupted in the previous apply from the journal.'
+HELP_OPTION_RUN_ID = """ID of the run to derive the IDs of migration jobs from.
+A rerun with the same ID adopts the jobs already started instead of starting them again."""
+HELP_OPTION_JOB_ID_PREFIX = 'Prefix of the IDs of migration jobs.'
+HELP_OPTION_JOB_LABEL = 'Label to set to migration jobs in KEY=VALUE format. Can be repeated.'
 HELP_OPTION_EXCLUDE_DATASET = 'Specify the ID of the dataset to exclude from managed.'
+HELP_OPTION_MANAGED_ONLY = """Refresh only datasets labelled as managed by apply
+and datasets defined in the configuration files."""
 
 MESSAGE_PLAN_HEADER = """An execution plan has been generated and is shown below.
 
@@ -48,3 +102,23 @@ MESSAGE_PLAN_DESTROY_SUMMARY = 'Plan: {0} to destroy'
 MESSAGE_APPLY_SUMMARY = 'Apply: {0} added, {1} changed, {2} destroyed'
 MESSAGE_APPLY_DESTROY_SUMMARY = 'Destroy: {0} destroyed'
 MESSAGE_SUMMARY_NO_CHANGE = 'No changes. Dataset and table is up-to-date.'
+MESSAGE_FAILURE_SUMMARY = 'Error: {0} resources failed, {1} succeeded'
+MESSAGE_MAX_BYTES_BILLED_EXCEEDED = """Error: Migration queries are estimated to process {0},
+which exceeds `--max-bytes-billed` {1}."""
+MESSAGE_JOURNAL_PENDING = """Error: Journal {0} has unfinished migrations: {1}
+Run apply with `--resume` to continue them."""
+MESSAGE_PROJECT_HEADER = 'Project: {0}'
+MESSAGE_PROJECT_ABORTED = 'Aborted before applying.'
+MESSAGE_MULTI_PROJECT_UNSUPPORTED = '{0} cannot be used with --multi-project.'
+MESSAGE_SCHEDULE_HEADER = 'Migration schedule (largest first):'
+MESSAGE_JOB_SUMMARY = 'Jobs: {0} jobs, {1:.2f} slot hours, {2:.1f} slots on average'
+MESSAGE_BATCH_JOB_SUMMARY = 'Batch: {0} jobs, {1:.1f}s waited in the queue'
+MESSAGE_TIMING_SUMMARY = 'Timing: {0}'
+MESSAGE_PROFILE_PHASE_HEADER = 'Profile phases (wall, cpu):'
+MESSAGE_PROFILE_CALL_HEADER = 'Profile API calls (calls, errors, p50, p90, p99):'
+MESSAGE_WATCH_WAITING = 'Watching {0} for changes... (Ctrl-C to stop)'
+MESSAGE_WATCH_CHANGED = 'Changed: {0}'
+MESSAGE_WATCH_ERROR = 'Failed to plan the changes, waiting for the next change: {0}'
+MESSAGE_WATCH_SERVING = '--watch cannot be used with a served command.'
+MESSAGE_ALREADY_SERVING = 'Cannot serve from a served command.'
+MESSAGE_RETRY_SUMMARY = 'Retry: {0} retries of API calls, {1:.1f}s spent backing off'
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+METRICS = OrderedDict([
+    ('bqdm_resources_refreshed', 'Number of datasets and tables refreshed from BigQuery.'),
+    ('bqdm_drift', 'Number of datasets and tables differing from the configuration.'),
+    ('bqdm_api_calls', 'Number of BigQuery API calls.'),
+    ('bqdm_api_errors', 'Number of failed BigQuery API calls.'),
+    ('bqdm_api_retries', 'Number of retries of BigQuery API calls.'),
+    ('bqdm_phase_duration_seconds', 'Wall time spent in each phase.'),
+    ('bqdm_run_duration_seconds', 'Wall time of the run.'),
+    ('bqdm_last_run_timestamp_seconds', 'Time the run finished.'),
+])
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+class Metrics(object):
+    """Gauges of a run in the Prometheus text format.
+
+    Every sample is labelled with ``project``, the project of the run unless given with
+    the sample. The metrics are written to a file for the textfile collector of the node
+    exporter or pushed to a Pushgateway."""
+
+    def __init__(self, project):
+        self.project = project
+        self._samples = OrderedDict((name, OrderedDict()) for name in METRICS)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        labels = dict({'project': self.project or ''}, **labels)
+        return tuple(sorted(labels.items()))
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._samples[name][self._key(labels)] = value
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._samples[name][key] = self._samples[name].get(key, 0) + value
+
+    def get(self, name, **labels):
+        with self._lock:
+            return self._samples[name].get(self._key(labels), None)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, samples in self._samples.items():
+                if not samples:
+                    continue
+                lines.append('# HELP {0} {1}'.format(name, METRICS[name]))
+                lines.append('# TYPE {0} gauge'.format(name))
+                for key, value in samples.items():
+                    lines.append('{0}{{{1}}} {2}'.format(name, ','.join(
+                        '{0}="{1}"'.format(k, _escape(v)) for k, v in key),
+                        _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Writes the metrics to the file, replacing it atomically so that the collector
+        does not read a partially written file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.bqdm', suffix='.prom')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.render().encode('utf-8'))
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def push(self, url, job='bqdm', timeout=10):
+        """Replaces the metrics of the job and project on the Pushgateway at ``url``.
+
+        Without a project, as in a run of several projects, the metrics of the job are
+        replaced."""
+        from future.moves.urllib.parse import quote
+        from future.moves.urllib.request import Request, urlopen
+
+        path = '/metrics/job/{0}'.format(quote(job, safe=''))
+        if self.project:
+            path += '/project/{0}'.format(quote(self.project, safe=''))
+        request = Request(url.rstrip('/') + path,
+                          data=self.render().encode('utf-8'),
+                          headers={'Content-Type': 'text/plain; version=0.0.4'})
+        request.get_method = lambda: 'PUT'
+        urlopen(request, timeout=timeout).close()
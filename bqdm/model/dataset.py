@@ -3,10 +3,28 @@ from __future__ import absolute_import
 
 from collections import OrderedDict
 
+from future.utils import iteritems
 from google.cloud.bigquery import DatasetReference
 from google.cloud.bigquery.dataset import AccessEntry, Dataset
 
 
+MANAGED_LABEL_KEY = 'bqdm-managed'
+MANAGED_LABEL_VALUE = 'true'
+MANAGED_LABEL_FILTER = 'labels.{0}:{1}'.format(MANAGED_LABEL_KEY, MANAGED_LABEL_VALUE)
+
+# Partial response selector for the dataset resource.
+# Only the fields read by `BigQueryDataset.from_dataset` are requested.
+DATASET_RESOURCE_FIELDS = ','.join([
+    'datasetReference',
+    'friendlyName',
+    'description',
+    'defaultTableExpirationMs',
+    'location',
+    'access',
+    'labels',
+])
+
+
 class BigQueryAccessEntry(object):
 
     def __init__(self, role, entity_type, entity_id):
@@ -68,7 +86,7 @@ class BigQueryDataset(object):
 
     def __init__(self, dataset_id, friendly_name=None, description=None,
                  default_table_expiration_ms=None, location=None,
-                 access_entries=None, labels=None):
+                 access_entries=None, labels=None, managed=None):
         self.dataset_id = dataset_id
         self.friendly_name = friendly_name
         self.description = description
@@ -76,6 +94,9 @@ class BigQueryDataset(object):
         self.location = location
         self.access_entries = tuple(access_entries) if access_entries else None
         self.labels = labels if labels else None
+        # Whether the dataset is labelled as managed by apply, read at refresh,
+        # not a part of the configuration.
+        self.managed = managed
 
     @staticmethod
     def from_dict(value):
@@ -96,6 +117,8 @@ class BigQueryDataset(object):
     def from_dataset(dataset):
         access_entries = tuple(BigQueryAccessEntry.from_access_entry(a)
                                for a in dataset.access_entries) if dataset.access_entries else None
+        labels = dict((k, v) for k, v in iteritems(dataset.labels)
+                      if k != MANAGED_LABEL_KEY) if dataset.labels else None
         return BigQueryDataset(
             dataset_id=dataset.dataset_id,
             friendly_name=dataset.friendly_name,
@@ -103,7 +126,9 @@ class BigQueryDataset(object):
             default_table_expiration_ms=dataset.default_table_expiration_ms,
             location=dataset.location,
             access_entries=access_entries,
-            labels=dataset.labels)
+            labels=labels,
+            managed=bool(dataset.labels) and
+            dataset.labels.get(MANAGED_LABEL_KEY, None) == MANAGED_LABEL_VALUE)
 
     @staticmethod
     def to_dataset(project, model):
@@ -7,12 +7,26 @@ from google.cloud.bigquery.table import Table
 from bqdm.model.schema import BigQuerySchemaField
 from bqdm.util import parse_expires
 
+# Partial response selector for the table resource.
+# Only the fields read by `BigQueryTable.from_table` are requested.
+TABLE_RESOURCE_FIELDS = ','.join([
+    'tableReference',
+    'friendlyName',
+    'description',
+    'expirationTime',
+    'timePartitioning',
+    'view',
+    'schema',
+    'labels',
+    'numBytes',
+])
+
 
 class BigQueryTable(object):
 
     def __init__(self, table_id, friendly_name=None, description=None,
                  expires=None, partitioning_type=None, view_use_legacy_sql=None,
-                 view_query=None, schema=None, labels=None):
+                 view_query=None, schema=None, labels=None, num_bytes=None):
         # TODO encryption_configuration
         # TODO external_data_configuration
         self.table_id = table_id
@@ -24,6 +38,8 @@ class BigQueryTable(object):
         self.view_query = view_query
         self.schema = tuple(schema) if schema else None
         self.labels = labels if labels else None
+        # Size of the table read at refresh, not a part of the configuration.
+        self.num_bytes = num_bytes
 
     @staticmethod
     def from_dict(value):
@@ -57,7 +73,8 @@ class BigQueryTable(object):
             view_use_legacy_sql=table.view_use_legacy_sql if table.view_query else None,
             view_query=table.view_query if table.view_query else None,
             schema=None if table.view_query else schema,
-            labels=table.labels)
+            labels=table.labels,
+            num_bytes=table.num_bytes)
 
     @staticmethod
     def to_table(dataset_ref, model):
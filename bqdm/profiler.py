@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from bqdm.tracing import TRACER
+
+try:
+    _thread_time = time.thread_time
+except AttributeError:
+    # Python 2
+    _thread_time = time.clock
+
+
+def percentile(values, q):
+    """Returns the ``q`` th percentile of ``values`` with the nearest-rank method."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(q / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def api_method_name(fn):
+    owner = getattr(fn, '__self__', None)
+    method_id = getattr(owner, 'methodId', None)
+    if method_id:
+        # googleapiclient.http.HttpRequest
+        return method_id
+    if owner is not None and type(owner).__name__ == 'BatchHttpRequest':
+        return 'batch'
+    return getattr(fn, '__name__', repr(fn))
+
+
+class Profiler(object):
+    """Collects the wall and CPU time of each phase and the latency of each API method.
+
+    The time of a phase excludes the phases nested in it on the same thread, so that
+    the phases add up to the time spent by all threads."""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+        self._wall = OrderedDict()
+        self._cpu = OrderedDict()
+        self._calls = defaultdict(int)
+        self._latencies = defaultdict(list)
+        self._errors = defaultdict(int)
+        self._events = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._origin = time.time()
+
+    def enable(self, trace=False):
+        self.enabled = True
+        self.trace = trace
+        self._origin = time.time()
+
+    def reset(self):
+        """Disables the profiler and discards what it collected."""
+        with self._lock:
+            self.enabled = False
+            self.trace = False
+            self._wall.clear()
+            self._cpu.clear()
+            self._calls.clear()
+            self._latencies.clear()
+            self._errors.clear()
+            self._events = []
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add_event(self, name, category, start, end, args=None):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int((start - self._origin) * 1000000),
+            'dur': int((end - start) * 1000000),
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+
+    def _accumulate(self, frame, wall, cpu):
+        with self._lock:
+            self._wall[frame['name']] = self._wall.get(frame['name'], 0.0) + \
+                wall - frame['wall']
+            self._cpu[frame['name']] = self._cpu.get(frame['name'], 0.0) + \
+                cpu - frame['cpu']
+
+    def enter(self, name):
+        wall, cpu = time.time(), _thread_time()
+        stack = self._stack()
+        if stack:
+            self._accumulate(stack[-1], wall, cpu)
+        stack.append({'name': name, 'wall': wall, 'cpu': cpu, 'start': wall})
+
+    def exit(self):
+        wall, cpu = time.time(), _thread_time()
+        stack = self._stack()
+        frame = stack.pop()
+        self._accumulate(frame, wall, cpu)
+        if stack:
+            stack[-1]['wall'], stack[-1]['cpu'] = wall, cpu
+        if self.trace:
+            self._add_event(frame['name'], 'phase', frame['start'], wall)
+
+    def phase(self, name):
+        """Decorator measuring the calls of the function as the phase ``name``."""
+        def decorator(wrapped):
+            @functools.wraps(wrapped)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return wrapped(*args, **kwargs)
+                self.enter(name)
+                try:
+                    return wrapped(*args, **kwargs)
+                finally:
+                    self.exit()
+            return wrapper
+        return decorator
+
+    def record_call(self, method, start, end, error=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._calls[method] += 1
+            self._latencies[method].append(end - start)
+            if error is not None:
+                self._errors[method] += 1
+        if self.trace:
+            args = {'error': str(error)} if error is not None else None
+            self._add_event(method, 'api', start, end, args)
+
+    def phases(self):
+        with self._lock:
+            return [(name, self._wall[name], self._cpu[name]) for name in self._wall]
+
+    def calls(self):
+        """Returns the count, errors and the 50/90/99th percentile latencies of each method."""
+        with self._lock:
+            return [(method, self._calls[method], self._errors[method],
+                     percentile(self._latencies[method], 50),
+                     percentile(self._latencies[method], 90),
+                     percentile(self._latencies[method], 99))
+                    for method in sorted(self._calls)]
+
+    def write_trace(self, path):
+        """Writes the phases and API calls in the Chrome trace event format."""
+        with self._lock:
+            events = list(self._events)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+PROFILER = Profiler()
+
+
+def phase(name):
+    """Decorator measuring the calls of the function as the phase ``name`` and tracing
+    them as spans of the phase."""
+    def decorator(wrapped):
+        profiled = PROFILER.phase(name)(wrapped)
+
+        @functools.wraps(wrapped)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return profiled(*args, **kwargs)
+            with TRACER.span(name):
+                return profiled(*args, **kwargs)
+        return wrapper
+    return decorator
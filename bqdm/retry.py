@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+import random
+import socket
+import sys
+import threading
+import time
+
+from bqdm.limiter import (QuotaExceededError, get_error_reasons, get_status_code,
+                          is_rate_limit_error)
+
+_logger = logging.getLogger(__name__)
+_logger.addHandler(logging.StreamHandler(sys.stdout))
+_logger.setLevel(logging.INFO)
+
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+RETRYABLE_REASONS = ('backendError', 'internalError', 'rateLimitExceeded')
+
+try:
+    _CONNECTION_ERRORS = (ConnectionError, socket.timeout)
+except NameError:
+    # Python 2
+    _CONNECTION_ERRORS = (socket.error, )
+
+
+def is_retryable_error(exception):
+    if isinstance(exception, _CONNECTION_ERRORS + (QuotaExceededError, )):
+        return True
+    if is_rate_limit_error(exception):
+        return True
+    if get_status_code(exception) in RETRYABLE_STATUS_CODES:
+        return True
+    return any(r in RETRYABLE_REASONS for r in get_error_reasons(exception))
+
+
+class Retry(object):
+    """Retries transient API errors with exponential backoff and full jitter.
+
+    ``deadline`` bounds the time spent on a single call including its retries,
+    ``run_deadline`` is the epoch time after which no call is started or retried.
+    ``retries`` counts the retries of all calls, not the calls retried."""
+
+    def __init__(self, max_attempts=5, initial_delay=1.0, max_delay=32.0, multiplier=2.0,
+                 deadline=None, run_deadline=None):
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.deadline = deadline
+        self.run_deadline = run_deadline
+        self._retries = 0
+        self._backoff = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def retries(self):
+        return self._retries
+
+    @property
+    def backoff(self):
+        return self._backoff
+
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.max_delay,
+                                     self.initial_delay * self.multiplier ** (attempt - 1)))
+
+    def _check_run_deadline(self, now):
+        if self.run_deadline is not None and now >= self.run_deadline:
+            raise RuntimeError('Run deadline exceeded.')
+
+    def call(self, fn, *args, **kwargs):
+        start = time.time()
+        self._check_run_deadline(start)
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if not is_retryable_error(e) or attempt >= self.max_attempts:
+                    raise
+                delay = self._delay(attempt)
+                now = time.time()
+                if self.deadline is not None and now + delay - start > self.deadline:
+                    raise
+                if self.run_deadline is not None and now + delay > self.run_deadline:
+                    raise
+                with self._lock:
+                    self._retries += 1
+                    self._backoff += delay
+                _logger.info('Retrying in {0:.2f}s ({1}/{2}): {3}'.format(
+                    delay, attempt, self.max_attempts - 1, e))
+                time.sleep(delay)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+
+class JobScheduler(object):
+    """Caps the number of query and copy jobs running at the same time.
+
+    Waiting jobs are started in descending order of ``priority``, the size of the table
+    they migrate, so that the largest migrations do not start last and set the total time.
+    BATCH priority queries wait in the queue of BigQuery, so they are capped separately and
+    do not hold the slots of interactive jobs. ``max_slots`` is a hint of the number of
+    BigQuery slots interactive jobs may use together, it is compared with the average slots
+    used by the finished jobs."""
+
+    def __init__(self, max_jobs=10, max_slots=None):
+        assert max_jobs >= 1, 'Invalid max jobs.'
+        self.max_jobs = max_jobs
+        self.max_slots = max_slots
+        self._running = {False: 0, True: 0}
+        self._waiting = {False: [], True: []}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._jobs = 0
+        self._batch_jobs = 0
+        self._slot_millis = 0
+        self._queued_seconds = 0.0
+        self._job_slots = None
+        self._started = None
+        self._ended = None
+
+    @property
+    def running(self):
+        return self._running[False] + self._running[True]
+
+    def _admissible(self, batch):
+        if self._running[batch] >= self.max_jobs:
+            return False
+        if batch or self.max_slots is None or self._job_slots is None \
+                or self._running[False] == 0:
+            return True
+        return (self._running[False] + 1) * self._job_slots <= self.max_slots
+
+    def acquire(self, priority=0, batch=False):
+        with self._condition:
+            entry = (-priority, next(self._counter))
+            waiting = self._waiting[batch]
+            heapq.heappush(waiting, entry)
+            while waiting[0] != entry or not self._admissible(batch):
+                self._condition.wait()
+            heapq.heappop(waiting)
+            self._running[batch] += 1
+            if self._started is None:
+                self._started = time.time()
+            self._condition.notify_all()
+
+    def release(self, batch=False):
+        with self._condition:
+            self._running[batch] -= 1
+            self._ended = time.time()
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority=0, batch=False):
+        self.acquire(priority, batch)
+        try:
+            yield
+        finally:
+            self.release(batch)
+
+    def record(self, job):
+        """Records the slot time consumed by the finished job and the time it was queued."""
+        properties = job._properties if job is not None else dict()
+        statistics = properties.get('statistics', dict())
+        configuration = properties.get('configuration', dict())
+        slot_millis = int(statistics.get('totalSlotMs', 0) or 0)
+        created = int(statistics.get('creationTime', 0) or 0)
+        started = int(statistics.get('startTime', 0) or 0)
+        ended = int(statistics.get('endTime', 0) or 0)
+        with self._condition:
+            self._jobs += 1
+            self._slot_millis += slot_millis
+            if configuration.get('query', dict()).get('priority', None) == 'BATCH':
+                self._batch_jobs += 1
+                if created and started:
+                    self._queued_seconds += (started - created) / 1000.0
+            elif started and ended > started:
+                job_slots = float(slot_millis) / (ended - started)
+                if self._job_slots is None:
+                    self._job_slots = job_slots
+                else:
+                    self._job_slots += 0.2 * (job_slots - self._job_slots)
+            self._condition.notify_all()
+
+    def utilization(self):
+        """Returns the number of jobs, the total slot seconds and the average number of slots
+        in use while jobs were running."""
+        with self._condition:
+            if self._started is None or self._ended is None:
+                return self._jobs, 0.0, 0.0
+            elapsed = self._ended - self._started
+            slot_seconds = self._slot_millis / 1000.0
+            return self._jobs, slot_seconds, slot_seconds / elapsed if elapsed > 0 else 0.0
+
+    def batch_summary(self):
+        """Returns the number of BATCH jobs and the total seconds they waited in the queue."""
+        with self._condition:
+            return self._batch_jobs, self._queued_seconds
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import socket
+import stat
+import sys
+
+_logger = logging.getLogger(__name__)
+_logger.addHandler(logging.StreamHandler(sys.stdout))
+_logger.setLevel(logging.INFO)
+
+
+def _remove_stale_socket(socket_path):
+    if not os.path.exists(socket_path):
+        return
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        raise RuntimeError('{0} exists and is not a socket.'.format(socket_path))
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except socket.error:
+        # Left by a server that did not shut down.
+        os.remove(socket_path)
+        return
+    finally:
+        client.close()
+    raise RuntimeError('Another server is listening on {0}.'.format(socket_path))
+
+
+def _reset():
+    """Resets the state of the process left by the previous request, so that the profile,
+    the trace, the metrics and the log level of a request are of the request only."""
+    from bqdm.profiler import PROFILER
+    from bqdm.tracing import TRACER
+
+    PROFILER.reset()
+    TRACER.reset()
+    for name, logger in list(logging.Logger.manager.loggerDict.items()):
+        if name.split('.')[0] == 'bqdm' and isinstance(logger, logging.Logger):
+            logger.setLevel(logging.INFO)
+
+
+class _Output(object):
+    """Output of a request."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data.decode('utf-8') if isinstance(data, bytes) else data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+
+class _OutputRouter(object):
+    """Standard output of the server process, written to the output of the request being
+    handled, by every thread of the command and by the loggers of ``bqdm``, and to the
+    standard output of the process between requests."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.output = None
+        self.color = False
+
+    def write(self, data):
+        (self.output if self.output is not None else self._stream).write(data)
+
+    def flush(self):
+        if self.output is None:
+            self._stream.flush()
+
+    def isatty(self):
+        # Colors are kept as requested, also in the output of the executor threads.
+        return self.color if self.output is not None else self._stream.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def install(self):
+        sys.stdout = self
+        self._retarget(self._stream, self)
+
+    def uninstall(self):
+        sys.stdout = self._stream
+        self._retarget(self, self._stream)
+
+    @staticmethod
+    def _retarget(old, new):
+        # The loggers of the modules bind the standard output when imported.
+        for name, logger in list(logging.Logger.manager.loggerDict.items()):
+            if name.split('.')[0] != 'bqdm' or not isinstance(logger, logging.Logger):
+                continue
+            for handler in logger.handlers:
+                if isinstance(handler, logging.StreamHandler) and handler.stream is old:
+                    handler.acquire()
+                    try:
+                        handler.stream = new
+                    finally:
+                        handler.release()
+
+
+def _invoke(args, state_cache, color, terminal_width, output):
+    import click
+    from bqdm.cli import cli
+
+    try:
+        result = cli.main(args, prog_name='bqdm', standalone_mode=False,
+                          obj={'state_cache': state_cache, 'server': True}, color=color,
+                          terminal_width=terminal_width)
+        return result if isinstance(result, int) else 0, None
+    except click.ClickException as e:
+        e.show(file=output)
+        return e.exit_code, None
+    except click.Abort:
+        output.write('Aborted!\n')
+        return 1, None
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0, None
+        output.write('{0}\n'.format(e.code))
+        return 1, None
+    except Exception as e:
+        return 1, '{0}: {1}'.format(type(e).__name__, e)
+
+
+def handle(line, state_cache, router):
+    """Runs the command of the request line and returns the response.
+
+    The request is a JSON object with ``args``, the arguments of ``bqdm``, and
+    optionally ``color`` and ``terminal_width``, the width of the help. The response
+    is a JSON object with the ``output`` and the ``exit_code`` of the command, and
+    the ``error`` if the command raised."""
+    try:
+        request = json.loads(line.decode('utf-8'))
+        args = request['args']
+        if not isinstance(args, list):
+            raise ValueError('args must be a list.')
+    except (ValueError, KeyError, TypeError) as e:
+        return {'output': '', 'exit_code': 2, 'error': 'Invalid request: {0}'.format(e)}
+    _reset()
+    output = _Output()
+    router.output, router.color = output, bool(request.get('color', False))
+    try:
+        exit_code, error = _invoke(args, state_cache, router.color,
+                                   request.get('terminal_width', None), output)
+    finally:
+        router.output = None
+    response = {'output': output.getvalue(), 'exit_code': exit_code}
+    if error is not None:
+        response['error'] = error
+    return response
+
+
+def make_server(socket_path, cache_ttl=300):
+    """Returns the server of the commands sent to the Unix socket.
+
+    The commands share the BigQuery clients, the parsed configuration files and the
+    remote state cache of the process. They run one at a time, since the standard output
+    of the process is routed to the output of the command until the server is closed."""
+    from future.moves import socketserver
+    from bqdm.cache import StateCache
+
+    state_cache = StateCache(cache_ttl)
+    router = _OutputRouter(sys.stdout)
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            response = handle(line, state_cache, router)
+            _logger.info('Served a request, exit code: {0}'.format(response['exit_code']))
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+    class Server(socketserver.UnixStreamServer):
+
+        def server_close(self):
+            socketserver.UnixStreamServer.server_close(self)
+            router.uninstall()
+
+    _remove_stale_socket(socket_path)
+    server = Server(socket_path, Handler)
+    os.chmod(socket_path, 0o600)
+    router.install()
+    return server
+
+
+def serve(socket_path, cache_ttl=300):
+    """Serves the commands sent to the Unix socket until interrupted."""
+    server = make_server(socket_path, cache_ttl)
+    _logger.info('Listening on {0}'.format(socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def _terminal_width():
+    """Width of the help in the terminal, as click formats it when run from the terminal."""
+    try:
+        from shutil import get_terminal_size
+    except ImportError:
+        # Python 2
+        return None
+    return max(min(get_terminal_size().columns, 80) - 2, 50)
+
+
+def request(socket_path, args, color=False, terminal_width=None):
+    """Sends the arguments of ``bqdm`` to the server and returns the response."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps({'args': list(args), 'color': color,
+                                   'terminal_width': terminal_width}).encode('utf-8') + b'\n')
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        client.close()
+    return json.loads(data.decode('utf-8'))
+
+
+def main(argv=None):
+    """Runs ``bqdm`` on the server, ``python -m bqdm.server SOCKET [ARGS]...``."""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        sys.stderr.write('Usage: python -m bqdm.server SOCKET [ARGS]...\n')
+        sys.exit(2)
+    response = request(argv[0], argv[1:], color=sys.stdout.isatty(),
+                       terminal_width=_terminal_width())
+    sys.stdout.write(response['output'])
+    if 'error' in response:
+        sys.stderr.write('Error: {0}\n'.format(response['error']))
+    sys.exit(response['exit_code'])
+
+
+if __name__ == '__main__':
+    main()
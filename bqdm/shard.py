@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import codecs
+import hashlib
+import json
+from collections import OrderedDict
+
+PLAN_FORMAT_VERSION = 1
+CHANGE_TYPES = ('add', 'change', 'destroy')
+
+
+def stable_hash(value):
+    """Hash of the string that does not change between processes and Python versions."""
+    return int(hashlib.sha1(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class Shard(object):
+    """The ``index`` th of ``count`` shards of the datasets, counted from 1.
+
+    Datasets are assigned by stable hashing of their IDs. With ``weights``, the
+    table counts of the datasets from a previous run, the weighted datasets are
+    assigned heaviest first to the lightest shard, so that the shards take similar
+    time. Every worker computes the same assignment from the same weights."""
+
+    def __init__(self, index, count, weights=None):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError('Invalid shard: {0}/{1}'.format(index, count))
+        self.index = index
+        self.count = count
+        self._owners = dict()
+        if weights:
+            loads = [0] * count
+            for dataset_id, weight in sorted(weights.items(), key=lambda w: (-w[1], w[0])):
+                owner = min(range(count), key=lambda i: (loads[i], i))
+                loads[owner] += weight
+                self._owners[dataset_id] = owner + 1
+
+    @staticmethod
+    def parse(value, weights=None):
+        index, sep, count = value.partition('/')
+        try:
+            if not sep:
+                raise ValueError()
+            return Shard(int(index), int(count), weights)
+        except ValueError:
+            raise ValueError('Must be INDEX/COUNT, such as 1/4: {0}'.format(value))
+
+    def owner(self, dataset_id):
+        owner = self._owners.get(dataset_id, None)
+        if owner is None:
+            owner = stable_hash(dataset_id) % self.count + 1
+        return owner
+
+    def owns(self, dataset_id):
+        return self.owner(dataset_id) == self.index
+
+    def __str__(self):
+        return '{0}/{1}'.format(self.index, self.count)
+
+
+def load_plan(path):
+    with codecs.open(path, 'rb', 'utf-8') as f:
+        return json.load(f)
+
+
+def load_weights(path):
+    """Returns the weights of the datasets from the plan of a previous run, the number
+    of their tables plus the dataset itself."""
+    return dict((k, v + 1) for k, v in load_plan(path)['tables'].items())
+
+
+def write_json(path, data):
+    with codecs.open(path, 'wb', 'utf-8') as f:
+        f.write(json.dumps(data, indent=2, sort_keys=True))
+        f.write('\n')
+
+
+def make_plan(shard, tables, changes, estimated_bytes=0):
+    """Returns the plan document of a shard.
+
+    ``tables`` is the number of tables of each dataset, ``changes`` is the IDs of the
+    datasets and tables to add, change and destroy."""
+    return OrderedDict([
+        ('version', PLAN_FORMAT_VERSION),
+        ('shard', [shard.index, shard.count] if shard else None),
+        ('tables', dict(tables)),
+        ('changes', dict((t, sorted(changes.get(t, ()))) for t in CHANGE_TYPES)),
+        ('estimated_bytes', estimated_bytes),
+    ])
+
+
+def merge_plans(plans):
+    """Merges the plans of all shards into the plan of the whole run.
+
+    Raises ValueError if a shard is missing or duplicated, or a dataset is planned by
+    more than one shard."""
+    if not plans:
+        raise ValueError('No plans to merge.')
+    for plan in plans:
+        if plan.get('version', None) != PLAN_FORMAT_VERSION:
+            raise ValueError('Unsupported plan format version: {0}'.format(
+                plan.get('version', None)))
+    shards = [tuple(p['shard']) if p['shard'] else None for p in plans]
+    if None in shards:
+        if len(plans) != 1:
+            raise ValueError('A plan without shard cannot be merged with others.')
+    else:
+        counts = set(c for _, c in shards)
+        if len(counts) != 1:
+            raise ValueError('Plans of different shard counts: {0}'.format(
+                ', '.join('{0}/{1}'.format(i, c) for i, c in sorted(shards))))
+        count = counts.pop()
+        indexes = sorted(i for i, _ in shards)
+        if indexes != list(range(1, count + 1)):
+            missing = sorted(set(range(1, count + 1)) - set(indexes))
+            duplicated = sorted(set(i for i in indexes if indexes.count(i) > 1))
+            raise ValueError('Shards missing: {0}, duplicated: {1}'.format(
+                missing or 'none', duplicated or 'none'))
+    tables = dict()
+    for plan in plans:
+        for dataset_id, count in plan['tables'].items():
+            if dataset_id in tables:
+                raise ValueError('Dataset {0} is planned by more than one shard.'.format(
+                    dataset_id))
+            tables[dataset_id] = count
+    changes = dict((t, set()) for t in CHANGE_TYPES)
+    for plan in plans:
+        for t in CHANGE_TYPES:
+            changes[t].update(plan['changes'].get(t, ()))
+    return make_plan(None, tables, changes, sum(p.get('estimated_bytes', 0) for p in plans))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import binascii
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from past.types import unicode
+
+import bqdm
+
+# https://opentelemetry.io/docs/specs/otlp/#json-protobuf-encoding
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_CODE_ERROR = 2
+
+
+def _random_id(size):
+    return binascii.hexlify(os.urandom(size)).decode('ascii')
+
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # 64 bit integers are encoded as strings in OTLP/JSON.
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': unicode(value)}
+
+
+def job_attributes(job):
+    """Returns the span attributes of the finished BigQuery job."""
+    properties = job._properties if job is not None else dict()
+    statistics = properties.get('statistics', dict())
+    attributes = {'bqdm.job_id': properties.get('jobReference', dict()).get('jobId', None)}
+    bytes_processed = statistics.get('query', dict()).get('totalBytesProcessed', None)
+    if bytes_processed is not None:
+        attributes['bqdm.bytes'] = int(bytes_processed)
+    slot_millis = statistics.get('totalSlotMs', None)
+    if slot_millis is not None:
+        attributes['bqdm.slot_ms'] = int(slot_millis)
+    return attributes
+
+
+class Span(object):
+
+    def __init__(self, trace_id, parent_id, name, kind, attributes):
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict((k, v) for k, v in attributes.items() if v is not None)
+        self.start = time.time()
+        self.end = None
+        self.error = None
+
+    def set_attributes(self, attributes):
+        self.attributes.update((k, v) for k, v in attributes.items() if v is not None)
+
+    def increment(self, key, value=1):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(int(self.start * 1e9)),
+            'endTimeUnixNano': str(int(self.end * 1e9)),
+            'attributes': [{'key': k, 'value': _attribute_value(v)}
+                           for k, v in sorted(self.attributes.items())],
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.error is not None:
+            span['status'] = {'code': STATUS_CODE_ERROR, 'message': unicode(self.error)}
+        return span
+
+
+class Tracer(object):
+    """Records spans of the phases and API calls of a run.
+
+    Spans nest under the span open on the same thread. Spans started on a thread of an
+    executor without an open span nest under the root span of the run, so that the spans
+    of all threads form a single trace."""
+
+    def __init__(self):
+        self.enabled = False
+        self._trace_id = _random_id(16)
+        self._root = None
+        self._spans = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        """Disables the tracer and starts a new trace for the next run."""
+        with self._lock:
+            self.enabled = False
+            self._trace_id = _random_id(16)
+            self._root = None
+            self._spans = []
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        if not self.enabled:
+            return None
+        stack = self._stack()
+        return stack[-1] if stack else self._root
+
+    def start(self, name, kind=SPAN_KIND_INTERNAL, root=False, **attributes):
+        parent = self.current()
+        span = Span(self._trace_id, parent.span_id if parent else None, name, kind, attributes)
+        if root:
+            self._root = span
+        self._stack().append(span)
+        return span
+
+    def end(self, span, error=None):
+        span.end = time.time()
+        span.error = error
+        stack = self._stack()
+        if span in stack:
+            stack.remove(span)
+        with self._lock:
+            self._spans.append(span)
+
+    @contextmanager
+    def span(self, name, kind=SPAN_KIND_INTERNAL, **attributes):
+        if not self.enabled:
+            yield None
+            return
+        span = self.start(name, kind, **attributes)
+        try:
+            yield span
+        except Exception as e:
+            self.end(span, e)
+            raise
+        self.end(span)
+
+    def write(self, path):
+        """Writes the finished spans to the file in the OTLP/JSON format."""
+        with self._lock:
+            spans = [s.to_otlp() for s in self._spans]
+        with open(path, 'w') as f:
+            json.dump({'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': 'bqdm'}},
+                    {'key': 'service.version', 'value': {'stringValue': bqdm.__version__}},
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': 'bqdm', 'version': bqdm.__version__},
+                    'spans': spans,
+                }],
+            }]}, f)
+
+
+TRACER = Tracer()
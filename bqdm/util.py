@@ -5,13 +5,17 @@ import codecs
 import difflib
 import functools
 import glob
+import hashlib
 import os
+import re
 import threading
+from collections import OrderedDict
 from concurrent import futures
+from contextlib import contextmanager
 
 import click
-import yaml
-from dateutil.parser import parse
+
+from bqdm.profiler import phase
 
 try:
     from multiprocessing import cpu_count
@@ -21,13 +25,194 @@ except ImportError:
 
 
 def get_parallelism():
-    return (cpu_count() or 1) * 5
+    # Upper bound of the concurrency, the actual limit is adjusted at runtime.
+    return max((cpu_count() or 1) * 5, 32)
 
 
 def as_completed(fs):
     return tuple(f.result() for f in futures.as_completed(fs))
 
 
+class ResultCollector(object):
+    """Waits for every operation and keeps the result of each resource.
+
+    Futures are given as a dict of the future to the ID of the resource it operates on."""
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+
+    def collect(self, fs):
+        for f in futures.as_completed(fs):
+            try:
+                f.result()
+                self.succeeded.append(fs[f])
+            except Exception as e:
+                self.failed.append((fs[f], e))
+
+
+class Timings(object):
+    """Accumulates the wall time spent on each phase of a run across threads."""
+
+    def __init__(self):
+        self._seconds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self._seconds[name] = self._seconds.get(name, 0.0) + seconds
+
+    def items(self):
+        with self._lock:
+            return list(self._seconds.items())
+
+
+def read_resources(path):
+    with codecs.open(path, 'rb', 'utf-8') as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+def write_resources(path, resources):
+    with codecs.open(path, 'wb', 'utf-8') as f:
+        for resource in sorted(resources):
+            f.write(resource + '\n')
+
+
+def chunks(values, size):
+    values = list(values)
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+_thread_local = threading.local()
+_representers_registered = False
+_clients = dict()
+_credentials = dict()
+_credentials_lock = threading.Lock()
+_clients_lock = threading.Lock()
+_confs = dict()
+_confs_lock = threading.Lock()
+
+
+def make_job_id(prefix, run_id, resource, step, salt=''):
+    """Derives the ID of the job of ``step`` on ``resource`` in the run ``run_id``.
+
+    https://cloud.google.com/bigquery/docs/running-jobs#generate-jobid"""
+    digest = hashlib.sha1('\0'.join([run_id, resource, step, salt]).encode('utf-8'))
+    name = re.sub(r'[^a-zA-Z0-9_-]', '_', '{0}{1}_{2}'.format(prefix, resource, step))
+    return '{0}_{1}'.format(name[:1000], digest.hexdigest()[:16])
+
+
+def make_job_labels(labels, run_id, resource, step):
+    """Returns the labels of the job with the run, the resource and the step.
+
+    https://cloud.google.com/bigquery/docs/labels#requirements"""
+    job_labels = dict(labels) if labels else dict()
+    job_labels.update({
+        'bqdm-run-id': run_id,
+        'bqdm-resource': resource,
+        'bqdm-step': step,
+    })
+    return dict((k, re.sub(r'[^a-z0-9_-]', '_', v.lower())[:63])
+                for k, v in job_labels.items())
+
+
+def estimate_throughput(jobs):
+    """Returns the bytes processed per second by the finished query jobs, or None if unknown."""
+    total_bytes, total_seconds = 0, 0.0
+    for job in jobs:
+        processed = getattr(job, 'total_bytes_processed', None)
+        if not processed or not job.started or not job.ended or job.error_result:
+            continue
+        total_bytes += processed
+        total_seconds += (job.ended - job.started).total_seconds()
+    if not total_bytes or total_seconds <= 0:
+        return None
+    return total_bytes / total_seconds
+
+
+def format_bytes(value):
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if abs(value) < 1024.0:
+            break
+        value /= 1024.0
+    else:
+        unit = 'PiB'
+    return '{0:.1f} {1}'.format(value, unit) if unit != 'B' else '{0} B'.format(int(value))
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return '{0}s'.format(seconds)
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return '{0}m{1:02d}s'.format(minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return '{0}h{1:02d}m'.format(hours, minutes)
+
+
+def format_estimate(estimated_bytes, throughput=None):
+    text = 'Migration query processes {0}'.format(format_bytes(estimated_bytes))
+    if throughput:
+        text += ', about {0}'.format(format_duration(estimated_bytes / throughput))
+    return text
+
+
+def list_all(fn):
+    """Returns a function listing all pages of the list method ``fn``, named after it."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return list(fn(*args, **kwargs))
+    return wrapper
+
+
+def get_client(project=None, credential_file=None):
+    """BigQuery client shared by the actions of the process.
+
+    A client is created for each project and the credentials are loaded once for each
+    credential file."""
+    from google.cloud import bigquery
+
+    key = (project, credential_file)
+    with _clients_lock:
+        client = _clients.get(key, None)
+        if client is None:
+            client = _clients[key] = bigquery.Client(project, _get_credentials(credential_file))
+        return client
+
+
+def _get_credentials(credential_file):
+    """Credentials of the service account file, loaded once and shared by the clients of
+    all projects."""
+    from google.oauth2 import service_account
+
+    if not credential_file:
+        return None
+    with _credentials_lock:
+        credentials = _credentials.get(credential_file, None)
+        if credentials is None:
+            credentials = _credentials[credential_file] = \
+                service_account.Credentials.from_service_account_file(credential_file)
+        return credentials
+
+
+def get_api_client(credential_file=None):
+    """BigQuery API discovery client bound to the current thread.
+
+    httplib2, which the discovery client relies on, is not thread-safe."""
+    import googleapiclient.discovery
+
+    api_clients = getattr(_thread_local, 'api_clients', None)
+    if api_clients is None:
+        api_clients = _thread_local.api_clients = dict()
+    api_client = api_clients.get(credential_file, None)
+    if api_client is None:
+        api_client = googleapiclient.discovery.build(
+            'bigquery', 'v2', credentials=_get_credentials(credential_file))
+        api_clients[credential_file] = api_client
+    return api_client
+
+
 def str_representer(dumper, data):
     if '\n' in data:
         return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
@@ -52,20 +237,72 @@ def synchronized(wrapped):
     return _wrapper
 
 
+def _register_representers():
+    """Registers the representers of the models on the first dump, so that yaml and the
+    models are imported only by the commands dumping them."""
+    global _representers_registered
+    if _representers_registered:
+        return
+    import yaml
+    from past.types import unicode
+    from bqdm.model.dataset import BigQueryAccessEntry, BigQueryDataset
+    from bqdm.model.schema import BigQuerySchemaField
+    from bqdm.model.table import BigQueryTable
+
+    yaml.add_representer(str, str_representer)
+    yaml.add_representer(unicode, str_representer)
+    yaml.add_representer(tuple, tuple_representer)
+    yaml.add_representer(BigQueryDataset, BigQueryDataset.represent)
+    yaml.add_representer(BigQueryAccessEntry, BigQueryAccessEntry.represent)
+    yaml.add_representer(BigQueryTable, BigQueryTable.represent)
+    yaml.add_representer(BigQuerySchemaField, BigQuerySchemaField.represent)
+    _representers_registered = True
+
+
 def dump(data):
+    import yaml
+
+    _register_representers()
     return yaml.dump(data, default_flow_style=False, indent=4,
                      allow_unicode=True, canonical=False)
 
 
+def _load_conf(conf, from_dict):
+    """Parses the configuration file, or returns the model parsed before if the file
+    has not been modified since."""
+    import yaml
+
+    stat = os.stat(conf)
+    version = (stat.st_ino, getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size)
+    with _confs_lock:
+        cached = _confs.get(conf, None)
+    if cached and cached[0] == version:
+        return cached[1]
+    with codecs.open(conf, 'rb', 'utf-8') as f:
+        model = from_dict(yaml.safe_load(f))
+    with _confs_lock:
+        _confs[conf] = (version, model)
+    return model
+
+
 def load_dataset(conf):
     from bqdm.model.dataset import BigQueryDataset
 
     echo('Load dataset config: {0}'.format(conf))
-    with codecs.open(conf, 'rb', 'utf-8') as f:
-        return BigQueryDataset.from_dict(yaml.load(f))
+    return _load_conf(conf, BigQueryDataset.from_dict)
 
 
-def list_local_datasets(conf_dir, include_datasets=(), exclude_datasets=()):
+@phase('load')
+def list_local_projects(conf_dir):
+    """Returns the IDs of the projects of the configuration files laid out as
+    ``PROJECT/DATASET.yml`` and ``PROJECT/DATASET/TABLE.yml`` under ``conf_dir``."""
+    if not os.path.exists(conf_dir):
+        raise RuntimeError('Configuration file directory not found.')
+    return sorted(p for p in os.listdir(conf_dir)
+                  if os.path.isdir(os.path.join(conf_dir, p)) and not p.startswith('.'))
+
+
+def list_local_datasets(conf_dir, include_datasets=(), exclude_datasets=(), shard=None):
     if not os.path.exists(conf_dir):
         raise RuntimeError('Configuration file directory not found.')
 
@@ -73,6 +310,8 @@ def list_local_datasets(conf_dir, include_datasets=(), exclude_datasets=()):
     confs = glob.glob(os.path.join(conf_dir, '*.yml'))
     for conf in confs:
         dataset_id = os.path.splitext(os.path.basename(conf))[0]
+        if shard and not shard.owns(dataset_id):
+            continue
         if not include_datasets:
             if dataset_id not in exclude_datasets:
                 datasets.append(load_dataset(conf))
@@ -86,10 +325,10 @@ def load_table(conf):
     from bqdm.model.table import BigQueryTable
 
     echo('Load table config: {0}'.format(conf))
-    with codecs.open(conf, 'rb', 'utf-8') as f:
-        return BigQueryTable.from_dict(yaml.load(f))
+    return _load_conf(conf, BigQueryTable.from_dict)
 
 
+@phase('load')
 def list_local_tables(conf_dir, dataset_id):
     conf_dir = os.path.join(conf_dir, dataset_id)
     if not os.path.exists(conf_dir):
@@ -103,16 +342,64 @@ def list_local_tables(conf_dir, dataset_id):
     return tables
 
 
+@phase('diff')
 def ndiff(source, target):
-    return difflib.ndiff(dump(source).splitlines(),
-                         dump(target).splitlines())
+    # The lines are compared as they are consumed, so within the phase.
+    return list(difflib.ndiff(dump(source).splitlines(),
+                              dump(target).splitlines()))
 
 
 def parse_expires(value):
+    from dateutil.parser import parse
+
     return parse(value)
 
 
+@contextmanager
+def capture_output(lines=None):
+    """Collects the output echoed by the current thread instead of writing it, so that
+    the output of a project run concurrently with others can be written as a block
+    by ``echo_captured``. The tasks submitted through ``CapturingExecutor`` echo into
+    the output of the thread submitting them."""
+    lines = [] if lines is None else lines
+    previous = getattr(_thread_local, 'captured', None)
+    _thread_local.captured = lines
+    try:
+        yield lines
+    finally:
+        _thread_local.captured = previous
+
+
+def _run_captured(lines, fn, *args, **kwargs):
+    with capture_output(lines):
+        return fn(*args, **kwargs)
+
+
+class CapturingExecutor(object):
+    """Executor running the tasks on ``executor`` with the output captured by the thread
+    submitting them."""
+
+    def __init__(self, executor):
+        self._executor = executor
+
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit(with_captured_output(fn), *args, **kwargs)
+
+
+def with_captured_output(fn):
+    """Returns ``fn`` echoing into the output captured by the current thread, if any,
+    on the thread running it."""
+    lines = getattr(_thread_local, 'captured', None)
+    if lines is None:
+        return fn
+    return functools.partial(_run_captured, lines, fn)
+
+
 def _echo(text=None, prefix='', fg=None, no_color=False):
+    captured = getattr(_thread_local, 'captured', None)
+    if captured is not None:
+        captured.append((text, prefix, fg, no_color))
+        return
     if not text:
         click.echo()
     elif no_color:
@@ -122,17 +409,26 @@ def _echo(text=None, prefix='', fg=None, no_color=False):
 
 
 @synchronized
+@phase('render')
 def echo(text=None, prefix='', fg=None, no_color=False):
     _echo(text=text, prefix=prefix, fg=fg, no_color=no_color)
 
 
 @synchronized
+def echo_captured(lines):
+    for text, prefix, fg, no_color in lines:
+        _echo(text=text, prefix=prefix, fg=fg, no_color=no_color)
+
+
+@synchronized
+@phase('render')
 def echo_dump(data, prefix='    ', fg=None, no_color=False):
     for line in dump(data).splitlines():
         _echo(line, prefix=prefix, fg=fg, no_color=no_color)
 
 
 @synchronized
+@phase('render')
 def echo_ndiff(source, target, prefix='    ', fg='yellow', no_color=False):
     diff = ndiff(source, target)
     for d in diff:
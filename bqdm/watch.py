@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import ctypes
+import ctypes.util
+import errno
+import glob
+import os
+import select
+import struct
+import sys
+import time
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def list_conf_files(conf_dir):
+    """Returns the configuration files of the datasets and the tables under ``conf_dir``."""
+    return glob.glob(os.path.join(conf_dir, '*.yml')) + \
+        glob.glob(os.path.join(conf_dir, '*', '*.yml'))
+
+
+def _is_conf_path(path):
+    return path.endswith('.yml') and not os.path.basename(path).startswith('.')
+
+
+class PollingWatcher(object):
+    """Waits for changes of the configuration files by polling their modification times."""
+
+    def __init__(self, conf_dir, interval=0.5):
+        self.conf_dir = conf_dir
+        self.interval = interval
+        self._snapshot = self._stat()
+
+    def _stat(self):
+        # Directories are compared by existence, their modification time changes
+        # with the temporary files of editors.
+        snapshot = dict((p, None) for p in glob.glob(os.path.join(self.conf_dir, '*'))
+                        if os.path.isdir(p))
+        for path in list_conf_files(self.conf_dir):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def wait(self):
+        """Blocks until files are changed and returns their paths."""
+        while True:
+            time.sleep(self.interval)
+            snapshot = self._stat()
+            changed = (set(snapshot) ^ set(self._snapshot)) | set(
+                p for p in set(snapshot) & set(self._snapshot)
+                if snapshot[p] != self._snapshot[p])
+            self._snapshot = snapshot
+            if changed:
+                return sorted(changed)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Waits for changes of the configuration files with inotify(7).
+
+    The events are collected until none arrives for ``settle`` seconds, so that
+    the several events of a single save are returned together."""
+
+    def __init__(self, conf_dir, settle=0.05):
+        self.conf_dir = conf_dir
+        self.settle = settle
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._paths = dict()
+        self._add_watch(conf_dir)
+        for path in glob.glob(os.path.join(conf_dir, '*')):
+            if os.path.isdir(path):
+                self._add_watch(path)
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.path.abspath(path).encode(sys.getfilesystemencoding()), IN_WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        self._paths[wd] = path
+
+    def _read(self, timeout):
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return None
+            raise
+        if not readable:
+            return None
+        return os.read(self._fd, 65536)
+
+    def _parse(self, data, changed):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(
+                sys.getfilesystemencoding())
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events are lost, every file is reported as changed.
+                changed.update(list_conf_files(self.conf_dir))
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            directory = self._paths.get(wd, None)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if directory == self.conf_dir:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._add_watch(path)
+                        changed.update(glob.glob(os.path.join(path, '*.yml')))
+                    changed.add(path)
+            elif _is_conf_path(name):
+                changed.add(path)
+
+    def wait(self):
+        """Blocks until files are changed and returns their paths."""
+        changed = set()
+        while not changed:
+            data = self._read(None)
+            while data:
+                self._parse(data, changed)
+                data = self._read(self.settle)
+        return sorted(changed)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(conf_dir):
+    """Returns the inotify watcher on Linux, and the polling watcher elsewhere."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(conf_dir)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(conf_dir)
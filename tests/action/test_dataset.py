@@ -3,8 +3,11 @@ from __future__ import absolute_import
 
 import unittest
 
+from google.api_core.exceptions import Forbidden
+
 from bqdm.action.dataset import DatasetAction
-from bqdm.model.dataset import BigQueryAccessEntry, BigQueryDataset
+from bqdm.model.dataset import DATASET_RESOURCE_FIELDS, BigQueryAccessEntry, BigQueryDataset
+from tests.util import FakeClient, FakeDiscoveryClient, http_error
 
 
 class TestDatasetAction(unittest.TestCase):
@@ -183,6 +186,49 @@ class TestDatasetAction(unittest.TestCase):
         self.assertEqual(actual_count8, 2)
         self.assertEqual(set(actual_results8), {target_dataset1_1, target_dataset1_2})
 
+    def test_get_change_fields(self):
+        source_dataset = BigQueryDataset(
+            dataset_id='test1',
+            friendly_name='test_friendly_name',
+            description='test_description',
+            location='US',
+            access_entries=(
+                BigQueryAccessEntry('OWNER', 'specialGroup', 'projectOwners'),
+                BigQueryAccessEntry('READER', 'specialGroup', 'projectReaders'),
+            ),
+            labels={'foo': 'bar'},
+            managed=True
+        )
+        target_dataset1 = BigQueryDataset(
+            dataset_id='test1',
+            friendly_name='test_friendly_name',
+            description='test_description',
+            location='EU',
+            access_entries=(
+                BigQueryAccessEntry('READER', 'specialGroup', 'projectReaders'),
+                BigQueryAccessEntry('OWNER', 'specialGroup', 'projectOwners'),
+            ),
+            labels={'foo': 'bar'}
+        )
+        self.assertEqual(DatasetAction.get_change_fields(source_dataset, target_dataset1), [])
+
+        target_dataset2 = BigQueryDataset(
+            dataset_id='test1',
+            friendly_name='test_friendly_name',
+            description='test_description_changed',
+            location='US',
+            access_entries=(
+                BigQueryAccessEntry('OWNER', 'specialGroup', 'projectOwners'),
+            ),
+            labels={'foo': 'baz'}
+        )
+        self.assertEqual(DatasetAction.get_change_fields(source_dataset, target_dataset2),
+                         ['description', 'labels', 'access_entries'])
+
+        source_dataset.managed = False
+        self.assertEqual(DatasetAction.get_change_fields(source_dataset, target_dataset1),
+                         ['labels'])
+
     def test_get_destroy_datasets(self):
         source_dataset1_1 = BigQueryDataset(
             dataset_id='test1',
@@ -318,3 +364,54 @@ class TestDatasetAction(unittest.TestCase):
     # TODO
     # test_list_datasets
     # test_export
+
+    def test_get_dataset(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        api_client = FakeDiscoveryClient({
+            'dataset1': [{
+                'datasetReference': {'projectId': 'test-project', 'datasetId': 'dataset1'},
+                'description': 'foo',
+            }],
+            'dataset2': [http_error(404)],
+        })
+        self.addCleanup(api_client.close)
+        action = DatasetAction(None, project='test-project')
+        self.assertEqual(action.get_dataset('dataset1'),
+                         BigQueryDataset(dataset_id='dataset1', description='foo'))
+        self.assertIsNone(action.get_dataset('dataset2'))
+        self.assertEqual([r.kwargs for r in api_client.requests], [
+            {'projectId': 'test-project', 'datasetId': d, 'fields': DATASET_RESOURCE_FIELDS}
+            for d in ['dataset1', 'dataset2']])
+
+    def test_get_datasets(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        api_client = FakeDiscoveryClient(dict(
+            (d, [{'datasetReference': {'projectId': 'test-project', 'datasetId': d}}])
+            for d in ['dataset1', 'dataset3']))
+        api_client.responses['dataset2'] = [http_error(404)]
+        self.addCleanup(api_client.close)
+        action = DatasetAction(None, project='test-project')
+        self.assertEqual(action.get_datasets(['dataset1', 'dataset2', 'dataset3']), (
+            BigQueryDataset(dataset_id='dataset1'), None, BigQueryDataset(dataset_id='dataset3')))
+        # The datasets are requested in a single batch.
+        self.assertEqual(len(api_client.batches), 1)
+        self.assertEqual([r.kwargs['fields'] for r, _ in api_client.batches[0].requests],
+                         [DATASET_RESOURCE_FIELDS] * 3)
+
+    def test_get_job_throughput(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        action = DatasetAction(None, project='test-project')
+        self.assertIsNone(action.get_job_throughput())
+        self.assertIsNone(action.get_job_throughput())
+        self.assertEqual(client.list_jobs_calls, 1)
+
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        client.list_jobs_error = Forbidden('Access Denied')
+        action = DatasetAction(None, project='test-project')
+        self.assertIsNone(action.get_job_throughput())
+        self.assertIsNone(action.get_job_throughput())
+        self.assertEqual(client.list_jobs_calls, 1)
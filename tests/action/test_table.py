@@ -1,14 +1,25 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import json
+import os
+import re
+import shutil
+import tempfile
 import unittest
 from datetime import datetime
 
+from google.api_core.exceptions import BadRequest, TooManyRequests
 from pytz import UTC
 
 from bqdm.action.table import TableAction
+from bqdm.api import ApiCaller
+from bqdm.journal import Journal
+from bqdm.limiter import ConcurrencyLimiter
 from bqdm.model.schema import BigQuerySchemaField
-from bqdm.model.table import BigQueryTable
+from bqdm.model.table import TABLE_RESOURCE_FIELDS, BigQueryTable
+from bqdm.retry import Retry
+from tests.util import FakeClient, FakeDiscoveryClient, http_error
 
 
 class TestTableAction(unittest.TestCase):
@@ -273,6 +284,71 @@ class TestTableAction(unittest.TestCase):
         self.assertEqual(actual_count5, 0)
         self.assertEqual(actual_results5, ())
 
+    def test_get_change_fields(self):
+        schema_field1 = BigQuerySchemaField(
+            name='test1',
+            field_type='STRING',
+            mode='NULLABLE',
+            description='test_description'
+        )
+        schema_field2 = BigQuerySchemaField(
+            name='test1',
+            field_type='STRING',
+            mode='NULLABLE',
+            description='test_description_changed'
+        )
+        schema_field3 = BigQuerySchemaField(
+            name='test1',
+            field_type='INTEGER',
+            mode='NULLABLE',
+            description='test_description'
+        )
+        source_table = BigQueryTable(
+            table_id='test',
+            description='test_description',
+            schema=(schema_field1, ),
+            labels={'foo': 'bar'}
+        )
+        target_table1 = BigQueryTable(
+            table_id='test',
+            description='test_description',
+            schema=(schema_field1, ),
+            labels={'foo': 'baz'}
+        )
+        self.assertEqual(TableAction.get_change_fields(source_table, target_table1), ['labels'])
+
+        target_table2 = BigQueryTable(
+            table_id='test',
+            friendly_name='test_friendly_name',
+            description='test_description',
+            schema=(schema_field2, ),
+            labels={'foo': 'bar'}
+        )
+        self.assertEqual(TableAction.get_change_fields(source_table, target_table2),
+                         ['friendly_name', 'schema'])
+
+        # The schema is changed by the migration.
+        target_table3 = BigQueryTable(
+            table_id='test',
+            description='test_description',
+            schema=(schema_field3, ),
+            labels={'foo': 'bar'}
+        )
+        self.assertEqual(TableAction.get_change_fields(source_table, target_table3), [])
+
+        source_view = BigQueryTable(
+            table_id='test',
+            view_use_legacy_sql=False,
+            view_query='SELECT * FROM test'
+        )
+        target_view = BigQueryTable(
+            table_id='test',
+            view_use_legacy_sql=False,
+            view_query='SELECT * FROM test',
+            labels={'foo': 'bar'}
+        )
+        self.assertEqual(TableAction.get_change_fields(source_view, target_view), ['labels'])
+
     def test_build_query_field(self):
         source_schema_field1 = BigQuerySchemaField(
             name='test1',
@@ -390,10 +466,212 @@ class TestTableAction(unittest.TestCase):
     # test_destroy
 
     # TODO
-    # test_backup
     # test_select_insert
     # test_create_temporary_table
 
     # TODO
     # test_list_tables
     # test_export
+
+    def test_select_insert_partitions_unpartitioned(self):
+        client = FakeClient('test-project', partitions=['20180101', '__UNPARTITIONED__'])
+        self.addCleanup(client.close)
+        journal = Journal()
+        table_action = TableAction(None, 'test', project='test-project', journal=journal,
+                                   run_id='test-run')
+        step = 'select_insert_temporary_table'
+        table_action._step('test-run', 'test.table1', step,
+                           lambda: table_action._select_insert_partitions(
+                               'test-run', 'test.table1', step, 'table1', 'tmp_table1',
+                               'cast(c1 AS STRING) AS c1'))
+        self.assertEqual(len(client.jobs), 1)
+        job = list(client.jobs.values())[0]
+        self.assertEqual(job.destination.table_id, 'tmp_table1')
+        self.assertNotIn('_PARTITIONTIME', job.query)
+        self.assertEqual(journal.get('test.table1', step)['state'], Journal.DONE)
+        self.assertEqual(journal.get('test.table1', step + '_whole')['attrs']['job_id'],
+                         job.job_id)
+
+    def test_select_insert_adopt_job(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        table_action = TableAction(None, 'test', project='test-project', run_id='test-run')
+        job1 = table_action.select_insert('table1', 'tmp_table1', 'c1', job_id='job1')
+        # A rerun of the same work adopts the job.
+        self.assertIs(table_action.select_insert('table1', 'tmp_table1', 'c1', job_id='job1'),
+                      job1)
+        # The job of the run ID writing to the temporary table of the previous run.
+        self.assertRaises(RuntimeError, table_action.select_insert,
+                          'table1', 'tmp_table2', 'c1', job_id='job1')
+        self.assertRaises(RuntimeError, table_action.select_insert,
+                          'table1', 'tmp_table1', 'c2', job_id='job1')
+        self.assertEqual(list(client.jobs.keys()), ['job1'])
+
+    def test_change_rate_limited(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        client.update_errors.append(TooManyRequests('Exceeded rate limits'))
+        api_caller = ApiCaller(parallelism=8, retry=Retry(initial_delay=0.01, max_delay=0.01))
+        self.assertEqual(api_caller.limit(ConcurrencyLimiter.WRITE), 4)
+        table_action = TableAction(None, 'test', project='test-project', api_caller=api_caller)
+        table_action._change(BigQueryTable(table_id='table1', description='foo'),
+                             BigQueryTable(table_id='table1', description='bar'))
+        # Not retried by the client library, the limit of writes is decreased.
+        self.assertEqual(api_caller.limit(ConcurrencyLimiter.WRITE), 2)
+        self.assertEqual(api_caller.retry.retries, 1)
+        self.assertEqual([(t.table_id, f) for t, f in client.updated],
+                         [('table1', ['description'])])
+
+    def test_backup(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        table_action = TableAction(None, 'test', project='test-project',
+                                   backup_dataset_id='backup', backup_type='snapshot',
+                                   backup_expiration=7)
+        job = table_action.backup('table1', backup_table_id='backup_table1', job_id='job1')
+        self.assertEqual(job.destination.path, '/projects/test-project/datasets/backup/'
+                                               'tables/backup_table1')
+        copy = job.job_config._properties['copy']
+        self.assertEqual(copy['operationType'], 'SNAPSHOT')
+        self.assertEqual(copy['createDisposition'], 'CREATE_IF_NEEDED')
+        self.assertTrue(re.match(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{6}Z$',
+                                 copy['destinationExpirationTime']))
+
+        table_action = TableAction(None, 'test', project='test-project',
+                                   backup_dataset_id='backup')
+        job = table_action.backup('table1', backup_table_id='backup_table2', job_id='job2')
+        copy = job.job_config._properties['copy']
+        self.assertNotIn('operationType', copy)
+        self.assertNotIn('destinationExpirationTime', copy)
+        self.assertEqual(sorted(client.jobs.keys()), ['job1', 'job2'])
+
+    def test_backup_snapshot_fallback(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        client.copy_errors.append(BadRequest('Invalid value for operationType'))
+        table_action = TableAction(None, 'test', project='test-project',
+                                   backup_type='snapshot')
+        job = table_action.backup('table1', backup_table_id='backup_table1', job_id='job1')
+        self.assertEqual(job.job_id, 'job1_copy')
+        self.assertNotIn('operationType', job.job_config._properties['copy'])
+        self.assertEqual(list(client.jobs.keys()), ['job1_copy'])
+
+        # A snapshot job failed after its submission does not fall back.
+        client.failed_job_ids.add('job2')
+        self.assertRaises(RuntimeError, table_action.backup, 'table1',
+                          backup_table_id='backup_table2', job_id='job2')
+        self.assertEqual(sorted(client.jobs.keys()), ['job1_copy', 'job2'])
+
+    def test_migrate_replace(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        journal_path = os.path.join(journal_dir, 'journal')
+        table_action = TableAction(None, 'test', project='test-project',
+                                   migration_mode='replace', journal=Journal(journal_path),
+                                   run_id='test-run')
+        source = BigQueryTable(table_id='table1', schema=(
+            BigQuerySchemaField(name='c1', field_type='INTEGER', mode='NULLABLE'), ))
+        target = BigQueryTable(table_id='table1', schema=(
+            BigQuerySchemaField(name='c1', field_type='STRING', mode='NULLABLE'), ))
+        table_action.migrate(source, target)
+
+        # The data is written once by the query, and copied back without any query.
+        jobs = list(client.jobs.values())
+        self.assertEqual(len(jobs), 2)
+        query_job, copy_job = jobs
+        tmp_table_id = query_job.destination.table_id
+        self.assertNotEqual(tmp_table_id, 'table1')
+        self.assertEqual(copy_job.query, None)
+        self.assertEqual(copy_job.destination.table_id, 'table1')
+        self.assertEqual(copy_job.job_config.write_disposition, 'WRITE_TRUNCATE')
+        self.assertEqual(client.created, [tmp_table_id, 'table1'])
+        self.assertEqual(client.deleted, ['table1', tmp_table_id])
+
+        with open(journal_path) as f:
+            records = [json.loads(line) for line in f]
+        steps = [r['step'] for r in records if r['state'] == Journal.DONE]
+        self.assertEqual(steps, ['create_temporary_table', 'select_insert_temporary_table',
+                                 'destroy', 'add', 'copy', 'destroy_temporary_table'])
+        copy_record = [r for r in records
+                       if r['step'] == 'copy' and r['state'] == Journal.DONE][0]
+        self.assertEqual(copy_record['attrs']['job_id'], copy_job.job_id)
+
+    def test_get_table(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        api_client = FakeDiscoveryClient({
+            'table1': [{
+                'tableReference': {'projectId': 'test-project', 'datasetId': 'test',
+                                   'tableId': 'table1'},
+                'description': 'foo',
+            }],
+            'table2': [http_error(404)],
+        })
+        self.addCleanup(api_client.close)
+        table_action = TableAction(None, 'test', project='test-project')
+        self.assertEqual(table_action.get_table('table1'),
+                         BigQueryTable(table_id='table1', description='foo'))
+        self.assertIsNone(table_action.get_table('table2'))
+        self.assertEqual([r.kwargs for r in api_client.requests], [
+            {'projectId': 'test-project', 'datasetId': 'test', 'tableId': t,
+             'fields': TABLE_RESOURCE_FIELDS} for t in ['table1', 'table2']])
+
+    def test_get_tables(self):
+        client = FakeClient('test-project')
+        self.addCleanup(client.close)
+        api_client = FakeDiscoveryClient(dict(
+            (t, [{'tableReference': {'projectId': 'test-project', 'datasetId': 'test',
+                                     'tableId': t}}]) for t in ['table1', 'table3']))
+        api_client.responses['table2'] = [http_error(404)]
+        self.addCleanup(api_client.close)
+        table_action = TableAction(None, 'test', project='test-project')
+        self.assertEqual(table_action.get_tables(['table1', 'table2', 'table3']), (
+            BigQueryTable(table_id='table1'), None, BigQueryTable(table_id='table3')))
+        # The tables are requested in a single batch.
+        self.assertEqual(len(api_client.batches), 1)
+        self.assertEqual([r.kwargs['fields'] for r, _ in api_client.batches[0].requests],
+                         [TABLE_RESOURCE_FIELDS] * 3)
+
+    def test_get_row_counts(self):
+        client = FakeClient('test-project',
+                            partitions=['20180101', '20180102', '__UNPARTITIONED__'])
+        self.addCleanup(client.close)
+        api_client = FakeDiscoveryClient({
+            'table1': [{'numRows': '3'}],
+            'table1$20180101': [http_error(503), {'numRows': '1'}],
+            'table1$20180102': [{'numRows': '2'}],
+        })
+        self.addCleanup(api_client.close)
+        api_caller = ApiCaller(retry=Retry(initial_delay=0.01, max_delay=0.01))
+        table_action = TableAction(None, 'test', project='test-project', batch_size=1,
+                                   api_caller=api_caller)
+        self.assertEqual(table_action.get_row_counts('table1', 'DAY'), {
+            'num_rows': 3,
+            'partitions': {'20180101': 1, '20180102': 2},
+        })
+        # The partition failed with a transient error is requested again.
+        self.assertEqual([[r.key for r, _ in b.requests] for b in api_client.batches],
+                         [['table1$20180101'], ['table1$20180101'], ['table1$20180102']])
+
+    def test_compare_row_counts(self):
+        self.assertEqual(TableAction.compare_row_counts(
+            {'num_rows': 10, 'partitions': {}},
+            {'num_rows': 10, 'partitions': {}}), [])
+        self.assertEqual(TableAction.compare_row_counts(
+            {'num_rows': 10, 'partitions': {}},
+            {'num_rows': 9, 'partitions': {}}), ['numRows 10 != 9'])
+        self.assertEqual(TableAction.compare_row_counts(
+            {'num_rows': 10, 'partitions': {'20180101': 4, '20180102': 6}},
+            {'num_rows': 10, 'partitions': {'20180101': 4, '20180102': 6}}), [])
+        self.assertEqual(TableAction.compare_row_counts(
+            {'num_rows': 10, 'partitions': {'20180101': 4, '20180102': 6}},
+            {'num_rows': 10, 'partitions': {'20180101': 6, '20180103': 4}}), [
+            'partition 20180101 numRows 4 != 6',
+            'partition 20180102 numRows 6 != 0',
+            'partition 20180103 numRows 0 != 4',
+        ])
+        self.assertEqual(TableAction.compare_row_counts(
+            {'num_rows': 10, 'partitions': {}},
+            {'num_rows': 10, 'partitions': {'20180101': 10}}), [])
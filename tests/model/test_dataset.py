@@ -5,7 +5,8 @@ import unittest
 
 from google.cloud.bigquery import AccessEntry
 
-from bqdm.model.dataset import BigQueryAccessEntry, BigQueryDataset
+from bqdm.model.dataset import (MANAGED_LABEL_KEY, MANAGED_LABEL_VALUE, BigQueryAccessEntry,
+                                BigQueryDataset)
 from tests.util import make_dataset
 
 
@@ -418,6 +419,7 @@ class TestBigQueryDataset(unittest.TestCase):
             'access_entries': None
         })
         self.assertEqual(expected_dataset1, actual_dataset1_1)
+        self.assertFalse(actual_dataset1_1.managed)
         actual_dataset1_2 = BigQueryDataset.from_dict({
             'dataset_id': 'test',
             'friendly_name': 'foo_bar',
@@ -620,6 +622,41 @@ class TestBigQueryDataset(unittest.TestCase):
         ))
         self.assertNotEqual(expected_dataset3, actual_dataset3_2)
 
+        actual_dataset3_3 = BigQueryDataset.from_dataset(make_dataset(
+            project=project,
+            dataset_id='test',
+            friendly_name='test_friendly_name',
+            description='test_description',
+            default_table_expiration_ms=24 * 60 * 60 * 1000,
+            location='US',
+            labels={
+                'foo': 'bar',
+                MANAGED_LABEL_KEY: MANAGED_LABEL_VALUE
+            }
+        ))
+        self.assertEqual(expected_dataset3, actual_dataset3_3)
+        self.assertTrue(actual_dataset3_3.managed)
+
+        expected_dataset4 = BigQueryDataset(
+            dataset_id='test',
+            friendly_name='test_friendly_name',
+            description='test_description',
+            default_table_expiration_ms=24 * 60 * 60 * 1000,
+            location='US'
+        )
+        actual_dataset4 = BigQueryDataset.from_dataset(make_dataset(
+            project=project,
+            dataset_id='test',
+            friendly_name='test_friendly_name',
+            description='test_description',
+            default_table_expiration_ms=24 * 60 * 60 * 1000,
+            location='US',
+            labels={
+                MANAGED_LABEL_KEY: MANAGED_LABEL_VALUE
+            }
+        ))
+        self.assertEqual(expected_dataset4, actual_dataset4)
+
     def test_to_dataset(self):
         project = 'test'
 
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+
+from google.api_core.exceptions import Conflict, NotFound, ServiceUnavailable
+from googleapiclient.errors import HttpError
+
+from bqdm.api import ApiCaller
+from bqdm.retry import Retry
+from tests.util import FakeDiscoveryClient, http_error
+
+
+def fast_retry(max_attempts=5):
+    return Retry(max_attempts=max_attempts, initial_delay=0.01, max_delay=0.01)
+
+
+class TestApiCaller(unittest.TestCase):
+
+    def test_read_batch(self):
+        api_client = FakeDiscoveryClient({
+            'foo': ['foo'],
+            'bar': [http_error(503), http_error(429), 'bar'],
+            'baz': [http_error(404)],
+        })
+        self.addCleanup(api_client.close)
+        results = dict()
+
+        def callback(index, response, exception):
+            results[index] = response if exception is None else exception.resp.status
+
+        caller = ApiCaller(retry=fast_retry())
+        caller.read_batch(api_client, [api_client.tables().get(tableId=t)
+                                       for t in ['foo', 'bar', 'baz']], callback)
+        self.assertEqual(results, {0: 'foo', 1: 'bar', 2: 404})
+        # Only the failed request is executed again.
+        self.assertEqual([[r.key for r, _ in b.requests] for b in api_client.batches],
+                         [['foo', 'bar', 'baz'], ['bar'], ['bar']])
+        self.assertEqual(caller.retry.retries, 2)
+
+    def test_read_batch_error(self):
+        api_client = FakeDiscoveryClient({
+            'foo': [http_error(503), 'foo'],
+            'bar': [http_error(400)],
+        })
+        self.addCleanup(api_client.close)
+
+        def callback(index, response, exception):
+            if exception is not None:
+                raise exception
+
+        caller = ApiCaller(retry=fast_retry())
+        with self.assertRaises(HttpError) as cm:
+            caller.read_batch(api_client, [api_client.tables().get(tableId=t)
+                                           for t in ['foo', 'bar']], callback)
+        self.assertEqual(cm.exception.resp.status, 400)
+        self.assertEqual(len(api_client.batches), 1)
+
+        api_client.responses['foo'] = [http_error(503)]
+        caller = ApiCaller(retry=fast_retry(max_attempts=3))
+        with self.assertRaises(HttpError) as cm:
+            caller.read_batch(api_client, [api_client.tables().get(tableId='foo')], callback)
+        self.assertEqual(cm.exception.resp.status, 503)
+        self.assertEqual(len(api_client.batches), 4)
+
+    def test_create(self):
+        def create_table(table, errors):
+            if errors:
+                raise errors.pop(0)
+            return table
+
+        caller = ApiCaller(retry=fast_retry())
+        self.assertEqual(caller.create('/tables/t1', create_table, 't1', []), 't1')
+        # The first attempt created the table, its response was lost.
+        self.assertIsNone(caller.create('/tables/t1', create_table, 't1', [
+            ServiceUnavailable('Service unavailable'), Conflict('Already Exists')]))
+        self.assertRaises(Conflict, caller.create, '/tables/t1', create_table, 't1', [
+            Conflict('Already Exists')])
+
+    def test_delete(self):
+        def delete_table(table, errors):
+            if errors:
+                raise errors.pop(0)
+
+        caller = ApiCaller(retry=fast_retry())
+        self.assertIsNone(caller.delete('/tables/t1', delete_table, 't1', [
+            ServiceUnavailable('Service unavailable'), NotFound('Not found')]))
+        self.assertRaises(NotFound, caller.delete, '/tables/t1', delete_table, 't1', [
+            NotFound('Not found')])
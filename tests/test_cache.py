@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import time
+import unittest
+
+from bqdm.cache import StateCache
+
+
+class TestStateCache(unittest.TestCase):
+
+    def test_get_or_set(self):
+        cache = StateCache(60)
+        calls = []
+
+        def refresh():
+            calls.append(1)
+            return ['dataset1']
+
+        self.assertEqual(cache.get_or_set(('project', 'datasets'), refresh), ['dataset1'])
+        self.assertEqual(cache.get_or_set(('project', 'datasets'), refresh), ['dataset1'])
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(cache.get(('project', 'tables', 'dataset1')))
+
+    def test_ttl(self):
+        cache = StateCache(0.05)
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('key'))
+
+    def test_clear(self):
+        cache = StateCache(60)
+        cache.set('key1', 'value1')
+        cache.set('key2', 'value2')
+        cache.clear()
+        self.assertIsNone(cache.get('key1'))
+        self.assertIsNone(cache.get('key2'))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import subprocess
+import sys
+import unittest
+
+HEAVY_MODULES = [
+    'yaml',
+    'dateutil',
+    'googleapiclient',
+    'google.cloud.bigquery',
+    'bqdm.action.dataset',
+    'bqdm.action.table',
+    'bqdm.model.table',
+]
+
+
+class TestCli(unittest.TestCase):
+
+    def test_help_lazy_imports(self):
+        # A fresh interpreter, the modules imported by the other tests are not counted.
+        script = '\n'.join([
+            'import sys',
+            'from bqdm.cli import cli',
+            'try:',
+            '    cli.main(["--help"])',
+            'except SystemExit:',
+            '    pass',
+            'print("loaded:" + ",".join(m for m in {0!r} if m in sys.modules))'.format(
+                HEAVY_MODULES),
+        ])
+        output = subprocess.check_output([sys.executable, '-c', script])
+        self.assertEqual(output.decode('utf-8').strip().splitlines()[-1], 'loaded:')
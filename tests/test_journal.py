@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bqdm.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, '.bqdm.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resume(self):
+        journal1 = Journal(self.path)
+        journal1.begin('dataset1.table1', 'migrate', mode='replace')
+        journal1.begin('dataset1.table1', 'create_temporary_table', tmp_table_id='tmp1')
+        journal1.done('dataset1.table1', 'create_temporary_table', tmp_table_id='tmp1')
+        journal1.begin('dataset1.table1', 'select_insert_temporary_table', job_id='job1')
+        journal1.begin('dataset1.table2', 'migrate', mode='drop_create')
+        journal1.finish('dataset1.table2')
+        with open(self.path, 'a') as f:
+            f.write('{"resource": "dataset1.ta')
+
+        journal2 = Journal(self.path)
+        self.assertEqual(journal2.pending(), ['dataset1.table1'])
+        self.assertEqual(journal2.get('dataset1.table1', 'migrate')['attrs'],
+                         {'mode': 'replace'})
+        self.assertEqual(journal2.get('dataset1.table1', 'create_temporary_table')['state'],
+                         Journal.DONE)
+        record = journal2.get('dataset1.table1', 'select_insert_temporary_table')
+        self.assertEqual(record['state'], Journal.BEGIN)
+        self.assertEqual(record['attrs'], {'job_id': 'job1'})
+        self.assertIsNone(journal2.get('dataset1.table1', 'destroy'))
+        self.assertIsNone(journal2.get('dataset1.table2', 'migrate'))
+
+        # The records appended after the torn record are read by the next resume.
+        journal2.done('dataset1.table1', 'select_insert_temporary_table', job_id='job1')
+        journal3 = Journal(self.path)
+        self.assertEqual(
+            journal3.get('dataset1.table1', 'select_insert_temporary_table')['state'],
+            Journal.DONE)
+
+        journal2.close()
+        self.assertTrue(os.path.exists(self.path))
+        journal2.finish('dataset1.table1')
+        journal2.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_in_memory(self):
+        journal = Journal()
+        journal.begin('dataset1.table1', 'migrate', mode='replace')
+        self.assertEqual(journal.pending(), ['dataset1.table1'])
+        journal.finish('dataset1.table1')
+        self.assertEqual(journal.pending(), [])
+        journal.close()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from google.api_core.exceptions import Forbidden, InternalServerError, TooManyRequests
+from googleapiclient.errors import HttpError
+
+from bqdm.limiter import (AdaptiveLimiter, QuotaExceededError, QuotaScheduler, ResourceQuota,
+                          is_rate_limit_error)
+from bqdm.retry import is_retryable_error
+
+
+class TestLimiter(unittest.TestCase):
+
+    def test_is_rate_limit_error(self):
+        self.assertTrue(is_rate_limit_error(TooManyRequests('Too many requests')))
+        self.assertTrue(is_rate_limit_error(Forbidden('Exceeded rate limits', errors=[
+            {'reason': 'rateLimitExceeded'}
+        ])))
+        self.assertFalse(is_rate_limit_error(Forbidden('Access denied', errors=[
+            {'reason': 'accessDenied'}
+        ])))
+        self.assertFalse(is_rate_limit_error(InternalServerError('Backend error')))
+        self.assertFalse(is_rate_limit_error(ValueError('Invalid value')))
+        self.assertFalse(is_rate_limit_error(None))
+
+        self.assertTrue(is_rate_limit_error(HttpError(
+            httplib2.Response({'status': 429}), b'')))
+        self.assertTrue(is_rate_limit_error(HttpError(
+            httplib2.Response({'status': 403}),
+            b'{"error": {"errors": [{"reason": "rateLimitExceeded"}], "code": 403}}')))
+        self.assertFalse(is_rate_limit_error(HttpError(
+            httplib2.Response({'status': 403}),
+            b'{"error": {"errors": [{"reason": "accessDenied"}], "code": 403}}')))
+        self.assertFalse(is_rate_limit_error(HttpError(
+            httplib2.Response({'status': 404}), b'Not Found')))
+
+    def test_adaptive_limiter_increase(self):
+        limiter = AdaptiveLimiter('test', 8, initial_limit=2)
+        self.assertEqual(limiter.limit, 2)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(latency=0.1)
+        self.assertGreater(limiter.limit, 2)
+        for _ in range(1000):
+            limiter.acquire()
+            limiter.release(latency=0.1)
+        self.assertEqual(limiter.limit, 8)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_adaptive_limiter_latency(self):
+        limiter = AdaptiveLimiter('test', 8, initial_limit=2)
+        limiter.acquire()
+        limiter.release(latency=0.1)
+        for _ in range(100):
+            limiter.acquire()
+            limiter.release(latency=1.0)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_adaptive_limiter_decrease(self):
+        limiter = AdaptiveLimiter('test', 16, initial_limit=16)
+        limiter.acquire()
+        limiter.release(rate_limited=True)
+        self.assertEqual(limiter.limit, 8)
+        limiter.acquire()
+        limiter.release(rate_limited=True)
+        self.assertEqual(limiter.limit, 4)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(rate_limited=True)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_resource_quota(self):
+        quota = ResourceQuota(2, 0.2)
+        start = time.time()
+        quota.acquire('/projects/p/datasets/d/tables/t1')
+        quota.acquire('/projects/p/datasets/d/tables/t1')
+        quota.acquire('/projects/p/datasets/d/tables/t2')
+        quota.acquire('/projects/p/datasets/d/tables/t2')
+        self.assertLess(time.time() - start, 0.2)
+        quota.acquire('/projects/p/datasets/d/tables/t1')
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_resource_quota_max_wait(self):
+        quota = ResourceQuota(1, 0.2, max_wait=0.1)
+        start = time.time()
+        quota.acquire('/projects/p/datasets/d/tables/t1')
+        # Never let through past the quota, failed without waiting.
+        self.assertRaises(QuotaExceededError, quota.acquire, '/projects/p/datasets/d/tables/t1')
+        self.assertLess(time.time() - start, 0.1)
+        self.assertTrue(is_retryable_error(QuotaExceededError('Quota exceeded')))
+        time.sleep(0.2)
+        quota.acquire('/projects/p/datasets/d/tables/t1')
+
+    def test_quota_scheduler_submit(self):
+        scheduler = QuotaScheduler(table_quota=(1, 0.2))
+        finished = []
+
+        def update(resource):
+            # The update acquired when the task was started.
+            start = time.time()
+            scheduler.acquire(resource)
+            self.assertLess(time.time() - start, 0.1)
+            finished.append((resource, time.time()))
+
+        t1, t2 = '/projects/p/datasets/d/tables/t1', '/projects/p/datasets/d/tables/t2'
+        with ThreadPoolExecutor(max_workers=1) as e:
+            fs = [scheduler.submit(e, t1, update, t1) for _ in range(3)]
+            fs.append(scheduler.submit(e, t2, update, t2))
+            for f in fs:
+                f.result()
+        self.assertEqual([r for r, _ in finished], [t1, t2, t1, t1])
+        times = [t for r, t in finished if r == t1]
+        self.assertGreaterEqual(times[1] - times[0], 0.2)
+        self.assertGreaterEqual(times[2] - times[1], 0.2)
+
+    def test_quota_scheduler_partition(self):
+        scheduler = QuotaScheduler(table_quota=(1, 0.2), partition_quota=(2, 0.2))
+        start = time.time()
+        scheduler.acquire('/projects/p/datasets/d/tables/t1')
+        scheduler.acquire('/projects/p/datasets/d/tables/t1$20180101')
+        scheduler.acquire('/projects/p/datasets/d/tables/t1$20180102')
+        self.assertLess(time.time() - start, 0.2)
+        scheduler.acquire('/projects/p/datasets/d/tables/t1$20180103')
+        self.assertGreaterEqual(time.time() - start, 0.2)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from future.moves.http.server import BaseHTTPRequestHandler, HTTPServer
+
+from bqdm.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_render(self):
+        metrics = Metrics('test-project')
+        self.assertEqual(metrics.render(), '\n')
+        metrics.set('bqdm_drift', 2, dataset='dataset1', resource='table', type='add')
+        metrics.inc('bqdm_api_calls', method='bigquery.tables.get')
+        metrics.inc('bqdm_api_calls', method='bigquery.tables.get')
+        metrics.set('bqdm_phase_duration_seconds', 0.5, phase='refresh')
+        metrics.set('bqdm_run_duration_seconds', 3.0, command='plan')
+        self.assertEqual(metrics.get('bqdm_api_calls', method='bigquery.tables.get'), 2)
+        self.assertEqual(metrics.render(), '\n'.join([
+            '# HELP bqdm_drift Number of datasets and tables differing from the configuration.',
+            '# TYPE bqdm_drift gauge',
+            'bqdm_drift{dataset="dataset1",project="test-project",resource="table",type="add"} 2',
+            '# HELP bqdm_api_calls Number of BigQuery API calls.',
+            '# TYPE bqdm_api_calls gauge',
+            'bqdm_api_calls{method="bigquery.tables.get",project="test-project"} 2',
+            '# HELP bqdm_phase_duration_seconds Wall time spent in each phase.',
+            '# TYPE bqdm_phase_duration_seconds gauge',
+            'bqdm_phase_duration_seconds{phase="refresh",project="test-project"} 0.5',
+            '# HELP bqdm_run_duration_seconds Wall time of the run.',
+            '# TYPE bqdm_run_duration_seconds gauge',
+            'bqdm_run_duration_seconds{command="plan",project="test-project"} 3',
+        ]) + '\n')
+
+    def test_render_escape(self):
+        metrics = Metrics('test-project')
+        metrics.set('bqdm_api_calls', 1, method='a"b\\c\nd')
+        self.assertIn('method="a\\"b\\\\c\\nd"', metrics.render())
+
+    def test_write_textfile(self):
+        metrics = Metrics('test-project')
+        metrics.set('bqdm_api_retries', 3)
+        path = os.path.join(self.tmp_dir, 'bqdm.prom')
+        metrics.write_textfile(path)
+        metrics.set('bqdm_api_retries', 4)
+        metrics.write_textfile(path)
+        with open(path) as f:
+            self.assertIn('bqdm_api_retries{project="test-project"} 4\n', f.read())
+        self.assertEqual(os.listdir(self.tmp_dir), ['bqdm.prom'])
+
+    def test_push(self):
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                requests.append((self.path, body.decode('utf-8')))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        url = 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+        thread = threading.Thread(target=lambda: [server.handle_request() for _ in range(2)])
+        thread.start()
+        try:
+            metrics = Metrics('test-project')
+            metrics.set('bqdm_api_retries', 1)
+            metrics.push(url)
+            # The metrics of a run of several projects.
+            projects = Metrics(None)
+            projects.set('bqdm_drift', 1, project='project1', dataset='dataset1',
+                         resource='table', type='add')
+            projects.push(url)
+        finally:
+            thread.join()
+            server.server_close()
+        self.assertEqual(requests, [('/metrics/job/bqdm/project/test-project', metrics.render()),
+                                    ('/metrics/job/bqdm', projects.render())])
+        self.assertIn('project="project1"', projects.render())
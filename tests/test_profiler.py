@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from bqdm.model.table import BigQueryTable
+from bqdm.profiler import PROFILER, Profiler, percentile
+from bqdm.util import ndiff
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 50))
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 90), 90)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3, 1, 2], 0), 1)
+        self.assertEqual(percentile([3, 1, 2], 100), 3)
+
+    def test_phase_disabled(self):
+        profiler = Profiler()
+
+        @profiler.phase('load')
+        def load():
+            return 'loaded'
+
+        self.assertEqual(load(), 'loaded')
+        profiler.record_call('bigquery.tables.get', 0.0, 1.0)
+        self.assertEqual(profiler.phases(), [])
+        self.assertEqual(profiler.calls(), [])
+
+    def test_phase_exclusive(self):
+        profiler = Profiler()
+        profiler.enable()
+
+        @profiler.phase('diff')
+        def diff():
+            time.sleep(0.05)
+
+        @profiler.phase('load')
+        def load():
+            diff()
+            return 'loaded'
+
+        self.assertEqual(load(), 'loaded')
+        phases = dict((name, wall) for name, wall, _ in profiler.phases())
+        self.assertEqual(set(phases.keys()), {'load', 'diff'})
+        self.assertGreaterEqual(phases['diff'], 0.05)
+        self.assertLess(phases['load'], 0.05)
+
+    def test_ndiff_phase(self):
+        PROFILER.enable()
+        self.addCleanup(PROFILER.reset)
+        diff = ndiff(BigQueryTable(table_id='table1', description='foo'),
+                     BigQueryTable(table_id='table1', description='bar'))
+        # The lines are compared within the phase, not when the caller consumes them.
+        self.assertIsInstance(diff, list)
+        self.assertIn('- description: foo', diff)
+        self.assertIn('+ description: bar', diff)
+        self.assertEqual([name for name, _, _ in PROFILER.phases()], ['diff'])
+
+    def test_record_call(self):
+        profiler = Profiler()
+        profiler.enable()
+        profiler.record_call('bigquery.tables.get', 0.0, 0.1)
+        profiler.record_call('bigquery.tables.get', 0.0, 0.3)
+        profiler.record_call('bigquery.tables.get', 0.0, 0.2, Exception('error'))
+        profiler.record_call('batch', 0.0, 1.0)
+        calls = profiler.calls()
+        self.assertEqual([c[0] for c in calls], ['batch', 'bigquery.tables.get'])
+        method, count, errors, p50, p90, p99 = calls[1]
+        self.assertEqual(count, 3)
+        self.assertEqual(errors, 1)
+        self.assertAlmostEqual(p50, 0.2)
+        self.assertAlmostEqual(p90, 0.3)
+        self.assertAlmostEqual(p99, 0.3)
+
+    def test_write_trace(self):
+        profiler = Profiler()
+        profiler.enable(trace=True)
+
+        @profiler.phase('refresh')
+        def refresh():
+            now = time.time()
+            profiler.record_call('bigquery.tables.get', now, now + 0.1)
+
+        refresh()
+        path = os.path.join(self.tmp_dir, 'trace.json')
+        profiler.write_trace(path)
+        with open(path) as f:
+            trace = json.load(f)
+        events = trace['traceEvents']
+        self.assertEqual(sorted(e['name'] for e in events), ['bigquery.tables.get', 'refresh'])
+        self.assertTrue(all(e['ph'] == 'X' for e in events))
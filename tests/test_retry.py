@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import socket
+import time
+import unittest
+
+import httplib2
+from google.api_core.exceptions import (BadRequest, Forbidden, InternalServerError, NotFound,
+                                        ServiceUnavailable)
+from googleapiclient.errors import HttpError
+
+from bqdm.retry import Retry, is_retryable_error
+
+
+class TestRetry(unittest.TestCase):
+
+    def test_is_retryable_error(self):
+        self.assertTrue(is_retryable_error(InternalServerError('Internal error')))
+        self.assertTrue(is_retryable_error(ServiceUnavailable('Service unavailable')))
+        self.assertTrue(is_retryable_error(Forbidden('Exceeded rate limits', errors=[
+            {'reason': 'rateLimitExceeded'}
+        ])))
+        self.assertTrue(is_retryable_error(BadRequest('Backend error', errors=[
+            {'reason': 'backendError'}
+        ])))
+        self.assertTrue(is_retryable_error(socket.timeout('timed out')))
+        self.assertTrue(is_retryable_error(HttpError(
+            httplib2.Response({'status': 503}), b'Service Unavailable')))
+        self.assertFalse(is_retryable_error(NotFound('Not found')))
+        self.assertFalse(is_retryable_error(Forbidden('Quota exceeded', errors=[
+            {'reason': 'quotaExceeded'}
+        ])))
+        self.assertFalse(is_retryable_error(HttpError(
+            httplib2.Response({'status': 404}), b'Not Found')))
+        self.assertFalse(is_retryable_error(ValueError('Invalid value')))
+
+    def test_call(self):
+        calls = []
+
+        def fn(value, fail=0):
+            calls.append(value)
+            if len(calls) <= fail:
+                raise ServiceUnavailable('Service unavailable')
+            return value
+
+        retry = Retry(max_attempts=3, initial_delay=0.01, max_delay=0.01)
+        self.assertEqual(retry.call(fn, 'foo'), 'foo')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(retry.retries, 0)
+
+        del calls[:]
+        self.assertEqual(retry.call(fn, 'foo', fail=2), 'foo')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(retry.retries, 2)
+
+        del calls[:]
+        self.assertRaises(ServiceUnavailable, retry.call, fn, 'foo', fail=3)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(retry.retries, 4)
+
+        del calls[:]
+        self.assertRaises(NotFound, retry.call, self._raise, NotFound('Not found'))
+        self.assertEqual(retry.retries, 4)
+
+    def test_deadline(self):
+        retry = Retry(max_attempts=10, initial_delay=1.0, max_delay=1.0, deadline=0.0)
+        self.assertRaises(ServiceUnavailable, retry.call,
+                          self._raise, ServiceUnavailable('Service unavailable'))
+        self.assertEqual(retry.retries, 0)
+
+        retry = Retry(run_deadline=time.time() - 1)
+        self.assertRaises(RuntimeError, retry.call, lambda: 'foo')
+
+    @staticmethod
+    def _raise(exception):
+        raise exception
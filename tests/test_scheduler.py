@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import threading
+import time
+import unittest
+
+from bqdm.scheduler import JobScheduler
+
+
+class Job(object):
+
+    def __init__(self, total_slot_ms):
+        self._properties = {'statistics': {'totalSlotMs': str(total_slot_ms)}}
+
+
+class TestJobScheduler(unittest.TestCase):
+
+    def test_largest_first(self):
+        scheduler = JobScheduler(1)
+        started = []
+        scheduler.acquire()
+
+        def run(priority):
+            with scheduler.slot(priority):
+                started.append(priority)
+
+        threads = [threading.Thread(target=run, args=(p, )) for p in [10, 1000, 100]]
+        for t in threads:
+            t.start()
+        while len(scheduler._waiting[False]) < 3:
+            time.sleep(0.01)
+        scheduler.release()
+        for t in threads:
+            t.join()
+        self.assertEqual(started, [1000, 100, 10])
+        self.assertEqual(scheduler.running, 0)
+
+    def test_max_jobs(self):
+        scheduler = JobScheduler(2)
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+
+        def run():
+            with scheduler.slot():
+                with lock:
+                    state['running'] += 1
+                    state['max'] = max(state['max'], state['running'])
+                time.sleep(0.02)
+                with lock:
+                    state['running'] -= 1
+
+        threads = [threading.Thread(target=run) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(state['max'], 2)
+
+    def test_utilization(self):
+        scheduler = JobScheduler(2)
+        self.assertEqual(scheduler.utilization(), (0, 0.0, 0.0))
+        with scheduler.slot():
+            time.sleep(0.1)
+        scheduler.record(Job(1000))
+        scheduler.record(Job(3000))
+        jobs, slot_seconds, slots = scheduler.utilization()
+        self.assertEqual(jobs, 2)
+        self.assertEqual(slot_seconds, 4.0)
+        self.assertGreater(slots, 0.0)
+        self.assertLess(slots, 40.0)
+
+    def test_batch(self):
+        scheduler = JobScheduler(1)
+        scheduler.acquire()
+        # BATCH jobs do not wait for the slots of interactive jobs.
+        with scheduler.slot(batch=True):
+            self.assertEqual(scheduler.running, 2)
+        scheduler.release()
+
+        job = Job(1000)
+        job._properties['configuration'] = {'query': {'priority': 'BATCH'}}
+        job._properties['statistics'].update({
+            'creationTime': '1514764800000',
+            'startTime': '1514764830000',
+            'endTime': '1514764840000',
+        })
+        scheduler.record(job)
+        self.assertEqual(scheduler.batch_summary(), (1, 30.0))
+
+    def test_max_slots(self):
+        scheduler = JobScheduler(10, max_slots=100)
+        job = Job(60000)
+        job._properties['statistics'].update({
+            'startTime': '1514764800000',
+            'endTime': '1514764801000',
+        })
+        scheduler.record(job)
+        scheduler.acquire()
+        self.assertFalse(scheduler._admissible(False))
+        self.assertTrue(scheduler._admissible(True))
+        scheduler.release()
+        self.assertTrue(scheduler._admissible(False))
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from click.testing import CliRunner
+
+from bqdm.cli import cli
+from bqdm.profiler import PROFILER
+from bqdm.server import make_server, request
+from bqdm.tracing import TRACER
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'bqdm.sock')
+        self.server = make_server(self.socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_output(self):
+        expected = CliRunner().invoke(cli, ['plan', '--help'], prog_name='bqdm',
+                                      terminal_width=78)
+        response = request(self.socket_path, ['plan', '--help'], terminal_width=78)
+        self.assertEqual(response, {'output': expected.output, 'exit_code': 0})
+
+    def test_usage_error(self):
+        response = request(self.socket_path, ['plan', '--no-such-option'])
+        self.assertEqual(response['exit_code'], 2)
+        response = request(self.socket_path, ['serve'])
+        self.assertEqual(response['exit_code'], 2)
+        self.assertIn('Cannot serve from a served command.', response['output'])
+
+    def test_log_output(self):
+        url = 'http://127.0.0.1:9/'
+        response = request(self.socket_path, ['--metrics-push-url', url, 'merge-plans', '--help'])
+        self.assertEqual(response['exit_code'], 0)
+        # Logged by the command, in the output of the request.
+        self.assertIn('Usage: bqdm merge-plans', response['output'])
+        self.assertIn('Failed to push metrics to {0}'.format(url), response['output'])
+
+    def test_invalid_request(self):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(self.socket_path)
+            client.sendall(b'{"args": "plan"}\n')
+            data = client.makefile('rb').readline()
+        finally:
+            client.close()
+        self.assertIn(b'Invalid request', data)
+
+    def test_socket_in_use(self):
+        with self.assertRaises(RuntimeError):
+            make_server(self.socket_path)
+
+    def test_reset_between_requests(self):
+        trace_files = [os.path.join(self.tmp_dir, 'trace{0}.json'.format(i)) for i in range(2)]
+        for trace_file in trace_files:
+            response = request(self.socket_path, [
+                '--debug', '--profile', '--trace-file', trace_file, '--trace-format', 'otlp',
+                'merge-plans', '--help'])
+            self.assertEqual(response['exit_code'], 0)
+        traces = []
+        for trace_file in trace_files:
+            with open(trace_file) as f:
+                spans = json.load(f)['resourceSpans'][0]['scopeSpans'][0]['spans']
+            traces.append((len(spans), set(s['traceId'] for s in spans)))
+        # The second trace has only the spans of the second request.
+        self.assertEqual(traces[0][0], traces[1][0])
+        self.assertEqual(len(traces[1][1]), 1)
+        self.assertNotEqual(traces[0][1], traces[1][1])
+
+        response = request(self.socket_path, ['merge-plans', '--help'])
+        self.assertEqual(response['exit_code'], 0)
+        self.assertFalse(PROFILER.enabled)
+        self.assertEqual(PROFILER.phases(), [])
+        self.assertFalse(TRACER.enabled)
+        self.assertEqual(logging.getLogger('bqdm.cli').level, logging.INFO)
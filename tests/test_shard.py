@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bqdm.shard import Shard, load_plan, load_weights, make_plan, merge_plans, write_json
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse(self):
+        shard = Shard.parse('2/4')
+        self.assertEqual(shard.index, 2)
+        self.assertEqual(shard.count, 4)
+        self.assertEqual(str(shard), '2/4')
+        for value in ['2', '0/4', '5/4', '1/0', 'a/b', '1/2/3']:
+            self.assertRaises(ValueError, Shard.parse, value)
+
+    def test_owns(self):
+        dataset_ids = ['dataset{0}'.format(i) for i in range(100)]
+        shards = [Shard(i, 4) for i in range(1, 5)]
+        owned = [[d for d in dataset_ids if s.owns(d)] for s in shards]
+        self.assertEqual(sorted(sum(owned, [])), sorted(dataset_ids))
+        self.assertTrue(all(owned))
+        # The assignment does not depend on the process.
+        self.assertEqual(Shard(1, 4).owner('dataset1'), 4)
+        self.assertEqual(Shard(1, 4).owner('dataset2'), 1)
+
+    def test_owns_weights(self):
+        weights = {'dataset1': 10, 'dataset2': 6, 'dataset3': 5, 'dataset4': 1}
+        shards = [Shard(i, 2, weights) for i in range(1, 3)]
+        self.assertEqual([d for d in sorted(weights) if shards[0].owns(d)],
+                         ['dataset1', 'dataset4'])
+        self.assertEqual([d for d in sorted(weights) if shards[1].owns(d)],
+                         ['dataset2', 'dataset3'])
+        # Datasets without weight are assigned by hash.
+        self.assertEqual(shards[0].owner('dataset5'), Shard(1, 2).owner('dataset5'))
+
+    def test_merge_plans(self):
+        plans = [
+            make_plan(Shard(1, 2), {'dataset1': 2, 'dataset3': 0},
+                      {'add': ['dataset3'], 'change': ['dataset1.table1']}, 100),
+            make_plan(Shard(2, 2), {'dataset2': 1},
+                      {'destroy': ['dataset2.table1']}, 50),
+        ]
+        merged = merge_plans(plans)
+        self.assertIsNone(merged['shard'])
+        self.assertEqual(merged['tables'], {'dataset1': 2, 'dataset2': 1, 'dataset3': 0})
+        self.assertEqual(merged['changes'], {
+            'add': ['dataset3'],
+            'change': ['dataset1.table1'],
+            'destroy': ['dataset2.table1'],
+        })
+        self.assertEqual(merged['estimated_bytes'], 150)
+
+        path = os.path.join(self.tmp_dir, 'plan.json')
+        write_json(path, merged)
+        self.assertEqual(load_plan(path), merged)
+        self.assertEqual(load_weights(path), {'dataset1': 3, 'dataset2': 2, 'dataset3': 1})
+
+    def test_merge_plans_invalid(self):
+        plan1 = make_plan(Shard(1, 2), {'dataset1': 1}, {})
+        plan2 = make_plan(Shard(2, 2), {'dataset2': 1}, {})
+        self.assertRaises(ValueError, merge_plans, [])
+        self.assertRaises(ValueError, merge_plans, [plan1])
+        self.assertRaises(ValueError, merge_plans, [plan1, plan1, plan2])
+        self.assertRaises(ValueError, merge_plans, [plan1, make_plan(Shard(2, 3), {}, {})])
+        self.assertRaises(ValueError, merge_plans, [plan1, make_plan(None, {}, {})])
+        self.assertRaises(ValueError, merge_plans,
+                          [plan1, make_plan(Shard(2, 2), {'dataset1': 1}, {})])
+        plan2['version'] = 2
+        self.assertRaises(ValueError, merge_plans, [plan1, plan2])
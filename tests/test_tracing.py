@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from bqdm.tracing import SPAN_KIND_CLIENT, STATUS_CODE_ERROR, Tracer, job_attributes
+
+
+class Job(object):
+
+    def __init__(self, properties):
+        self._properties = properties
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled(self):
+        tracer = Tracer()
+        with tracer.span('refresh') as span:
+            self.assertIsNone(span)
+        self.assertIsNone(tracer.current())
+
+    def test_nested(self):
+        tracer = Tracer()
+        tracer.enable()
+        root = tracer.start('plan', root=True)
+        with tracer.span('refresh') as refresh:
+            with tracer.span('bigquery.tables.get', SPAN_KIND_CLIENT) as call:
+                self.assertEqual(call.parent_id, refresh.span_id)
+        self.assertEqual(refresh.parent_id, root.span_id)
+
+        spans = []
+
+        def run():
+            with tracer.span('apply') as span:
+                spans.append(span)
+
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+        # Spans of the threads without an open span nest under the root span.
+        self.assertEqual(spans[0].parent_id, root.span_id)
+        tracer.end(root)
+        self.assertIsNone(tracer.current().parent_id)
+
+    def test_error(self):
+        tracer = Tracer()
+        tracer.enable()
+        with self.assertRaises(RuntimeError):
+            with tracer.span('apply'):
+                raise RuntimeError('error')
+        path = os.path.join(self.tmp_dir, 'trace.json')
+        tracer.write(path)
+        with open(path) as f:
+            span = json.load(f)['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+        self.assertEqual(span['status'], {'code': STATUS_CODE_ERROR, 'message': 'error'})
+
+    def test_write(self):
+        tracer = Tracer()
+        tracer.enable()
+        with tracer.span('refresh'):
+            with tracer.span('bigquery.tables.get', SPAN_KIND_CLIENT,
+                             **{'bqdm.resource': 'dataset1.table1',
+                                'bqdm.job_id': None}) as span:
+                span.increment('bqdm.attempts')
+                span.increment('bqdm.attempts')
+                span.set_attributes({'bqdm.bytes': 1024, 'bqdm.cached': False})
+        path = os.path.join(self.tmp_dir, 'trace.json')
+        tracer.write(path)
+        with open(path) as f:
+            trace = json.load(f)
+        spans = trace['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual([s['name'] for s in spans], ['bigquery.tables.get', 'refresh'])
+        call, refresh = spans
+        self.assertEqual(call['parentSpanId'], refresh['spanId'])
+        self.assertNotIn('parentSpanId', refresh)
+        self.assertEqual(call['traceId'], refresh['traceId'])
+        self.assertEqual(len(call['traceId']), 32)
+        self.assertEqual(len(call['spanId']), 16)
+        self.assertEqual(call['kind'], SPAN_KIND_CLIENT)
+        self.assertLessEqual(int(call['startTimeUnixNano']), int(call['endTimeUnixNano']))
+        self.assertEqual(call['attributes'], [
+            {'key': 'bqdm.attempts', 'value': {'intValue': '2'}},
+            {'key': 'bqdm.bytes', 'value': {'intValue': '1024'}},
+            {'key': 'bqdm.cached', 'value': {'boolValue': False}},
+            {'key': 'bqdm.resource', 'value': {'stringValue': 'dataset1.table1'}},
+        ])
+
+    def test_job_attributes(self):
+        self.assertEqual(job_attributes(Job({
+            'jobReference': {'jobId': 'bqdm_job'},
+            'statistics': {'totalSlotMs': '2000', 'query': {'totalBytesProcessed': '1024'}},
+        })), {'bqdm.job_id': 'bqdm_job', 'bqdm.bytes': 1024, 'bqdm.slot_ms': 2000})
+        self.assertEqual(job_attributes(Job({'jobReference': {'jobId': 'bqdm_copy'}})),
+                         {'bqdm.job_id': 'bqdm_copy'})
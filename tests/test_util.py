@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import os
+import re
+import shutil
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from pytz import UTC
@@ -9,7 +14,9 @@ from pytz import UTC
 from bqdm.model.dataset import BigQueryAccessEntry, BigQueryDataset
 from bqdm.model.schema import BigQuerySchemaField
 from bqdm.model.table import BigQueryTable
-from bqdm.util import dump
+from bqdm.util import (CapturingExecutor, ResultCollector, capture_output, chunks, dump, echo,
+                       estimate_throughput, format_estimate, list_local_projects, load_dataset,
+                       make_job_id, make_job_labels)
 
 
 class TestUtil(unittest.TestCase):
@@ -433,3 +440,128 @@ labels:
 """
         actual_dump_data9 = dump(table9)
         self.assertEqual(expected_dump_data9, actual_dump_data9)
+
+    def test_chunks(self):
+        self.assertEqual(chunks([], 2), [])
+        self.assertEqual(chunks([1, 2, 3], 2), [[1, 2], [3]])
+        self.assertEqual(chunks((i for i in range(4)), 2), [[0, 1], [2, 3]])
+        self.assertEqual(chunks([1, 2, 3], 5), [[1, 2, 3]])
+
+    def test_result_collector(self):
+        def fail(value):
+            raise ValueError(value)
+
+        results = ResultCollector()
+        with ThreadPoolExecutor(max_workers=2) as e:
+            results.collect({
+                e.submit(lambda: 'ok'): 'dataset1',
+                e.submit(fail, 'error'): 'dataset1.table1',
+                e.submit(lambda: None): 'dataset1.table2',
+            })
+        self.assertEqual(sorted(results.succeeded), ['dataset1', 'dataset1.table2'])
+        self.assertEqual(len(results.failed), 1)
+        self.assertEqual(results.failed[0][0], 'dataset1.table1')
+        self.assertIsInstance(results.failed[0][1], ValueError)
+
+    def test_make_job_id(self):
+        job_id = make_job_id('bqdm_', 'run1', 'dataset1.table1', 'select_insert')
+        self.assertEqual(job_id,
+                         make_job_id('bqdm_', 'run1', 'dataset1.table1', 'select_insert'))
+        self.assertTrue(re.match(r'^bqdm_dataset1_table1_select_insert_[0-9a-f]{16}$', job_id))
+        self.assertNotEqual(job_id,
+                            make_job_id('bqdm_', 'run2', 'dataset1.table1', 'select_insert'))
+        self.assertNotEqual(job_id,
+                            make_job_id('bqdm_', 'run1', 'dataset1.table2', 'select_insert'))
+        self.assertNotEqual(job_id,
+                            make_job_id('bqdm_', 'run1', 'dataset1.table1', 'backup'))
+        self.assertNotEqual(job_id,
+                            make_job_id('bqdm_', 'run1', 'dataset1.table1', 'select_insert',
+                                        job_id))
+
+    def test_make_job_labels(self):
+        self.assertEqual(make_job_labels({'team': 'Data'}, 'Run.1', 'dataset1.Table1', 'backup'), {
+            'team': 'data',
+            'bqdm-run-id': 'run_1',
+            'bqdm-resource': 'dataset1_table1',
+            'bqdm-step': 'backup',
+        })
+        self.assertEqual(len(make_job_labels(None, 'r' * 100, 'd.t', 'backup')['bqdm-run-id']),
+                         63)
+
+    def test_estimate_throughput(self):
+        class Job(object):
+            def __init__(self, total_bytes_processed, seconds, error_result=None):
+                self.total_bytes_processed = total_bytes_processed
+                self.started = datetime(2018, 1, 1, tzinfo=UTC)
+                self.ended = datetime(2018, 1, 1, 0, 0, seconds, tzinfo=UTC)
+                self.error_result = error_result
+
+        self.assertIsNone(estimate_throughput([]))
+        self.assertIsNone(estimate_throughput([Job(0, 10)]))
+        self.assertEqual(estimate_throughput([Job(100, 10), Job(300, 10)]), 20.0)
+        self.assertEqual(estimate_throughput([
+            Job(100, 10), Job(300, 10, error_result={'reason': 'invalidQuery'})]), 10.0)
+
+    def test_format_estimate(self):
+        self.assertEqual(format_estimate(512), 'Migration query processes 512 B')
+        self.assertEqual(format_estimate(3 * 1024 ** 3, 1024 ** 3 / 60.0),
+                         'Migration query processes 3.0 GiB, about 3m00s')
+        self.assertEqual(format_estimate(2 * 1024 ** 5, 1024 ** 4 / 2.0),
+                         'Migration query processes 2.0 PiB, about 1h08m')
+
+    def test_load_dataset_cache(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            conf = os.path.join(tmp_dir, 'test1.yml')
+            with open(conf, 'w') as f:
+                f.write('dataset_id: test1\ndescription: test_description\n')
+            dataset1 = load_dataset(conf)
+            self.assertIs(load_dataset(conf), dataset1)
+            with open(conf, 'w') as f:
+                f.write('dataset_id: test1\ndescription: test_description_changed\n')
+            os.utime(conf, (0, 0))
+            dataset2 = load_dataset(conf)
+            self.assertIsNot(dataset2, dataset1)
+            self.assertEqual(dataset2.description, 'test_description_changed')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_list_local_projects(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for path in ['project2/dataset1', 'project1', '.git']:
+                os.makedirs(os.path.join(tmp_dir, path))
+            with open(os.path.join(tmp_dir, 'dataset1.yml'), 'w') as f:
+                f.write('dataset_id: dataset1\n')
+            self.assertEqual(list_local_projects(tmp_dir), ['project1', 'project2'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_capture_output(self):
+        def run(i):
+            with capture_output() as lines:
+                echo('project{0}'.format(i), prefix='  ')
+                echo()
+            return lines
+
+        with ThreadPoolExecutor(max_workers=2) as e:
+            captured = list(e.map(run, range(2)))
+        self.assertEqual(captured, [[('project0', '  ', None, False), (None, '', None, False)],
+                                    [('project1', '  ', None, False), (None, '', None, False)]])
+
+    def test_capture_output_executor(self):
+        with ThreadPoolExecutor(max_workers=2) as e:
+            executor = CapturingExecutor(e)
+
+            def run(i):
+                with capture_output() as lines:
+                    echo('project{0}'.format(i))
+                    executor.submit(echo, 'task{0}'.format(i)).result()
+                return lines
+
+            with ThreadPoolExecutor(max_workers=2) as drivers:
+                captured = list(drivers.map(run, range(2)))
+            # Outside of the capture, tasks echo as usual.
+            self.assertIsNone(executor.submit(lambda: None).result())
+        self.assertEqual(captured, [[('project0', '', None, False), ('task0', '', None, False)],
+                                    [('project1', '', None, False), ('task1', '', None, False)]])
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import click
+
+from bqdm import watch
+from bqdm.api import ApiCaller
+from bqdm.cli import _watch_plan, cli
+from bqdm.model.table import BigQueryTable
+from bqdm.util import capture_output
+from bqdm.watch import InotifyWatcher, PollingWatcher
+from tests.util import FakeClient
+
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.conf_dir, 'dataset1'))
+        self.write('dataset1.yml', 'dataset_id: dataset1\n')
+        self.write(os.path.join('dataset1', 'table1.yml'), 'table_id: table1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.conf_dir)
+
+    def write(self, path, content):
+        with open(os.path.join(self.conf_dir, path), 'w') as f:
+            f.write(content)
+
+    def path(self, *paths):
+        return os.path.join(self.conf_dir, *paths)
+
+    def assert_watch(self, watcher):
+        try:
+            self.write(os.path.join('dataset1', 'table1.yml'), 'table_id: table1\n'
+                                                               'description: test\n')
+            self.write(os.path.join('dataset1', '.table1.yml.swp'), '')
+            self.assertEqual(watcher.wait(), [self.path('dataset1', 'table1.yml')])
+
+            os.remove(self.path('dataset1.yml'))
+            self.assertEqual(watcher.wait(), [self.path('dataset1.yml')])
+
+            os.mkdir(self.path('dataset2'))
+            self.assertEqual(watcher.wait(), [self.path('dataset2')])
+            self.write(os.path.join('dataset2', 'table1.yml'), 'table_id: table1\n')
+            self.assertEqual(watcher.wait(), [self.path('dataset2', 'table1.yml')])
+        finally:
+            watcher.close()
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is available on Linux.')
+    def test_inotify(self):
+        self.assert_watch(InotifyWatcher(self.conf_dir))
+
+    def test_polling(self):
+        self.assert_watch(PollingWatcher(self.conf_dir, interval=0.05))
+
+
+class FakeWatcher(object):
+    """Watcher writing each of ``changes`` in turn, interrupted after the last one."""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+
+    def wait(self):
+        if not self.changes:
+            raise KeyboardInterrupt()
+        path, content = self.changes.pop(0)
+        with open(path, 'w') as f:
+            f.write(content)
+        return [path]
+
+    def close(self):
+        pass
+
+
+class TestWatchPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.conf_dir, 'dataset1'))
+        self.create_watcher = watch.create_watcher
+        self.client = FakeClient('test-project')
+
+    def tearDown(self):
+        self.client.close()
+        watch.create_watcher = self.create_watcher
+        shutil.rmtree(self.conf_dir)
+
+    def test_error(self):
+        path = os.path.join(self.conf_dir, 'dataset1', 'table1.yml')
+        watch.create_watcher = lambda conf_dir: FakeWatcher([
+            (path, 'table_id: [table1\n'),
+            (path, 'table_id: table1\ndescription: bar\n'),
+        ])
+        ctx = click.Context(cli, obj={
+            'project': 'test-project',
+            'credential_file': None,
+            'color': False,
+            'debug': False,
+            'parallelism': 1,
+            'batch_size': 50,
+            'api_caller': ApiCaller(),
+            'state_cache': None,
+            'server': False,
+        })
+        table = BigQueryTable(table_id='table1', description='foo')
+        with capture_output() as lines:
+            _watch_plan(ctx, self.conf_dir, (), (), None, [], [],
+                        {'dataset1': [table]}, {'dataset1': [table]})
+        output = [text for text, _, _, _ in lines if text]
+        # The invalid file does not end the watch, the fixed file is planned.
+        self.assertTrue(any(o.startswith('Failed to plan the changes') for o in output))
+        self.assertIn('Plan: 0 to add, 1 to change, 0 to destroy', output)
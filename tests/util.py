@@ -5,7 +5,7 @@ import functools
 import os
 
 from google.cloud import bigquery
-from google.cloud.bigquery import Dataset, DatasetReference, Table, TableReference
+from google.cloud.bigquery import DEFAULT_RETRY, Dataset, DatasetReference, Table, TableReference
 
 
 class Env(object):
@@ -61,3 +61,203 @@ def make_table(project, dataset_id, table_id, friendly_name=None, description=No
     if labels is not None:
         table.labels = labels
     return table
+
+
+class FakeJob(object):
+
+    def __init__(self, job_id, query=None, destination=None, job_config=None):
+        self.job_id = job_id
+        self.query = query
+        self.destination = destination
+        self.job_config = job_config
+        self.state = 'DONE'
+        self.error_result = None
+        self.errors = None
+        self._properties = dict()
+
+    def result(self):
+        return self
+
+
+def _check_retry(retry):
+    # The calls are retried by ApiCaller, not by the client library.
+    assert retry is None, 'The call is retried by the client library.'
+
+
+class FakeClient(object):
+    """Client of BigQuery recording the jobs started, for the actions run without BigQuery.
+
+    Registered as the client of ``project`` shared by the actions until ``close``."""
+
+    def __init__(self, project, partitions=()):
+        from bqdm import util
+
+        self.project = project
+        self.partitions = list(partitions)
+        self.jobs = dict()
+        self.list_jobs_calls = 0
+        self.list_jobs_error = None
+        self.updated = []
+        self.update_errors = []
+        self.copy_errors = []
+        self.created = []
+        self.deleted = []
+        self.failed_job_ids = set()
+        self._client = util._clients.get((project, None), None)
+        util._clients[(project, None)] = self
+
+    def dataset(self, dataset_id):
+        return DatasetReference(self.project, dataset_id)
+
+    def get_dataset(self, dataset_ref, retry=DEFAULT_RETRY):
+        _check_retry(retry)
+        return Dataset(dataset_ref)
+
+    def create_table(self, table):
+        self.created.append(table.table_id)
+        return table
+
+    def delete_table(self, table, retry=DEFAULT_RETRY):
+        _check_retry(retry)
+        self.deleted.append(table.table_id)
+
+    def update_table(self, table, fields, retry=DEFAULT_RETRY):
+        _check_retry(retry)
+        if self.update_errors:
+            raise self.update_errors.pop(0)
+        self.updated.append((table, fields))
+        return table
+
+    def list_partitions(self, table_ref, retry=DEFAULT_RETRY):
+        _check_retry(retry)
+        return self.partitions
+
+    def query(self, query, job_config=None, job_id=None, retry=DEFAULT_RETRY):
+        from google.api_core.exceptions import Conflict
+
+        _check_retry(retry)
+        if job_id in self.jobs:
+            raise Conflict('Already Exists: Job {0}'.format(job_id))
+        job = self.jobs[job_id] = FakeJob(job_id, query, job_config.destination, job_config)
+        return job
+
+    def copy_table(self, sources, destination, job_id=None, job_config=None,
+                   retry=DEFAULT_RETRY):
+        from google.api_core.exceptions import Conflict
+
+        _check_retry(retry)
+        if self.copy_errors:
+            raise self.copy_errors.pop(0)
+        if job_id in self.jobs:
+            raise Conflict('Already Exists: Job {0}'.format(job_id))
+        job = self.jobs[job_id] = FakeJob(job_id, destination=destination,
+                                          job_config=job_config)
+        if job_id in self.failed_job_ids:
+            job.error_result = {'reason': 'backendError'}
+            job.errors = [job.error_result]
+        return job
+
+    def get_job(self, job_id, retry=DEFAULT_RETRY):
+        _check_retry(retry)
+        return self.jobs[job_id]
+
+    def list_jobs(self, max_results=None, state_filter=None, retry=DEFAULT_RETRY):
+        _check_retry(retry)
+        self.list_jobs_calls += 1
+        if self.list_jobs_error:
+            raise self.list_jobs_error
+        return list(self.jobs.values())[:max_results]
+
+    def close(self):
+        from bqdm import util
+
+        if self._client is None:
+            util._clients.pop((self.project, None), None)
+        else:
+            util._clients[(self.project, None)] = self._client
+
+
+class FakeRequest(object):
+
+    def __init__(self, client, key, kwargs):
+        self._client = client
+        self.key = key
+        self.kwargs = kwargs
+
+    def execute(self):
+        self._client.requests.append(self)
+        responses = self._client.responses[self.key]
+        response = responses.pop(0) if len(responses) > 1 else responses[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class FakeBatch(object):
+
+    def __init__(self, client, callback):
+        self._client = client
+        self._callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self):
+        for request, request_id in self.requests:
+            try:
+                response = request.execute()
+            except Exception as e:
+                self._callback(request_id, None, e)
+            else:
+                self._callback(request_id, response, None)
+
+
+class FakeResource(object):
+
+    def __init__(self, client, key_field):
+        self._client = client
+        self._key_field = key_field
+
+    def get(self, **kwargs):
+        return FakeRequest(self._client, kwargs[self._key_field], kwargs)
+
+
+class FakeDiscoveryClient(object):
+    """Discovery client of BigQuery answering ``datasets().get`` and ``tables().get`` with
+    ``responses`` by dataset ID or table ID, a response or an exception for each request
+    in turn, the last one repeated.
+
+    Registered as the discovery client of the current thread until ``close``."""
+
+    def __init__(self, responses):
+        from bqdm import util
+
+        self.responses = responses
+        self.requests = []
+        self.batches = []
+        self._api_clients = getattr(util._thread_local, 'api_clients', None)
+        util._thread_local.api_clients = {None: self}
+
+    def datasets(self):
+        return FakeResource(self, 'datasetId')
+
+    def tables(self):
+        return FakeResource(self, 'tableId')
+
+    def new_batch_http_request(self, callback):
+        batch = FakeBatch(self, callback)
+        self.batches.append(batch)
+        return batch
+
+    def close(self):
+        from bqdm import util
+
+        util._thread_local.api_clients = self._api_clients
+
+
+def http_error(status):
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    return HttpError(httplib2.Response({'status': status}), b'')